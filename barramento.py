@@ -0,0 +1,270 @@
+import selectors
+import socket
+
+from diario import log
+from servidor import FilaSaida, irc_lower, split_prefixed
+
+# Barramento local do modo com vários processos (servidor.py --workers N).
+# O processo principal roda o Barramento; cada worker mantém duas conexões Unix com ele:
+#  - controle: pedidos síncronos de reserva de nick ("CLAIM <antigo|*> <novo>"), respondidos com OK/NO
+#  - eventos: as próprias linhas IRC (:nick JOIN/PART/QUIT/NICK/PRIVMSG) nos dois sentidos
+# O barramento sabe quem é dono de cada nick e em quais workers cada canal tem membros.
+# Mudanças de estado (JOIN/PART/QUIT/NICK) vão para todos os workers, para que cada um
+# conheça os membros remotos dos canais; PRIVMSG vai só para os workers com membros no canal.
+
+# Limite da fila de saída do worker para o barramento (o barramento não pode ser descartado)
+BUS_SENDQ = 64 * 1024 * 1024
+
+
+# Uma das conexões de um worker com o barramento
+class ConexaoWorker:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.kind = None    # "ctl" ou "evt", definido pelo HELLO
+        self.worker = None
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+
+class Barramento:
+
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(64)
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.workers = {}        # id do worker -> ConexaoWorker de eventos
+        self.nicks = {}          # irc_lower(nick) -> (id do worker dono, nick)
+        self.user_channels = {}  # irc_lower(nick) -> conjunto de irc_lower(canal)
+        self.channels = {}       # irc_lower(canal) -> {id do worker: conjunto de irc_lower(nick)}
+
+    def close(self):
+        self.selector.close()
+        self.sock.close()
+
+    def run(self):
+        while True:
+            for key, events in self.selector.select():
+                if key.fileobj is self.sock:
+                    self.accept()
+                    continue
+                conn = key.data
+                if events & selectors.EVENT_READ:
+                    self.read(conn)
+                if events & selectors.EVENT_WRITE and conn.sock.fileno() != -1:
+                    self.flush(conn)
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            conn = ConexaoWorker(sock)
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+
+    def read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.drop(conn)
+            return
+        conn.inbuf += data
+        while True:
+            end = conn.inbuf.find(b"\n")
+            if end < 0:
+                break
+            line = bytes(conn.inbuf[:end + 1])
+            del conn.inbuf[:end + 1]
+            if conn.kind is None:
+                _, worker, kind = line.split()
+                conn.worker, conn.kind = int(worker), kind.decode()
+                if conn.kind == "evt":
+                    self.workers[conn.worker] = conn
+            elif conn.kind == "ctl":
+                self.handle_claim(conn, line)
+            else:
+                self.handle_event(conn.worker, line)
+
+    # Escrita não bloqueante: um worker ocupado nunca trava o barramento
+    def send(self, conn, data):
+        if conn.outbuf:
+            conn.outbuf += data
+            return
+        try:
+            sent = conn.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            return
+        if sent < len(data):
+            conn.outbuf += data[sent:]
+            self.selector.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+
+    def flush(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except BlockingIOError:
+            return
+        except OSError:
+            sent = len(conn.outbuf)
+        del conn.outbuf[:sent]
+        if not conn.outbuf:
+            self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+
+    def handle_claim(self, conn, line):
+        parts = line.split()
+        if len(parts) != 3 or parts[0] != b"CLAIM":
+            self.send(conn, b"NO\n")
+            return
+        old, nick = parts[1].decode(), parts[2].decode()
+        owner = self.nicks.get(irc_lower(nick))
+        if owner is not None and owner[0] != conn.worker:
+            self.send(conn, b"NO\n")
+            return
+        if old != "*" and self.nicks.get(irc_lower(old), (None,))[0] == conn.worker:
+            del self.nicks[irc_lower(old)]
+        self.nicks[irc_lower(nick)] = (conn.worker, nick)
+        self.send(conn, b"OK\n")
+
+    # Atualiza o estado global e repassa a linha aos workers interessados
+    def handle_event(self, worker, line):
+        nick, cmd, target = split_prefixed(line)
+        if cmd is None:
+            return
+        key = irc_lower(nick)
+        if cmd == b"PRIVMSG":
+            members = self.channels.get(irc_lower(target), {})
+            for other in members:
+                if other != worker and other in self.workers:
+                    self.send(self.workers[other], line)
+            return
+        if cmd == b"JOIN":
+            chan = irc_lower(target)
+            self.channels.setdefault(chan, {}).setdefault(worker, set()).add(key)
+            self.user_channels.setdefault(key, set()).add(chan)
+        elif cmd == b"PART":
+            self.leave(worker, key, irc_lower(target))
+        elif cmd == b"QUIT":
+            for chan in list(self.user_channels.get(key, ())):
+                self.leave(worker, key, chan)
+            if self.nicks.get(key, (None,))[0] == worker:
+                del self.nicks[key]
+        elif cmd == b"NICK":
+            new = irc_lower(target)
+            chans = self.user_channels.pop(key, set())
+            for chan in chans:
+                members = self.channels[chan][worker]
+                members.discard(key)
+                members.add(new)
+            if chans:
+                self.user_channels[new] = chans
+        self.relay(worker, line)
+
+    def relay(self, origin, line):
+        for other, conn in self.workers.items():
+            if other != origin:
+                self.send(conn, line)
+
+    def leave(self, worker, key, chan):
+        members = self.channels.get(chan, {})
+        nicks = members.get(worker)
+        if nicks is not None:
+            nicks.discard(key)
+            if not nicks:
+                del members[worker]
+        if not members:
+            self.channels.pop(chan, None)
+        chans = self.user_channels.get(key)
+        if chans is not None:
+            chans.discard(chan)
+            if not chans:
+                del self.user_channels[key]
+
+    # Um worker caiu: os usuários dele saem da rede para os outros workers
+    def drop(self, conn):
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+        if conn.kind != "evt" or self.workers.get(conn.worker) is not conn:
+            return
+        del self.workers[conn.worker]
+        log.warning("barramento", "Worker desconectou do barramento", worker=conn.worker)
+        for owner, nick in list(self.nicks.values()):
+            if owner == conn.worker:
+                self.handle_event(conn.worker, f":{nick} QUIT :worker {conn.worker} encerrado\r\n".encode("utf-8"))
+        for chan, members in list(self.channels.items()):
+            if members.pop(conn.worker, None) is not None and not members:
+                del self.channels[chan]
+
+
+# Lado do worker: é a "ligação" do Servidor com o resto da rede. Usuários remotos
+# apontam para ela, e o Servidor manda por aqui uma única cópia de cada linha
+class LigacaoBarramento:
+
+    introduces_users = False # Os nicks são reservados no barramento (CLAIM), não anunciados
+
+    def __init__(self, server, path, worker_id):
+        self.server = server
+        self.addr = ("barramento", worker_id)
+        self.worker_id = worker_id
+        self.buffer = bytearray()
+        self.quit_reason = None
+        self.ctl = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.ctl.connect(path)
+        self.ctl.sendall(f"HELLO {worker_id} ctl\n".encode())
+        self.ctl_file = self.ctl.makefile("rb")
+        self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.conn.connect(path)
+        self.conn.sendall(f"HELLO {worker_id} evt\n".encode())
+        self.conn.setblocking(False)
+        self.fila = FilaSaida(self, soft=BUS_SENDQ, hard=BUS_SENDQ)
+
+    # Chamado pelo Servidor quando o laço de eventos já existe
+    def start(self):
+        self.server.loop.add_reader(self.conn.fileno(), self.read)
+
+    def send_bytes(self, data, droppable=False):
+        return self.fila.put(data)
+
+    # Reserva um nick em toda a rede; ida e volta síncrona por um socket Unix local
+    def claim(self, old, new):
+        try:
+            self.ctl.sendall(f"CLAIM {old or '*'} {new}\n".encode("utf-8"))
+            return self.ctl_file.readline().strip() == b"OK"
+        except OSError as e:
+            log.error("barramento", "Erro ao reservar nick", nick=new, erro=e)
+            return False
+
+    def read(self):
+        try:
+            data = self.conn.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.evict("Barramento encerrado")
+            return
+        self.buffer += data
+        start = 0
+        while True:
+            end = self.buffer.find(b"\n", start)
+            if end < 0:
+                break
+            self.server.handle_remote(self, bytes(self.buffer[start:end + 1]))
+            start = end + 1
+        del self.buffer[:start]
+
+    # Sem o barramento o worker não consegue garantir nicks únicos: encerra o worker
+    def evict(self, reason):
+        log.error("barramento", "Worker encerrado", worker=self.worker_id, motivo=reason)
+        self.server.stop()
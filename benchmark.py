@@ -0,0 +1,1743 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+# Ferramenta de medição do servidor IRC.
+# Cada subcomando sobe o servidor.py em um processo separado (quando necessário)
+# e mede o seu comportamento a partir deste processo.
+
+
+# Lê informações de memória e threads de um processo em /proc (somente Linux)
+def process_status(pid):
+    info = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "Threads"):
+                info[key] = int(value.split()[0])
+    return info
+
+
+def start_server(port, mode, extra=()):
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "servidor.py"),
+           "--porta", str(port), "--modo", mode, *extra]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Aguarda o servidor começar a aceitar conexões
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"Servidor no modo {mode} não iniciou na porta {port}")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+# Abre n conexões e registra cada uma com NICK/USER; devolve a lista de sockets
+def open_clients(n, port, prefix="b"):
+    sockets = []
+    for i in range(n):
+        s = socket.create_connection(("127.0.0.1", port))
+        s.sendall(f"NICK {prefix}{i}\r\nUSER {prefix}{i} 0 = bot {i}\r\n".encode("utf-8"))
+        sockets.append(s)
+    return sockets
+
+
+# Lê de todos os sockets até que cada um tenha recebido `count` ocorrências de `token`
+def wait_for(sockets, token, count=1, timeout=30):
+    sel = selectors.DefaultSelector()
+    pending = {}
+    for s in sockets:
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ)
+        pending[s] = [count, b""]
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        for key, _ in sel.select(0.5):
+            s = key.fileobj
+            try:
+                data = s.recv(65536)
+            except BlockingIOError:
+                continue
+            state = pending.get(s)
+            if state is None:
+                continue
+            state[1] += data
+            found = state[1].count(token)
+            if found:
+                state[0] -= found
+                state[1] = state[1][state[1].rfind(token) + len(token):]
+            if state[0] <= 0 or not data:
+                del pending[s]
+                sel.unregister(s)
+    sel.close()
+    for s in sockets:
+        s.setblocking(True)
+    return len(pending)
+
+
+# Compara o modo com threads e o modo asyncio: quantas conexões ficam abertas,
+# quanta memória o servidor usa e quanto tempo leva uma rodada de PING em todas elas
+def bench_conexoes(args):
+    results = []
+    for i, mode in enumerate(args.modos):
+        port = args.porta + i
+        proc = start_server(port, mode)
+        try:
+            base = process_status(proc.pid)
+            start = time.time()
+            sockets = open_clients(args.conexoes, port)
+            missing = wait_for(sockets, b" 376 ")
+            connect_time = time.time() - start
+            time.sleep(0.5)
+            idle = process_status(proc.pid)
+
+            # Fase "tagarela": todas as conexões enviam PING ao mesmo tempo
+            start = time.time()
+            for s in sockets:
+                s.sendall(b"PING :bench\r\n")
+            missing += wait_for(sockets, b"PONG")
+            ping_time = time.time() - start
+
+            for s in sockets:
+                s.close()
+            results.append({
+                "modo": mode,
+                "conexoes": len(sockets) - missing,
+                "threads": idle["Threads"],
+                "rss_kb": idle["VmRSS"],
+                "kb_por_conexao": (idle["VmRSS"] - base["VmRSS"]) / max(len(sockets), 1),
+                "registro_s": connect_time,
+                "rodada_ping_s": ping_time,
+            })
+        finally:
+            stop_server(proc)
+
+    print(f"{'modo':<8} {'conexões':>9} {'threads':>8} {'RSS (KiB)':>10} {'KiB/conn':>9} {'registro (s)':>13} {'PING (s)':>9}")
+    for r in results:
+        print(f"{r['modo']:<8} {r['conexoes']:>9} {r['threads']:>8} {r['rss_kb']:>10} "
+              f"{r['kb_por_conexao']:>9.1f} {r['registro_s']:>13.2f} {r['rodada_ping_s']:>9.2f}")
+    return results
+
+
+# Bot assíncrono: registra, entra em um canal e conta as linhas PRIVMSG recebidas.
+# Com `latencies` (lista), guarda a latência das PRIVMSG que terminam com uma marca
+# de tempo em ns (perf_counter_ns de quem enviou, no mesmo processo)
+class Bot:
+
+    def __init__(self, nick, channel, latencies=None):
+        self.nick = nick
+        self.channel = channel
+        self.received = 0
+        self.latencies = latencies
+        self.pongs = []  # Latência (ns) de cada PING enviado com ping()
+        self.reader = None
+        self.writer = None
+        self.registered = None
+        self.joined = None
+        self.closed = None
+
+    async def connect(self, port):
+        await self.register(port)
+        await self.join()
+
+    async def register(self, port):
+        loop = asyncio.get_running_loop()
+        self.registered = loop.create_future()
+        self.joined = loop.create_future()
+        self.closed = loop.create_future()
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self.writer.write(f"NICK {self.nick}\r\nUSER {self.nick} 0 = :bot\r\n".encode())
+        loop.create_task(self.read_loop())
+        await self.registered
+
+    async def join(self):
+        self.writer.write(f"JOIN {self.channel}\r\n".encode())
+        await self.joined
+
+    async def read_loop(self):
+        try:
+            async for line in self.reader:
+                if b" PRIVMSG " in line:
+                    self.received += 1
+                    if self.latencies is not None:
+                        self.latencies.append(time.perf_counter_ns() - int(line.rpartition(b" ")[2]))
+                elif line.startswith(b"PONG ") and line[6:-2].isdigit():
+                    self.pongs.append(time.perf_counter_ns() - int(line[6:]))
+                elif b" 376 " in line and not self.registered.done():
+                    self.registered.set_result(None)
+                elif (b" 366 " in line or b" 403 " in line) and not self.joined.done():
+                    self.joined.set_result(None)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if not self.closed.done():
+                self.closed.set_result(None)
+
+    def ping(self):
+        self.writer.write(f"PING :{time.perf_counter_ns()}\r\n".encode())
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# Uma rodada de fan-out: `clients` bots divididos em `channels` canais; o primeiro
+# bot de cada canal envia `messages` linhas. Devolve (entregas, segundos)
+async def fanout_round(port, clients, channels, messages):
+    bots = [Bot(f"f{i}", f"#b{i % channels}") for i in range(clients)]
+    for start in range(0, len(bots), 200):
+        await asyncio.gather(*(b.connect(port) for b in bots[start:start + 200]))
+    await asyncio.sleep(0.5)
+    senders = bots[:channels]
+    expected = sum((len(range(i, clients, channels)) - 1) * messages for i in range(channels))
+    start = time.perf_counter()
+    for n in range(messages):
+        for bot in senders:
+            bot.writer.write(f"PRIVMSG {bot.channel} :m{n}\r\n".encode())
+        if n % 50 == 0:
+            await asyncio.gather(*(b.writer.drain() for b in senders))
+    deadline = start + 60
+    while sum(b.received for b in bots) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    delivered = sum(b.received for b in bots)
+    for b in bots:
+        b.close()
+    return delivered, expected, elapsed
+
+
+# Vazão de fan-out em função do número de workers (servidor.py --workers N)
+def bench_sharding(args):
+    print(f"{'workers':>8} {'entregues':>10} {'esperadas':>10} {'tempo (s)':>10} {'msgs/s':>10}")
+    for i, workers in enumerate(args.workers):
+        port = args.porta + i
+        extra = ["--flood-taxa", "0"] + (["--workers", str(workers)] if workers > 1 else [])
+        proc = start_server(port, "async", extra)
+        try:
+            delivered, expected, elapsed = asyncio.run(
+                fanout_round(port, args.clientes, args.canais, args.mensagens))
+        finally:
+            stop_server(proc)
+        print(f"{workers:>8} {delivered:>10} {expected:>10} {elapsed:>10.2f} {delivered / elapsed:>10.0f}")
+
+
+# Memória (KiB) de um processo somada à dos seus filhos (workers do --workers N)
+def tree_rss(pid):
+    total = process_status(pid)["VmRSS"]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = f.read().split()
+    except OSError:
+        children = []
+    for child in children:
+        total += tree_rss(int(child))
+    return total
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+# Enxame de bots contra o servidor do processo `pid`: registro, tempestade de JOIN,
+# fan-out de PRIVMSG com marca de tempo e tempestade de QUIT. Devolve as métricas
+async def swarm(port, pid, args):
+    latencies = []
+    size = args.tamanho_canal
+    bots = [Bot(f"c{i}", f"#carga{i // size}", latencies) for i in range(args.clientes)]
+    base = tree_rss(pid)
+
+    # Registro em lotes de conexões simultâneas (o backlog do listen é pequeno)
+    start = time.perf_counter()
+    for i in range(0, len(bots), args.lote):
+        await asyncio.gather(*(b.register(port) for b in bots[i:i + args.lote]))
+    register_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(b.join() for b in bots))
+    join_time = time.perf_counter() - start
+    await asyncio.sleep(0.5)
+    rss = tree_rss(pid)
+
+    # Fan-out: o primeiro bot de cada canal envia uma mensagem por rodada
+    senders = bots[::size]
+    expected = sum(min(size, len(bots) - i) - 1 for i in range(0, len(bots), size)) * args.mensagens
+    start = time.perf_counter()
+    for n in range(args.mensagens):
+        for bot in senders:
+            bot.writer.write(f"PRIVMSG {bot.channel} :{n} {time.perf_counter_ns()}\r\n".encode())
+        await asyncio.gather(*(b.writer.drain() for b in senders))
+        if args.intervalo:
+            await asyncio.sleep(args.intervalo / 1000)
+    # Espera as entregas até completar ou ficar 2 s sem progresso (mensagens descartadas)
+    delivered, last = 0, time.perf_counter()
+    while delivered < expected and time.perf_counter() - last < 2:
+        await asyncio.sleep(0.01)
+        count = sum(b.received for b in bots)
+        if count != delivered:
+            delivered, last = count, time.perf_counter()
+    fanout_time = last - start
+
+    start = time.perf_counter()
+    for b in bots:
+        b.writer.write(b"QUIT :carga\r\n")
+    await asyncio.wait([b.closed for b in bots], timeout=60)
+    quit_time = time.perf_counter() - start
+    closed = sum(b.closed.done() for b in bots)
+    for b in bots:
+        b.close()
+
+    return {
+        "clientes": len(bots),
+        "tamanho_canal": size,
+        "canais": len(senders),
+        "mensagens": args.mensagens,
+        "registro_s": register_time,
+        "conexoes_por_s": len(bots) / register_time,
+        "join_s": join_time,
+        "joins_por_s": len(bots) / join_time,
+        "rss_kb": rss,
+        "kb_por_conexao": (rss - base) / len(bots),
+        "entregues": delivered,
+        "esperadas": expected,
+        "msgs_por_s": delivered / fanout_time if fanout_time > 0 else 0.0,
+        "latencia_p50_ms": percentile(latencies, 0.50) / 1e6,
+        "latencia_p99_ms": percentile(latencies, 0.99) / 1e6,
+        "quit_s": quit_time,
+        "quits_por_s": closed / quit_time,
+        "desconectados": closed,
+    }
+
+
+# Métricas comparadas com a linha de base: 1 quando maior é melhor, -1 quando menor é melhor
+LOAD_METRICS = {
+    "conexoes_por_s": 1,
+    "joins_por_s": 1,
+    "msgs_por_s": 1,
+    "quits_por_s": 1,
+    "latencia_p50_ms": -1,
+    "latencia_p99_ms": -1,
+    "kb_por_conexao": -1,
+}
+
+
+# Devolve as métricas que pioraram mais do que `tolerance` (fração) em relação à base
+def compare_runs(result, baseline, tolerance):
+    regressions = []
+    for key, direction in LOAD_METRICS.items():
+        old, new = baseline.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * direction
+        status = "REGRESSÃO" if change < -tolerance else "ok"
+        print(f"{key:<18} {old:>12.2f} {new:>12.2f} {change * 100:>+8.1f}% {status}", file=sys.stderr)
+        if change < -tolerance:
+            regressions.append(key)
+    return regressions
+
+
+# Teste de carga com um enxame de bots; a saída --json pode ser salva e usada como
+# linha de base (--comparar) para detectar regressões entre versões
+def bench_carga(args):
+    extra = ["--flood-taxa", "0"] # Mede a capacidade do servidor, não o limite por cliente
+    if args.workers > 1:
+        extra += ["--workers", str(args.workers)]
+    proc = start_server(args.porta, args.modo, extra)
+    try:
+        result = asyncio.run(swarm(args.porta, proc.pid, args))
+    finally:
+        stop_server(proc)
+    result = {"modo": args.modo, "workers": args.workers, **result}
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:<18} {value:>12.2f}" if isinstance(value, float) else f"{key:<18} {value:>12}")
+    if args.salvar:
+        with open(args.salvar, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.comparar:
+        with open(args.comparar) as f:
+            baseline = json.load(f)
+        print(f"{'métrica':<18} {'base':>12} {'atual':>12} {'variação':>9}", file=sys.stderr)
+        regressions = compare_runs(result, baseline, args.tolerancia / 100)
+        if regressions:
+            print(f"Regressões: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+# Um cliente inunda um canal grande com PRIVMSG enquanto outro cliente mede a
+# latência de PING. Devolve as linhas enviadas e entregues, quando o abusador foi
+# desconectado (ou None) e as latências de PING
+async def flood_round(port, listeners, duration):
+    bots = [Bot(f"l{i}", "#flood") for i in range(listeners)]
+    for i in range(0, len(bots), 200):
+        await asyncio.gather(*(b.connect(port) for b in bots[i:i + 200]))
+    normal = Bot("normal", "#outro")
+    abuser = Bot("abusador", "#flood")
+    await normal.connect(port)
+    await abuser.connect(port)
+
+    async def pinger():
+        while time.perf_counter() < end:
+            normal.ping()
+            await asyncio.sleep(0.05)
+
+    line = b"PRIVMSG #flood :" + b"x" * 100 + b"\r\n"
+    start = time.perf_counter()
+    end = start + duration
+    task = asyncio.get_running_loop().create_task(pinger())
+    sent = 0
+    kicked = None
+    while time.perf_counter() < end:
+        if abuser.closed.done() or abuser.writer.is_closing():
+            kicked = time.perf_counter() - start
+            break
+        abuser.writer.write(line * 20)
+        sent += 20
+        try:
+            await asyncio.wait_for(abuser.writer.drain(), 0.1)
+        except asyncio.TimeoutError:
+            pass # Servidor parou de ler o abusador; continua checando a desconexão
+        except ConnectionError:
+            kicked = time.perf_counter() - start
+            break
+    if kicked is None and abuser.closed.done():
+        kicked = time.perf_counter() - start
+    await task
+    await asyncio.sleep(0.5)
+    delivered = sum(b.received for b in bots)
+    for b in bots + [normal, abuser]:
+        b.close()
+    return sent, delivered, kicked, normal.pongs
+
+
+# Compara o servidor com e sem controle de flood diante de um abusador: com o
+# controle ligado o abusador precisa ser desconectado e o PING dos outros não pode
+# sofrer; termina com código 1 se o abusador não for desconectado
+def bench_flood(args):
+    print(f"{'controle':<9} {'enviadas':>9} {'entregues':>10} {'derrubado (s)':>14} "
+          f"{'PING p50 (ms)':>14} {'PING p99 (ms)':>14}")
+    ok = True
+    for i, rate in enumerate((0, args.taxa)):
+        port = args.porta + i
+        proc = start_server(port, args.modo, ["--flood-taxa", str(rate)])
+        try:
+            sent, delivered, kicked, pongs = asyncio.run(flood_round(port, args.ouvintes, args.duracao))
+        finally:
+            stop_server(proc)
+        label = f"{rate:g}/s" if rate else "desligado"
+        print(f"{label:<9} {sent:>9} {delivered:>10} {kicked if kicked is None else round(kicked, 2)!s:>14} "
+              f"{percentile(pongs, 0.5) / 1e6:>14.2f} {percentile(pongs, 0.99) / 1e6:>14.2f}")
+        if rate:
+            ok = kicked is not None
+    if not ok:
+        print("Falha: o abusador não foi desconectado")
+        sys.exit(1)
+
+
+# Implementações anteriores do recebimento de linhas, usadas como referência no
+# benchmark do enquadrador. Um chunk com UTF-8 cortado gerava exceção e era perdido
+def reference_server(data, chunk):
+    buffer, lines, errors = "", 0, 0
+    for i in range(0, len(data), chunk):
+        try:
+            buffer += data[i:i + chunk].decode("utf-8")
+        except UnicodeDecodeError:
+            errors += 1
+            continue
+        if "\r\n" in buffer:
+            parts = buffer.split("\r\n")
+            buffer = parts[-1]
+            lines += len(parts) - 1
+    return lines, errors
+
+
+def reference_client(data, chunk):
+    buffer, lines, errors = "", 0, 0
+    for i in range(0, len(data), chunk):
+        try:
+            buffer += data[i:i + chunk].decode("utf-8")
+        except UnicodeDecodeError:
+            errors += 1
+            continue
+        while "\r\n" in buffer:
+            _, buffer = buffer.split("\r\n", 1)
+            lines += 1
+    return lines, errors
+
+
+def framer_lines(data, chunk):
+    from protocolo import Enquadrador
+    framer = Enquadrador()
+    scratch = bytearray(chunk)
+    lines = 0
+    for i in range(0, len(data), chunk):
+        piece = data[i:i + chunk]
+        scratch[:len(piece)] = piece # O que o kernel faria no recv_into
+        lines += len(framer.feed(scratch, len(piece)))
+    return lines, 0
+
+
+# Vazão do enquadrador de linhas com um "colar" enorme (rajada de linhas em um único envio)
+def bench_framer(args):
+    from protocolo import RECV_SIZE
+    rng = random.Random(1)
+    words = ["olá", "canal", "ação", "mensagem", "teste", "😀", "irc", "x" * 12]
+    lines = []
+    for i in range(args.linhas):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(2, 60)))
+        lines.append(f"PRIVMSG #flood :{text}"[:500])
+    data = "\r\n".join(lines).encode("utf-8") + b"\r\n"
+    print(f"{args.linhas} linhas, {len(data) / 1e6:.1f} MB")
+    print(f"{'implementação':<34} {'linhas':>8} {'perdas':>7} {'tempo (s)':>10} {'MB/s':>8}")
+    cases = [
+        ("servidor anterior (recv 1 KiB)", reference_server, 1024),
+        ("cliente anterior (recv 1 KiB)", reference_client, 1024),
+        (f"servidor anterior (recv {RECV_SIZE // 1024} KiB)", reference_server, RECV_SIZE),
+        (f"cliente anterior (recv {RECV_SIZE // 1024} KiB)", reference_client, RECV_SIZE),
+        ("Enquadrador (recv_into 1 KiB)", framer_lines, 1024),
+        (f"Enquadrador (recv_into {RECV_SIZE // 1024} KiB)", framer_lines, RECV_SIZE),
+    ]
+    for label, func, chunk in cases:
+        start = time.perf_counter()
+        count, errors = func(data, chunk)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<34} {count:>8} {errors:>7} {elapsed:>10.3f} {len(data) / 1e6 / elapsed:>8.1f}")
+
+
+# Caminho anterior do handle_command: split, maiúsculas e cadeia de if/elif
+# (devolve os argumentos que seriam passados ao handler)
+def reference_handle_command(command):
+    parts = command.split()
+    cmd = parts[0].upper()
+    if cmd == "NICK" and len(parts) > 1:
+        return (parts[1],)
+    elif cmd == "USER" and len(parts) > 4:
+        return parts[1], " ".join(parts[4:])
+    elif cmd == "PING" and len(parts) > 1:
+        return (" ".join(parts[1:]),)
+    elif cmd == "PONG":
+        return (" ".join(parts[0:]),)
+    elif cmd == "JOIN" and len(parts) > 1:
+        return (parts[1],)
+    elif cmd == "PART" and len(parts) > 1:
+        return parts[1], " ".join(parts[2:]) if len(parts) > 2 else ""
+    elif cmd == "QUIT":
+        return (" ".join(parts[1:]) if len(parts) > 1 else "",)
+    elif cmd == "PRIVMSG" and len(parts) > 2:
+        return parts[1], " ".join(parts[2:])
+    elif cmd == "NAMES" and len(parts) > 1:
+        return (parts[1],)
+    elif cmd == "LIST":
+        return (parts[1] if len(parts) > 1 else "",)
+    return None
+
+
+# Parser novo + tabela de despacho (consulta e checagem de parâmetros, sem o handler)
+def parsed_handle_command():
+    from protocolo import parse_message
+    from servidor import Cliente
+    commands = Cliente.COMMANDS
+
+    def dispatch(line):
+        msg = parse_message(line)
+        entry = commands.get(msg.command)
+        if entry is None or len(msg.params) < entry[0]:
+            return None
+        return msg
+    return dispatch
+
+
+def bench_parser(args):
+    rng = random.Random(1)
+    words = ["olá", "canal", "mensagem", "teste", "irc", "x" * 12]
+    lines = []
+    for i in range(args.linhas):
+        r = rng.random()
+        if r < 0.8:
+            lines.append(f"PRIVMSG #canal{i % 50} :" + " ".join(rng.choice(words) for _ in range(rng.randint(1, 40))))
+        elif r < 0.9:
+            lines.append(f"PING :token{i}")
+        elif r < 0.95:
+            lines.append(f"JOIN #canal{i % 50}")
+        else:
+            lines.append(f"PART #canal{i % 50} :até mais")
+    dispatch = parsed_handle_command()
+    print(f"{len(lines)} linhas")
+    for label, func in (("split + if/elif (anterior)", reference_handle_command),
+                        ("parse_message + tabela", dispatch)):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<28} {elapsed:>8.3f} s {elapsed / len(lines) * 1e9:>8.0f} ns/linha")
+
+
+# Conexão falsa para os microbenchmarks em processo: aceita tudo e descarta
+class ConexaoNula:
+
+    def send(self, data, flags=0):
+        return len(data)
+
+    def sendmsg(self, buffers, ancdata=(), flags=0):
+        return sum(len(b) for b in buffers)
+
+    def fileno(self):
+        return -1
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+# Servidor sem rede para microbenchmarks: as filas de saída esvaziam na hora
+# (com várias threads, quem está esvaziando continua até a fila ficar vazia)
+def offline_server():
+    import servidor
+    server = servidor.Servidor()
+    server.host = "bench"
+    server.wake_writer = drain
+    return servidor, server
+
+
+def drain(fila):
+    while not fila.flush():
+        pass
+
+
+def timed(label, n, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {n:>9} ops {elapsed:>8.2f} s {elapsed / max(n, 1) * 1e6:>9.2f} µs/op")
+    return elapsed
+
+
+# Microbenchmark do registro de nicks e canais: NICK, JOIN, NAMES, PART e QUIT
+# com muitos clientes e canais, sem rede (mede só as estruturas do servidor)
+def bench_registro(args):
+    servidor, server = offline_server()
+    rng = random.Random(1)
+    clients = [servidor.Cliente(ConexaoNula(), ("bench", i), server) for i in range(args.clientes)]
+    server.clients.update(clients)
+    names = [f"#c{i}" for i in range(args.canais)]
+    print(f"{args.clientes} clientes, {args.canais} canais, {args.por_cliente} canais por cliente")
+
+    def nick():
+        for i, c in enumerate(clients):
+            c.handle_nick(f"N{i:x}")
+            c.handle_user(f"u{i}", "bench")
+    timed("NICK + USER", len(clients), nick)
+
+    def collide():
+        for i in range(len(clients)):
+            server.is_nick_available(f"n{i:x}")
+    timed("NICK em uso (minúsculas)", len(clients), collide)
+
+    joins = [(c, rng.choice(names)) for c in clients for _ in range(args.por_cliente)]
+    timed("JOIN", len(joins), lambda: [c.handle_join(ch) for c, ch in joins])
+
+    sample = [(c, rng.choice(names)) for c in rng.sample(clients, min(10000, len(clients)))]
+    timed("NAMES", len(sample), lambda: [c.handle_names(ch) for c, ch in sample])
+
+    parts = joins[::2]
+    timed("PART", len(parts), lambda: [c.handle_part(ch, "bench") for c, ch in parts])
+
+    timed("QUIT", len(clients), lambda: [server.remove_client(c, "bench") for c in clients])
+    print(f"canais restantes: {len(server.channels)}, nicks restantes: {len(server.nicks)}")
+
+
+# Custo do keepalive (roda de temporização) por número de clientes, sem rede e com
+# relógio simulado: metade dos clientes fica ativa e a outra metade em silêncio
+# deve receber um PING e ser derrubada. O custo por cliente deve ficar constante
+def bench_keepalive(args):
+    print(f"{'clientes':>9} {'ticks':>6} {'µs/tick':>9} {'pior tick (µs)':>15} {'ns/cliente/ciclo':>17} {'PINGs':>7} {'derrubados':>11}")
+    failed = False
+    for n in args.clientes:
+        servidor, server = offline_server()
+        clock = [0.0]
+        server.keepalive = servidor.RodaTempo(clock=lambda: clock[0])
+        server.ping_interval, server.ping_timeout = args.intervalo, args.timeout
+        wheel = server.keepalive
+        pings = [0]
+
+        # Conta os PINGs e só marca a derrubada, sem mexer em socket
+        class Silencioso(servidor.Cliente):
+            __slots__ = ()
+
+            def send_data(self, message, droppable=False):
+                pings[0] += 1
+
+            def evict(self, reason):
+                self.quit_reason = reason
+
+        clients = [Silencioso(ConexaoNula(), ("bench", i), server) for i in range(n)]
+        for c in clients:
+            c.nick = f"k{c.addr[1]}"
+            server.clients.add(c)
+            server.watch(c)
+        active = clients[::2]
+        cycle = args.intervalo + args.timeout + 1
+        ticks = 2 * cycle
+        total = worst = 0
+        for _ in range(ticks):
+            clock[0] += wheel.tick
+            for c in active:
+                c.last_seen = clock[0]
+            start = time.perf_counter()
+            server.check_keepalive()
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            worst = max(worst, elapsed)
+        evicted = sum(c.quit_reason is not None for c in clients)
+        failed |= evicted != n - len(active) or any(c.quit_reason for c in active)
+        print(f"{n:>9} {ticks:>6} {total / ticks * 1e6:>9.1f} {worst * 1e6:>15.1f} "
+              f"{total / 2 / n * 1e9:>17.0f} {pings[0]:>7} {evicted:>11}")
+    if failed:
+        print("Falha: os clientes derrubados não são exatamente os silenciosos")
+        sys.exit(1)
+
+
+# Histórico dos canais: custo do record() no caminho do broadcast, tempo até a
+# thread de escrita alcançar, recarga dos anéis a partir do log e replay pelo mmap.
+# Termina com código 1 se o replay não devolver exatamente as últimas mensagens
+def bench_historico(args):
+    import tempfile
+    from historico import Historico
+    from servidor import irc_lower
+    directory = tempfile.mkdtemp(prefix="historico-")
+    path = os.path.join(directory, "log")
+    keys = [irc_lower(f"#h{i}") for i in range(args.canais)]
+    lines = [f":nick{i % 97} PRIVMSG {keys[i % args.canais]} :mensagem número {i} {'x' * 40}\r\n".encode()
+             for i in range(args.mensagens)]
+    print(f"{args.mensagens} mensagens em {args.canais} canais, anel de {args.limite} por canal")
+    try:
+        for label, log in (("memória", None), ("disco (mmap)", path)):
+            history = Historico(args.limite, log)
+            start = time.perf_counter()
+            for i, line in enumerate(lines):
+                history.record(keys[i % args.canais], line)
+            elapsed = time.perf_counter() - start
+            print(f"{label:<13} record(): {elapsed / len(lines) * 1e9:>7.0f} ns/msg", end="")
+            history.flush()
+            print(f"  gravado em {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        history = Historico(args.limite, path)
+        print(f"recarga do log: {time.perf_counter() - start:.2f} s, "
+              f"{sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)) / 1e6:.1f} MB em disco")
+        sample = random.Random(1).sample(range(args.canais), min(1000, args.canais))
+        start = time.perf_counter()
+        ok = True
+        for c in sample:
+            got = [line for _, line in history.latest(keys[c], args.limite)]
+            ok &= got == lines[c::args.canais][-args.limite:]
+        elapsed = time.perf_counter() - start
+        print(f"replay de {args.limite} linhas: {elapsed / len(sample) * 1e6:.0f} µs por canal")
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+    if not ok:
+        print("Falha: o replay não devolveu as últimas mensagens do canal")
+        sys.exit(1)
+
+
+# Muitos bots do cliente.py no mesmo processo, todos no mesmo laço (Laco): registro
+# e JOIN enviados juntos sem esperar respostas, depois cada bot envia as suas
+# PRIVMSG de uma vez (pipelining). Mostra o tempo de cada fase, as linhas por send
+# (escritas agrupadas) e a memória por bot; termina com código 1 se alguma entrega faltar
+def bench_clientes(args):
+    from cliente import Cliente, Laco
+    proc = start_server(args.porta, "async", ["--flood-taxa", "0"])
+    rss_before = process_status(os.getpid())["VmRSS"]
+    laco = Laco()
+    counts = {"joined": 0, "privmsg": 0}
+
+    def joined(cliente, msg):
+        counts["joined"] += 1
+
+    def privmsg(cliente, msg):
+        counts["privmsg"] += 1
+
+    bots = []
+    try:
+        start = time.perf_counter()
+        for i in range(args.bots):
+            c = Cliente(laco, eco=False)
+            c.on("366", joined)
+            c.on("403", joined) # Quem cria o canal recebe 403 no lugar do NAMES
+            c.on("PRIVMSG", privmsg)
+            c.conectar("127.0.0.1", args.porta, f"cb{i}")
+            c.join_command(f"#cl{i % args.canais}")
+            bots.append(c)
+        ok = laco.run(lambda: counts["joined"] >= len(bots), 60)
+        setup = time.perf_counter() - start
+        print(f"{len(bots)} bots em um processo ({process_status(os.getpid())['Threads']} thread), "
+              f"{args.canais} canais, {args.mensagens} mensagens por bot")
+        print(f"conexão + registro + JOIN: {setup:.2f} s ({len(bots) / setup:.0f} bots/s)")
+
+        sizes = [len(range(c, len(bots), args.canais)) for c in range(args.canais)]
+        expected = sum(n * (n - 1) for n in sizes) * args.mensagens
+        sends_before = sum(c.envios for c in bots)
+        lines_before = sum(c.linhas_enviadas for c in bots)
+        start = time.perf_counter()
+        for i, c in enumerate(bots):
+            for j in range(args.mensagens):
+                c.privmsg_command(c.current_channel, f"{i} {j}")
+        ok &= laco.run(lambda: counts["privmsg"] >= expected, 120)
+        elapsed = time.perf_counter() - start
+        sends = sum(c.envios for c in bots) - sends_before
+        lines = sum(c.linhas_enviadas for c in bots) - lines_before
+        print(f"PRIVMSG: {lines} linhas em {sends} envios ({lines / max(sends, 1):.1f} linhas por send), "
+              f"{counts['privmsg']} de {expected} entregas em {elapsed:.2f} s ({counts['privmsg'] / elapsed:.0f}/s)")
+        rss = process_status(os.getpid())["VmRSS"] - rss_before
+        print(f"memória do processo dos bots: {rss / len(bots):.1f} KiB por bot")
+    finally:
+        for c in bots:
+            c.fechar()
+        stop_server(proc)
+    if not ok or counts["privmsg"] != expected:
+        print("Falha: nem todos os bots entraram ou receberam todas as mensagens")
+        sys.exit(1)
+
+
+# Listas de alvos: um cliente entra em `canais` canais com um JOIN por canal,
+# esperando cada resposta (como um cliente ingênuo), e outro com um único JOIN em
+# lote. Depois `bots` membros se espalham pelos canais, uma PRIVMSG vai para 10
+# canais de uma vez e um NAMES lista um canal com todos eles. O servidor usa o
+# controle de flood padrão; só o cliente ingênuo vai para um segundo servidor sem
+# ele, já que um JOIN por canal esgota o balde de propósito. Termina com código 1
+# se o JOIN em lote esgotar o balde, se alguém receber a PRIVMSG mais de uma vez
+# (ou não receber) ou se alguma linha 353 passar de 512 bytes ou faltar algum nick
+def bench_alvos(args):
+    import tempfile
+    from cliente import Cliente, Laco
+    from protocolo import MAX_LINE
+    directory = tempfile.mkdtemp(prefix="alvos-")
+    metrics_path = os.path.join(directory, "metricas")
+    proc = start_server(args.porta, "async", ["--metricas", metrics_path])
+    naive = start_server(args.porta + 1, "async", ["--flood-taxa", "0"])
+    laco = Laco()
+    names = [f"#alvo{i}" for i in range(args.canais)]
+    clients = []
+
+    def new(nick, port=args.porta):
+        c = Cliente(laco, eco=False)
+        c.conectar("127.0.0.1", port, nick)
+        c.esperar("376", 10)
+        clients.append(c)
+        return c
+
+    def throttles():
+        with socket.socket(socket.AF_UNIX) as s:
+            s.connect(metrics_path)
+            return json.loads(s.makefile().readline())["flood_avisos"]
+
+    failed = False
+    try:
+        one = new("umporum", args.porta + 1)
+        start = time.perf_counter()
+        for name in names:
+            one.enviar_dados(f"JOIN {name}")
+            one.esperar("403", 10) # Quem cria o canal recebe 403 no lugar do NAMES
+        sequential = time.perf_counter() - start
+
+        batch = new("emlote")
+        joined = []
+        batch.on("366", lambda c, msg: joined.append(msg))
+        batch.on("403", lambda c, msg: joined.append(msg)) # Os canais são novos neste servidor
+        start = time.perf_counter()
+        batch.join_command(names)
+        laco.run(lambda: len(joined) >= len(names), 30)
+        batched = time.perf_counter() - start
+        throttled = throttles()
+        print(f"{args.canais} canais: {args.canais} JOINs esperando cada resposta {sequential * 1000:.1f} ms, "
+              f"um JOIN em lote {batched * 1000:.1f} ms ({sequential / batched:.1f}x), "
+              f"{throttled} vezes sem fichas")
+        failed |= throttled > 0
+
+        received = {}
+        bots = []
+        for i in range(args.bots):
+            c = Cliente(laco, eco=False)
+            c.on("PRIVMSG", lambda c, msg: received.__setitem__(c, received.get(c, 0) + 1))
+            c.on("366", lambda c, msg: joined.append(msg))
+            c.conectar("127.0.0.1", args.porta, f"m{i}")
+            # Cada bot entra em 3 canais sorteados (com sobreposição entre os alvos)
+            c.join_command([names[0]] + random.Random(i).sample(names, 3))
+            bots.append(c)
+        clients.extend(bots)
+        expected = len(names) + sum(len(c.channels) for c in bots)
+        laco.run(lambda: len(joined) >= expected, 30)
+        targets = names[:10]
+        sender = batch
+        sender.privmsg_command(",".join(targets), "para muitos canais")
+        members = [c for c in bots if set(c.channels) & set(targets)]
+        laco.run(lambda: sum(received.values()) >= len(members), 10)
+        laco.run(lambda: False, 0.5) # Cópias repetidas chegariam aqui
+        repeated = sum(1 for n in received.values() if n > 1)
+        missing = sum(1 for c in members if c not in received)
+        print(f"PRIVMSG para {len(targets)} canais: {len(members)} destinatários, {sum(received.values())} entregas, "
+              f"{repeated} repetidas, {missing} faltando")
+        failed |= repeated > 0 or missing > 0
+
+        lines = []
+        original = sender.processar_comando
+        sender.processar_comando = lambda linha: (lines.append(linha), original(linha))
+        sender.names_command(names[0])
+        sender.esperar("366", 10)
+        sizes = [len(line.encode("utf-8")) + 2 for line in lines if " 353 " in line]
+        nicks = {n for line in lines if " 353 " in line for n in line.split(" :", 1)[1].split()}
+        expected = {c.nick for c in bots} | {"emlote"}
+        print(f"NAMES de um canal com {len(expected)} membros: {len(sizes)} linhas 353, "
+              f"maior com {max(sizes)} bytes, {len(nicks)} nicks")
+        failed |= max(sizes) > MAX_LINE or nicks != expected
+    finally:
+        for c in clients:
+            c.fechar()
+        stop_server(proc)
+        stop_server(naive)
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+    if failed:
+        print("Falha: JOIN em lote sem fichas, entregas repetidas/faltando ou NAMES incompleto/grande demais")
+        sys.exit(1)
+
+
+# NAMES e LIST com as respostas guardadas nos canais. Sem rede: NAMES de um canal
+# grande com a lista pronta contra a lista refeita a cada pedido, conferindo que a
+# lista montada aos poucos pelos JOINs é igual à refeita. Com rede: um cliente com
+# buffer de recepção pequeno pede o LIST de muitos canais e demora a ler; o LIST
+# tem que chegar inteiro sem derrubar a conexão, enquanto outro cliente mede o
+# tempo de resposta de PINGs
+def bench_listas(args):
+    servidor, server = offline_server()
+    clients = [servidor.Cliente(ConexaoNula(), ("bench", i), server) for i in range(args.membros)]
+    for i, c in enumerate(clients):
+        c.handle_nick(f"m{i}")
+        c.handle_user(f"m{i}", "bench")
+    first = clients[0]
+    first.handle_join("#grande")
+    canal = server.get_channel("#grande")
+    server.names_of(canal)
+    for c in clients[1:]:
+        c.handle_join("#grande")
+    incremental = server.names_of(canal)
+    canal.names = None
+    failed = incremental != server.names_of(canal)
+    clients[-1].handle_nick("renomeado") # A troca de nick descarta a lista guardada
+    failed |= "renomeado" not in server.names_of(canal)[-1].split()
+    print(f"NAMES de {args.membros} membros: lista montada pelos JOINs "
+          f"{'igual' if not failed else 'DIFERENTE'} da refeita ({len(incremental)} linhas 353)")
+
+    def rebuilt():
+        for _ in range(args.pedidos):
+            canal.names = None
+            first.handle_names("#grande")
+    cold = timed("NAMES refeito", args.pedidos, rebuilt)
+    warm = timed("NAMES guardado", args.pedidos, lambda: [first.handle_names("#grande") for _ in range(args.pedidos)])
+    print(f"NAMES guardado {cold / warm:.1f}x mais rápido")
+
+    proc = start_server(args.porta, args.modo, ["--flood-taxa", "0"])
+    try:
+        owner = open_clients(1, args.porta, "dono")[0]
+        wait_for([owner], b" 376 ")
+        names = [f"#l{i}" for i in range(args.canais)]
+        from protocolo import pack_items
+        for i in range(0, len(names), 1000): # Em lotes, lendo as respostas (403 para quem cria o canal)
+            batch = names[i:i + 1000]
+            owner.sendall("".join(line + "\r\n" for line in pack_items("JOIN ", batch, sep=",")).encode("utf-8"))
+            wait_for([owner], b" 403 ", len(batch))
+        pinger = open_clients(1, args.porta, "ping")[0]
+        wait_for([pinger], b" 376 ")
+
+        reader = socket.socket()
+        reader.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        reader.connect(("127.0.0.1", args.porta))
+        reader.sendall(b"NICK leitor\r\nUSER leitor 0 * :leitor\r\n")
+        wait_for([reader], b" 376 ")
+        start = time.perf_counter()
+        reader.sendall(b"LIST\r\n")
+        pinger.settimeout(10)
+        latencies = []
+        deadline = time.time() + args.espera
+        while time.time() < deadline: # O leitor fica sem ler enquanto isso
+            sent = time.perf_counter()
+            pinger.sendall(b"PING :t\r\n")
+            data = b""
+            while b"PONG" not in data:
+                data += pinger.recv(4096)
+            latencies.append(time.perf_counter() - sent)
+            time.sleep(0.01)
+        data = b""
+        reader.settimeout(30)
+        while b" 323 " not in data:
+            chunk = reader.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        elapsed = time.perf_counter() - start
+        entries = data.count(b" 322 ")
+        print(f"LIST de {args.canais} canais lido {args.espera:.1f} s depois: {entries} linhas 322, "
+              f"{len(data) // 1024} KiB, {elapsed:.2f} s, fim {'recebido' if b' 323 ' in data else 'FALTANDO'}")
+        print(f"PING de outro cliente durante o LIST: p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+              f"max {max(latencies) * 1000:.2f} ms")
+        failed |= entries != args.canais or b" 323 " not in data
+
+        reader.sendall(b"LIST #l1*,>0\r\n")
+        data = b""
+        while b" 323 " not in data:
+            data += reader.recv(65536)
+        expected = sum(1 for name in names if name.startswith("#l1"))
+        print(f"LIST #l1*,>0: {data.count(b' 322 ')} canais (esperados {expected})")
+        failed |= data.count(b" 322 ") != expected
+        for s in (owner, pinger, reader):
+            s.close()
+    finally:
+        stop_server(proc)
+    if failed:
+        print("Falha: NAMES guardado diferente do refeito ou LIST incompleto")
+        sys.exit(1)
+
+
+# Terminal de mentira: conta as chamadas de write e as linhas; com `guardar`
+# também guarda o texto. Cada write espera `custo` segundos (um terminal de
+# verdade custa bem mais por escrita do que um arquivo)
+class TerminalFalso:
+
+    def __init__(self, custo=0.0, guardar=False):
+        self.custo = custo
+        self.textos = [] if guardar else None
+        self.writes = 0
+        self.linhas = 0
+
+    def write(self, texto):
+        self.writes += 1
+        self.linhas += texto.count("\n")
+        if self.textos is not None:
+            self.textos.append(texto)
+        if self.custo:
+            time.sleep(self.custo)
+
+    def flush(self):
+        pass
+
+
+# Saída do cliente interativo sem rede: `--linhas` PRIVMSGs espalhadas por
+# `--canais` canais chegam em blocos (como as leituras do socket) a um cliente
+# com o primeiro canal na tela. Compara um print por linha com a Tela (lotes por
+# tempo, só o canal atual) em um terminal em que cada write custa `--custo-us`.
+# Confere as não lidas dos outros canais, o tamanho dos históricos e uma página
+# do /scroll; termina com código 1 se algo não bater
+def bench_tela(args):
+    import cliente
+    from protocolo import parse_message
+    names = [f"#c{i}" for i in range(args.canais)]
+    lines = [f":n{i % 50}!u@h PRIVMSG {names[i % args.canais]} :mensagem {i} com um texto de tamanho médio"
+             for i in range(args.linhas)]
+    blocks = [lines[i:i + args.bloco] for i in range(0, len(lines), args.bloco)]
+    custo = args.custo_us / 1e6
+
+    terminal = TerminalFalso(custo)
+    start = time.perf_counter()
+    for block in blocks:
+        for line in block:
+            parse_message(line)
+            print(line, file=terminal)
+    before = time.perf_counter() - start
+    print(f"print por linha: {len(lines)} linhas em {before:.2f} s ({len(lines) / before:,.0f} linhas/s), "
+          f"{terminal.writes} writes")
+
+    c = cliente.Cliente(cliente.Laco())
+    terminal = TerminalFalso(custo, guardar=True)
+    c.tela.saida = terminal
+    c.tela.selecionar(names[0])
+    start = time.perf_counter()
+    for block in blocks:
+        for line in block:
+            c.processar_comando(line)
+        c.laco.run_once(0)
+    c.tela.desenhar()
+    after = time.perf_counter() - start
+    print(f"Tela: {len(lines)} linhas em {after:.2f} s ({len(lines) / after:,.0f} linhas/s), "
+          f"{terminal.writes} writes, {terminal.linhas} linhas escritas ({before / after:.1f}x)")
+
+    text = "".join(terminal.textos)
+    shown = text.count(f"PRIVMSG {names[0]} :")
+    omitted = sum(int(line.split()[1]) for line in text.splitlines() if "linhas omitidas" in line)
+    per_channel = {name.lower(): sum(1 for line in lines if f" {name} :" in line) for name in names}
+    unread = {k: v for k, v in per_channel.items() if k != names[0]}
+    failed = shown + omitted != per_channel[names[0]] or c.tela.nao_lidas != unread
+    failed |= any(len(c.tela.historico[k]) != min(v, cliente.SCROLLBACK) for k, v in per_channel.items())
+    print(f"canal atual: {shown} linhas escritas + {omitted} omitidas = {per_channel[names[0]]}; "
+          f"não lidas nos outros canais {'conferem' if c.tela.nao_lidas == unread else 'NÃO conferem'}")
+
+    terminal.textos.clear()
+    c.tela.rolar("2")
+    page = terminal.textos[-1].splitlines()[1:]
+    ring = list(c.tela.historico[names[0]])
+    expected = ring[len(ring) - 2 * cliente.PAGE - cliente.PAGE:len(ring) - 2 * cliente.PAGE]
+    print(f"/scroll 2: {len(page)} linhas, {'iguais' if page == expected else 'DIFERENTES'} ao histórico")
+    failed |= page != expected
+    c.tela.selecionar(names[1], exibir=True)
+    failed |= names[1] in c.tela.nao_lidas
+    if failed:
+        print("Falha: linhas perdidas, não lidas ou histórico incorretos")
+        sys.exit(1)
+
+
+# Tempo de CPU (s) já gasto por um processo, de /proc/<pid>/stat (somente Linux)
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+# Sobe `count` servidores ligados em fila (cada um se liga ao anterior) e espera
+# a rede se formar; devolve os processos
+def start_network(count, port, extra=()):
+    from cliente import Cliente, Laco
+    procs = []
+    try:
+        for i in range(count):
+            links = ["--conectar", f"127.0.0.1:{port + 100 + i - 1}"] if i else []
+            procs.append(start_server(port + i, "async", ["--nome", f"s{i}.rede", "--link-porta", str(port + 100 + i),
+                                                          *links, *extra]))
+        laco = Laco()
+        probe = Cliente(laco, eco=False)
+        probe.conectar("127.0.0.1", port + count - 1, "sonda")
+        probe.esperar("376", 10)
+        servers = []
+        probe.on("364", lambda c, msg: servers.append(msg))
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            servers.clear()
+            probe.enviar_dados("LINKS")
+            probe.esperar("365", 5)
+            if len(servers) >= count:
+                break
+            time.sleep(0.5)
+        else:
+            raise RuntimeError(f"A rede de {count} servidores não se formou")
+        probe.fechar()
+        return procs
+    except BaseException:
+        for proc in procs:
+            stop_server(proc)
+        raise
+
+
+# Rede de servidores (--link-porta/--conectar): o mesmo canal com membros
+# espalhados por 1, 2, 3... servidores em fila. Um cliente do primeiro servidor
+# manda PRIVMSGs e o benchmark mede as entregas e o tempo de CPU de cada servidor,
+# mostrando o custo do fan-out dividido entre os nós (cada servidor entrega aos
+# seus membros e manda uma única cópia por ligação). Depois confere um netsplit
+# (quem fica recebe o QUIT de todos os usuários do servidor derrubado) e uma
+# colisão de nick (fica o mais antigo). Termina com código 1 se algo faltar
+def bench_rede(args):
+    from cliente import Cliente, Laco
+    failed = False
+    extra = ["--flood-taxa", "0"]
+    print(f"{'servidores':>10} {'entregues':>10} {'esperadas':>10} {'tempo (s)':>10} {'msgs/s':>9}  CPU por servidor (ms)")
+    for count in args.servidores:
+        port = args.porta
+        procs = start_network(count, port, extra)
+        laco = Laco()
+        bots = []
+        received = [0]
+        joined = []
+        try:
+            for i in range(args.clientes):
+                c = Cliente(laco, eco=False)
+                c.on("PRIVMSG", lambda c, msg: received.__setitem__(0, received[0] + 1))
+                c.on("366", lambda c, msg: joined.append(msg))
+                c.on("403", lambda c, msg: joined.append(msg))
+                c.conectar("127.0.0.1", port + i % count, f"r{i}")
+                c.join_command(["#rede"])
+                bots.append(c)
+                if i == 0:
+                    laco.run(lambda: joined, 10) # O primeiro cria o canal
+            laco.run(lambda: len(joined) >= len(bots), 60)
+            laco.run(lambda: False, 1) # JOINs remotos terminando de se espalhar
+            before = [cpu_seconds(proc.pid) for proc in procs]
+            expected = (len(bots) - 1) * args.mensagens
+            sender = bots[0]
+            start = time.perf_counter()
+            for n in range(args.mensagens):
+                sender.enviar_dados(f"PRIVMSG #rede :mensagem {n}")
+                if n % 50 == 0:
+                    laco.run_once(0)
+            laco.run(lambda: received[0] >= expected, 120)
+            elapsed = time.perf_counter() - start
+            cpu = [(cpu_seconds(proc.pid) - b) * 1000 for proc, b in zip(procs, before)]
+            print(f"{count:>10} {received[0]:>10} {expected:>10} {elapsed:>10.2f} {received[0] / elapsed:>9.0f}  "
+                  + " ".join(f"{ms:.0f}" for ms in cpu))
+            failed |= received[0] < expected
+
+            if count > 1:
+                # Netsplit: o último servidor cai; os membros dos outros recebem um QUIT
+                # de cada usuário dele
+                quits = {}
+                for c in bots:
+                    c.on("QUIT", lambda c, msg: quits.__setitem__(c, quits.get(c, 0) + 1))
+                lost = sum(1 for i in range(len(bots)) if i % count == count - 1)
+                stayed = [c for i, c in enumerate(bots) if i % count != count - 1]
+                start = time.perf_counter()
+                stop_server(procs.pop())
+                laco.run(lambda: all(quits.get(c, 0) >= lost for c in stayed), 30)
+                missing = sum(1 for c in stayed if quits.get(c, 0) < lost)
+                print(f"{'':>10} netsplit: {len(stayed)} clientes, {lost} QUITs esperados por cliente, "
+                      f"{missing} com QUITs faltando ({(time.perf_counter() - start) * 1000:.0f} ms)")
+                failed |= missing > 0
+        finally:
+            for c in bots:
+                c.fechar()
+            for proc in procs:
+                stop_server(proc)
+
+    # Colisão: o mesmo nick registrado nos dois lados antes da ligação se formar
+    port = args.porta + 10
+    first = start_server(port, "async", ["--nome", "a.rede", "--link-porta", str(port + 100),
+                                         "--conectar", f"127.0.0.1:{port + 101}"])
+    second = None
+    laco = Laco()
+    try:
+        old = Cliente(laco, eco=False)
+        old.conectar("127.0.0.1", port, "colisao")
+        old.esperar("376", 10)
+        second = start_server(port + 1, "async", ["--nome", "b.rede", "--link-porta", str(port + 101)])
+        new = Cliente(laco, eco=False)
+        new.conectar("127.0.0.1", port + 1, "colisao")
+        new.esperar("376", 10)
+        killed = new.esperar("KILL", 15) is not None # A ligação se forma em até 5 s
+        laco.run(lambda: False, 1)
+        survived = old.conectado
+        print(f"colisão de nick: mais novo derrubado: {'sim' if killed else 'não'}, "
+              f"mais antigo mantido: {'sim' if survived else 'não'}")
+        failed |= not killed or not survived
+        old.fechar()
+        new.fechar()
+    finally:
+        stop_server(first)
+        if second is not None:
+            stop_server(second)
+    if failed:
+        print("Falha: entregas, QUITs do netsplit ou colisão de nick fora do esperado")
+        sys.exit(1)
+
+
+# Trava que não trava: o registro sem proteção, para comparação
+class TravaNula:
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# Conexão sem rede que conta as PRIVMSGs de um canal entregues a ela
+class ConexaoContadora(ConexaoNula):
+
+    def __init__(self, token):
+        self.token = token
+        self.received = 0
+
+    def send(self, data, flags=0):
+        self.received += bytes(data).count(self.token)
+        return len(data)
+
+    def sendmsg(self, buffers, ancdata=(), flags=0):
+        return sum(self.send(b) for b in buffers)
+
+
+# Confere os índices do registro: canais e membros, índice reverso dos clientes e
+# nicks. Devolve a lista de inconsistências encontradas
+def registry_errors(servidor, server, departed):
+    errors = []
+    for key, canal in server.channels.items():
+        if canal.key != key or not canal.members:
+            errors.append(f"canal {key} vazio ou com chave errada")
+        if canal.snapshot is not None and set(canal.snapshot) != set(canal.members):
+            errors.append(f"canal {key} com cópia dos membros desatualizada")
+        for member in canal.members:
+            if member not in server.clients or canal not in member.channels:
+                errors.append(f"{member.nick} no canal {key} sem estar no índice do cliente")
+    for client in server.clients:
+        for canal in client.channels:
+            if server.channels.get(canal.key) is not canal or client not in canal.members:
+                errors.append(f"{client.nick} aponta para o canal {canal.key} fora do registro")
+        if client.nick is not None and server.nicks.get(servidor.irc_lower(client.nick)) is not client:
+            errors.append(f"nick {client.nick} sem dono no registro")
+    for key, owner in server.nicks.items():
+        if owner not in server.clients or servidor.irc_lower(owner.nick) != key:
+            errors.append(f"nick {key} aponta para cliente errado")
+    for client in departed:
+        if client.channels or client in server.clients:
+            errors.append(f"{client.nick} saiu mas continua no registro")
+    return errors
+
+
+# Estresse do registro no modo com threads, sem rede: `--threads` threads mandam
+# JOIN, PART, PRIVMSG, NICK e QUIT (seguido de um cliente novo) ao mesmo servidor,
+# em poucos canais disputados, com a troca de threads do Python forçada a cada
+# poucos microssegundos. Três ouvintes fixos em #e0 devem receber cada PRIVMSG
+# enviada ao canal exatamente uma vez. Roda sem as travas do registro e com elas
+# e confere os índices no fim. Termina com código 1 se a rodada com travas tiver alguma
+# inconsistência ou exceção
+def bench_concorrencia(args):
+    import threading
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(args.troca / 1e6)
+    failed = False
+    try:
+        for label, locked in (("sem travas", False), ("com travas", True)):
+            servidor, server = offline_server()
+            server.flood_rate = 0
+            if not locked:
+                server.locks = [TravaNula()] * len(server.locks)
+            departed = []
+            exceptions = []
+            counts = [0] * args.threads
+            sent = [0] * args.threads # PRIVMSGs para #e0, que os ouvintes fixos devem receber
+            serial = iter(range(10 ** 9))
+            stop = threading.Event()
+
+            def connect(prefix):
+                c = servidor.Cliente(ConexaoNula(), ("bench", 0), server)
+                server.clients.add(c)
+                c.handle_command(f"NICK {prefix}{next(serial)}")
+                c.handle_command("USER u 0 * :estresse")
+                return c
+
+            listeners = []
+            for i in range(3):
+                c = servidor.Cliente(ConexaoContadora(b" PRIVMSG #e0 "), ("bench", 0), server)
+                server.clients.add(c)
+                for line in (f"NICK ouvinte{i}", "USER u 0 * :ouvinte", "JOIN #e0"):
+                    c.handle_command(line)
+                listeners.append(c)
+
+            def worker(n):
+                rng = random.Random(n)
+                mine = [connect(f"t{n}x") for _ in range(args.clientes)]
+                while not stop.is_set():
+                    i = rng.randrange(len(mine))
+                    c = mine[i]
+                    channel = f"#e{rng.randrange(args.canais)}"
+                    op = rng.random()
+                    try:
+                        if op < 0.35:
+                            c.handle_command(f"JOIN {channel}")
+                        elif op < 0.65:
+                            c.handle_command(f"PART {channel}")
+                        elif op < 0.9:
+                            c.handle_command(f"PRIVMSG {channel} :estresse")
+                            sent[n] += channel == "#e0"
+                        elif op < 0.97:
+                            c.handle_command(f"NICK t{n}n{next(serial)}")
+                        else:
+                            c.handle_command("QUIT :estresse")
+                            departed.append(c)
+                            mine[i] = connect(f"t{n}r")
+                    except Exception as e:
+                        exceptions.append(repr(e))
+                    counts[n] += 1
+
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+            for t in threads:
+                t.start()
+            time.sleep(args.duracao)
+            stop.set()
+            for t in threads:
+                t.join()
+            errors = registry_errors(servidor, server, departed)
+            for c in listeners:
+                if c.conn.received != sum(sent):
+                    errors.append(f"{c.nick} recebeu {c.conn.received} de {sum(sent)} mensagens para #e0")
+            print(f"{label}: {sum(counts)} comandos ({sum(counts) / args.duracao:.0f}/s) em {args.threads} threads, "
+                  f"{len(server.channels)} canais, "
+                  f"{len(exceptions)} exceções, {len(errors)} inconsistências")
+            for problem in (exceptions + errors)[:5]:
+                print(f"    {problem}")
+            if locked:
+                failed = bool(exceptions or errors)
+    finally:
+        sys.setswitchinterval(interval)
+    if failed:
+        print("Falha: registro inconsistente com as travas ligadas")
+        sys.exit(1)
+
+
+# Memória por conexão ociosa: sem rede, com tracemalloc, mede as estruturas do
+# servidor de `--offline` clientes registrados (NICK/USER) sem canais e confere
+# que canais, índices e filas voltam ao vazio depois de JOIN e PART; com rede,
+# mede o RSS do servidor no modo async com `--conexoes` conexões registradas e
+# paradas. Termina com código 1 se alguma das medidas passar de `--max-kb`
+def bench_memoria(args):
+    import gc
+    import tracemalloc
+    servidor, server = offline_server()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    clients = []
+    for i in range(args.offline):
+        c = servidor.Cliente(ConexaoNula(), ("127.0.0.1", 1024 + i % 60000), server)
+        server.clients.add(c)
+        server.watch(c)
+        c.handle_command(f"NICK o{i:x}")
+        c.handle_command("USER u 0 * :Nome Real")
+        clients.append(c)
+    gc.collect()
+    offline = (tracemalloc.get_traced_memory()[0] - before) / len(clients)
+    tracemalloc.stop()
+    # Canais pequenos: um canal com todos os clientes tornaria cada JOIN (e a lista
+    # de nomes enviada a ele) proporcional ao número de clientes
+    rooms = len(clients) // 4 + 1
+    for i, c in enumerate(clients):
+        c.handle_command(f"JOIN #s{i % rooms},#t{i % (rooms + 7)}")
+    for c in clients:
+        c.handle_command(f"PART {','.join(canal.name for canal in c.channels)}")
+    leftover = (len(server.channels) + sum(c.channels is not servidor.NO_CHANNELS for c in clients)
+                + sum(c.fila.items is not servidor.NO_ITEMS for c in clients))
+    print(f"sem rede: {len(clients)} clientes ociosos, {offline:.0f} bytes por conexão "
+          f"(estruturas do servidor, tracemalloc); estado restante depois do PART: {leftover}")
+
+    proc = start_server(args.porta, "async")
+    try:
+        base = process_status(proc.pid)["VmRSS"]
+        sockets = open_clients(args.conexoes, args.porta, "o")
+        missing = wait_for(sockets, b" 376 ")
+        time.sleep(0.5)
+        rss = process_status(proc.pid)["VmRSS"]
+        for s in sockets:
+            s.close()
+    finally:
+        stop_server(proc)
+    per_conn = (rss - base) / max(args.conexoes - missing, 1)
+    print(f"com rede: {args.conexoes - missing} conexões ociosas, RSS {base} -> {rss} KiB, "
+          f"{per_conn:.2f} KiB por conexão (alvo: {args.max_kb} KiB)")
+    if leftover or missing or per_conn > args.max_kb or offline / 1024 > args.max_kb:
+        print("Falha: memória por conexão acima do alvo ou estado de canal não liberado")
+        sys.exit(1)
+
+
+# Troca a quente com muitas conexões: o servidor com --troca recebe `--conexoes`
+# clientes registrados em `--canais` canais, e um segundo processo com o mesmo
+# --troca assume tudo. Mede o tempo da troca (dos logs dos dois processos) e o
+# maior intervalo sem resposta visto por um cliente que manda PING sem parar.
+# Termina com código 1 se alguma conexão cair ou deixar de responder, se um
+# canal perder membros ou se o processo antigo não terminar
+def bench_troca(args):
+    import tempfile
+    import threading
+    directory = tempfile.mkdtemp(prefix="troca-")
+    path = os.path.join(directory, "troca.sock")
+    logs = [os.path.join(directory, f"servidor{i}.log") for i in range(2)]
+    extra = ["--troca", path, "--flood-taxa", "0"]
+    old = start_server(args.porta, "async", extra + ["--log-arquivo", logs[0]])
+    new = None
+    sockets = []
+    failed = False
+    try:
+        sockets = open_clients(args.conexoes, args.porta, "t")
+        missing = wait_for(sockets, b" 376 ")
+        for i, s in enumerate(sockets):
+            s.sendall(f"JOIN #t{i % args.canais}\r\nPING :pronto\r\n".encode("utf-8"))
+        missing += wait_for(sockets, b"PONG")
+        print(f"{args.conexoes - missing} conexões registradas em {args.canais} canais")
+
+        probe = open_clients(1, args.porta, "sonda")[0]
+        wait_for([probe], b" 376 ")
+        gaps = []
+        running = True
+
+        def ping():
+            probe.settimeout(30)
+            while running:
+                sent = time.perf_counter()
+                probe.sendall(b"PING :sonda\r\n")
+                data = b""
+                while b"PONG" not in data:
+                    data += probe.recv(4096)
+                gaps.append(time.perf_counter() - sent)
+                time.sleep(0.002)
+
+        thread = threading.Thread(target=ping)
+        thread.start()
+        time.sleep(0.2)
+        start = time.perf_counter()
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "servidor.py"),
+               "--porta", str(args.porta), "--modo", "async", *extra, "--log-arquivo", logs[1]]
+        new = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        code = old.wait(60)
+        elapsed = time.perf_counter() - start
+        time.sleep(0.2)
+        running = False
+        thread.join()
+
+        for s in sockets:
+            s.sendall(b"PING :depois\r\n")
+        lost = wait_for(sockets, b"PONG")
+        sockets[0].sendall(b"NAMES #t0\r\n")
+        sockets[0].settimeout(10)
+        data = b""
+        while b" 366 " not in data:
+            data += sockets[0].recv(65536)
+        names = {n for line in data.split(b"\r\n") if b" 353 " in line for n in line.split(b" :", 1)[1].split()}
+        expected = {f"t{i}".encode() for i in range(0, args.conexoes, args.canais)}
+        times = {}
+        for i, log_path in enumerate(logs):
+            for line in open(log_path, encoding="utf-8"):
+                if "troca" in line and "duracao_ms=" in line:
+                    times[line.split('"')[1]] = float(line.rsplit("duracao_ms=", 1)[1])
+        print(f"troca: processo novo iniciado e antigo encerrado em {elapsed:.2f} s (código {code}); "
+              f"conexões entregues pelo antigo em {times.get('Conexões entregues', 0):.1f} ms, "
+              f"assumidas pelo novo em {times.get('Troca a quente concluída', 0):.1f} ms")
+        print(f"PING da sonda: {len(gaps)} respostas, p50 {percentile(gaps, 0.5) * 1000:.2f} ms, "
+              f"maior espera {max(gaps) * 1000:.1f} ms")
+        print(f"depois da troca: {args.conexoes - lost} de {args.conexoes} conexões respondem ao PING; "
+              f"NAMES #t0 com {len(names)} membros (esperados {len(expected)})")
+        failed = code != 0 or lost > 0 or missing > 0 or names != expected
+        probe.close()
+    finally:
+        for s in sockets:
+            s.close()
+        if new is not None:
+            stop_server(new)
+        stop_server(old)
+    if failed:
+        print("Falha: conexões perdidas, canal incompleto ou processo antigo não terminou")
+        sys.exit(1)
+
+
+# Custo do log no caminho de um comando: print síncrono (em arquivo e em um pipe
+# lido devagar, como um terminal) contra o enfileiramento do diario.py com o nível
+# ligado, filtrado pelo nível e amostrado, mais o tempo até a thread de escrita
+# alcançar. Termina com código 1 se algum evento sumir sem ser contado como descartado
+def bench_log(args):
+    import tempfile
+    from diario import Diario
+    directory = tempfile.mkdtemp(prefix="log-")
+    path = os.path.join(directory, "servidor.log")
+    addr = ("127.0.0.1", 50000)
+    line = "PRIVMSG #sala :uma mensagem de tamanho comum para o benchmark"
+    n = args.linhas
+    print(f"{n} linhas por caso, rotação a cada {args.tamanho} KiB")
+    try:
+        with open(os.path.join(directory, "print.log"), "w") as out:
+            timed("print() em arquivo", n, lambda: [print(f"Recebendo comando: {line}", file=out) for _ in range(n)])
+        reader = subprocess.Popen([sys.executable, "-c", SLOW_READER], stdin=subprocess.PIPE)
+        with open(reader.stdin.fileno(), "w", buffering=1, closefd=False) as out:
+            timed("print() em pipe lento", n, lambda: [print(f"Recebendo comando: {line}", file=out) for _ in range(n)])
+        reader.stdin.close()
+        reader.wait()
+
+        cases = (("log.debug (nível debug)", "debug", {}), ("log.debug (nível info)", "info", {}),
+                 ("log.debug (amostra 1/100)", "debug", {"comando": 100}))
+        for label, level, sampling in cases:
+            log = Diario()
+            log.configure(level, path, args.tamanho * 1024, args.copias, sampling)
+            timed(label, n, lambda: [log.debug("comando", "Recebendo comando", addr=addr, linha=line) for _ in range(n)])
+            start = time.perf_counter()
+            log.flush()
+            if level == "debug" and not sampling:
+                print(f"{'':<28} escrita alcançou em {time.perf_counter() - start:.2f} s")
+        written = dropped = files = 0
+        for name in os.listdir(directory):
+            if name.startswith("servidor.log"):
+                files += 1
+                with open(os.path.join(directory, name)) as f:
+                    for entry in f:
+                        if " log " in entry:
+                            dropped += int(entry.rsplit("quantidade=", 1)[1])
+                        else:
+                            written += 1
+        expected = n + n // 100 # Nível debug completo e a amostra de 1 em 100
+        print(f"eventos gravados: {written}, descartados pela fila cheia: {dropped}, "
+              f"esperados: {expected}, arquivos: {files}")
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+    # Com todas as cópias em uso a rotação pode ter apagado o arquivo mais antigo
+    if written + dropped != expected and files <= args.copias:
+        print("Falha: eventos do log se perderam")
+        sys.exit(1)
+
+
+# Leitor de pipe que consome cerca de 4 MB/s, como um terminal ocupado
+SLOW_READER = """
+import sys, time
+while sys.stdin.buffer.read1(4096):
+    time.sleep(0.001)
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do servidor IRC")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("conexoes", help="Compara conexões e memória entre os modos threads e async")
+    p.add_argument("--conexoes", type=int, default=1000)
+    p.add_argument("--porta", type=int, default=16667)
+    p.add_argument("--modos", nargs="+", default=["threads", "async"])
+    p.set_defaults(func=bench_conexoes)
+
+    p = sub.add_parser("registro", help="Microbenchmark do registro de nicks e canais")
+    p.add_argument("--clientes", type=int, default=100000)
+    p.add_argument("--canais", type=int, default=50000)
+    p.add_argument("--por-cliente", type=int, default=3)
+    p.set_defaults(func=bench_registro)
+
+    p = sub.add_parser("sharding", help="Vazão de fan-out por número de workers")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--clientes", type=int, default=400)
+    p.add_argument("--canais", type=int, default=4)
+    p.add_argument("--mensagens", type=int, default=200)
+    p.add_argument("--porta", type=int, default=16767)
+    p.set_defaults(func=bench_sharding)
+
+    p = sub.add_parser("carga", help="Enxame de bots: registro, JOIN, fan-out e QUIT")
+    p.add_argument("--clientes", type=int, default=2000)
+    p.add_argument("--tamanho-canal", type=int, default=50)
+    p.add_argument("--mensagens", type=int, default=100)
+    p.add_argument("--intervalo", type=float, default=10, help="pausa entre rodadas de PRIVMSG (ms)")
+    p.add_argument("--lote", type=int, default=200, help="conexões simultâneas no registro")
+    p.add_argument("--modo", choices=["threads", "async"], default="async")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--porta", type=int, default=16867)
+    p.add_argument("--json", action="store_true", help="saída em JSON")
+    p.add_argument("--salvar", help="grava o resultado em JSON neste arquivo")
+    p.add_argument("--comparar", help="arquivo JSON de uma execução anterior (linha de base)")
+    p.add_argument("--tolerancia", type=float, default=20, help="piora aceita em relação à base (%%)")
+    p.set_defaults(func=bench_carga)
+
+    p = sub.add_parser("flood", help="Abusador inundando um canal, com e sem controle de flood")
+    p.add_argument("--ouvintes", type=int, default=200)
+    p.add_argument("--duracao", type=float, default=5)
+    p.add_argument("--taxa", type=float, default=10, help="--flood-taxa do servidor com controle")
+    p.add_argument("--modo", choices=["threads", "async"], default="async")
+    p.add_argument("--porta", type=int, default=16967)
+    p.set_defaults(func=bench_flood)
+
+    p = sub.add_parser("framer", help="Vazão do enquadrador de linhas com rajadas coladas")
+    p.add_argument("--linhas", type=int, default=50000)
+    p.set_defaults(func=bench_framer)
+
+    p = sub.add_parser("parser", help="Parser de mensagens IRC contra o caminho anterior")
+    p.add_argument("--linhas", type=int, default=50000)
+    p.set_defaults(func=bench_parser)
+
+    p = sub.add_parser("keepalive", help="Custo do keepalive por número de clientes")
+    p.add_argument("--clientes", type=int, nargs="+", default=[1000, 10000, 100000])
+    p.add_argument("--intervalo", type=int, default=30, help="intervalo de PING simulado (s)")
+    p.add_argument("--timeout", type=int, default=10, help="espera pelo PONG simulada (s)")
+    p.set_defaults(func=bench_keepalive)
+
+    p = sub.add_parser("historico", help="Histórico dos canais: gravação, recarga e replay")
+    p.add_argument("--mensagens", type=int, default=500000)
+    p.add_argument("--canais", type=int, default=2000)
+    p.add_argument("--limite", type=int, default=100)
+    p.set_defaults(func=bench_historico)
+
+    p = sub.add_parser("clientes", help="Muitos bots do cliente.py em um único processo")
+    p.add_argument("--bots", type=int, default=500)
+    p.add_argument("--canais", type=int, default=25)
+    p.add_argument("--mensagens", type=int, default=20)
+    p.add_argument("--porta", type=int, default=17067)
+    p.set_defaults(func=bench_clientes)
+
+    p = sub.add_parser("alvos", help="JOIN/PRIVMSG/NAMES com listas de alvos")
+    p.add_argument("--canais", type=int, default=50)
+    p.add_argument("--bots", type=int, default=200)
+    p.add_argument("--porta", type=int, default=17167)
+    p.set_defaults(func=bench_alvos)
+
+    p = sub.add_parser("listas", help="NAMES guardado e LIST em blocos no ritmo do cliente")
+    p.add_argument("--membros", type=int, default=5000, help="Membros do canal do NAMES")
+    p.add_argument("--pedidos", type=int, default=2000, help="Pedidos de NAMES em cada medida")
+    p.add_argument("--canais", type=int, default=30000, help="Canais no LIST")
+    p.add_argument("--espera", type=float, default=1.0, help="Segundos até o leitor começar a ler o LIST")
+    p.add_argument("--modo", choices=("async", "threads"), default="async")
+    p.add_argument("--porta", type=int, default=17368)
+    p.set_defaults(func=bench_listas)
+
+    p = sub.add_parser("tela", help="Saída do cliente interativo: lotes, histórico por canal e /scroll")
+    p.add_argument("--linhas", type=int, default=50000)
+    p.add_argument("--canais", type=int, default=10)
+    p.add_argument("--bloco", type=int, default=100, help="Linhas por leitura do socket")
+    p.add_argument("--custo-us", type=float, default=20, help="Custo de cada write no terminal (µs)")
+    p.set_defaults(func=bench_tela)
+
+    p = sub.add_parser("rede", help="Fan-out em uma rede de servidores ligados, netsplit e colisão")
+    p.add_argument("--servidores", type=int, nargs="+", default=[1, 2, 3])
+    p.add_argument("--clientes", type=int, default=300)
+    p.add_argument("--mensagens", type=int, default=1000)
+    p.add_argument("--porta", type=int, default=17367)
+    p.set_defaults(func=bench_rede)
+
+    p = sub.add_parser("concorrencia", help="Estresse do registro com JOIN/PART/PRIVMSG/NICK/QUIT em threads")
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--clientes", type=int, default=20, help="clientes por thread")
+    p.add_argument("--canais", type=int, default=4)
+    p.add_argument("--duracao", type=float, default=3, help="segundos de cada rodada")
+    p.add_argument("--troca", type=float, default=5, help="intervalo de troca de threads (µs)")
+    p.set_defaults(func=bench_concorrencia)
+
+    p = sub.add_parser("memoria", help="Memória por conexão ociosa, com alvo máximo")
+    p.add_argument("--offline", type=int, default=100000, help="clientes medidos sem rede")
+    p.add_argument("--conexoes", type=int, default=10000, help="conexões reais medidas pelo RSS")
+    p.add_argument("--max-kb", type=float, default=3.5, help="KiB por conexão aceitos")
+    p.add_argument("--porta", type=int, default=17267)
+    p.set_defaults(func=bench_memoria)
+
+    p = sub.add_parser("troca", help="Troca a quente do servidor com muitas conexões abertas")
+    p.add_argument("--conexoes", type=int, default=10000)
+    p.add_argument("--canais", type=int, default=100)
+    p.add_argument("--porta", type=int, default=17369)
+    p.set_defaults(func=bench_troca)
+
+    p = sub.add_parser("log", help="Custo do log assíncrono contra print síncrono")
+    p.add_argument("--linhas", type=int, default=50000)
+    p.add_argument("--tamanho", type=int, default=1024, help="KiB por arquivo antes da rotação")
+    p.add_argument("--copias", type=int, default=3)
+    p.set_defaults(func=bench_log)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
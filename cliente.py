@@ -1,222 +1,666 @@
+import argparse
+import heapq
+import os
+import selectors
 import signal
 import socket
-import threading
+import sys
 import time
+from collections import deque
+from itertools import count, islice
 
+from protocolo import RECV_SIZE, Enquadrador, pack_items, parse_message
+
+# Saída no terminal (modo interativo)
+SCROLLBACK = 1000      # Linhas guardadas por canal
+RENDER_INTERVAL = 0.05 # Segundos entre as escritas no terminal
+RENDER_MAX = 200       # Linhas escritas por lote; o excesso fica só no histórico (/scroll)
+PAGE = 20              # Linhas por página do /scroll e ao trocar de canal
+
+# Comandos cujo primeiro parâmetro é o canal, e numéricos com o canal em outra posição
+CHANNEL_COMMANDS = ("PRIVMSG", "NOTICE", "JOIN", "PART")
+CHANNEL_NUMERICS = {"353": 2, "366": 1}
+
+
+# Laço de eventos do cliente (selectors). Um único laço atende a entrada do usuário
+# e qualquer número de conexões, então centenas de bots rodam no mesmo processo sem
+# uma thread por conexão. O que os clientes enviam durante uma volta do laço fica
+# acumulado e sai em um único send por conexão no fim da volta
+class Laco:
 
-class Cliente:
     def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.pending = set() # Clientes com dados na fila de saída
+        self.timers = []     # heap de (momento, ordem, callback)
+        self.order = count()
+
+    # Chama `callback` daqui a `delay` segundos, em uma volta do laço
+    def call_later(self, delay, callback):
+        heapq.heappush(self.timers, (time.monotonic() + delay, next(self.order), callback))
+
+    def run_timers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            heapq.heappop(self.timers)[2]()
+
+    def register(self, fileobj, events, callback):
+        self.selector.register(fileobj, events, callback)
+
+    def modify(self, fileobj, events, callback):
+        self.selector.modify(fileobj, events, callback)
+
+    def unregister(self, fileobj):
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    # Descarrega a saída acumulada de cada cliente
+    def flush(self):
+        while self.pending:
+            self.pending.pop().flush()
+
+    # Uma volta: espera eventos por até `timeout` segundos (menos, se um timer
+    # vencer antes) e chama os callbacks
+    def run_once(self, timeout=None):
+        self.flush()
+        if self.timers:
+            wait = max(self.timers[0][0] - time.monotonic(), 0)
+            timeout = wait if timeout is None else min(timeout, wait)
+        if not self.selector.get_map():
+            if timeout:
+                time.sleep(timeout)
+        else:
+            for key, mask in self.selector.select(timeout):
+                key.data(mask)
+        self.run_timers()
+        self.flush()
+
+    # Roda até `until()` ser verdadeiro (ou para sempre, sem `until`); devolve False
+    # se `timeout` segundos passarem antes disso
+    def run(self, until=None, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while until is None or not until():
+            if deadline is None:
+                self.run_once(1)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.run_once(min(remaining, 1))
+        return True
+
+
+# Saída do cliente interativo. Cada linha recebida vai para o histórico do seu
+# canal (um anel de SCROLLBACK linhas; as que não são de canal nenhum ficam no
+# histórico None) e só as do canal atual e as sem canal vão para o terminal, em
+# lotes: a cada RENDER_INTERVAL segundos um único write com o que chegou. Um lote
+# com mais de RENDER_MAX linhas escreve só as últimas. Os outros canais só contam
+# as linhas não lidas. Sem canal atual, todas as linhas são escritas
+class Tela:
+
+    def __init__(self, laco, saida=None):
+        self.laco = laco
+        self.saida = saida      # None escreve em sys.stdout
+        self.todos = False      # Escreve as linhas de todos os canais (modo sem terminal)
+        self.historico = {}     # canal (minúsculas) -> deque das linhas
+        self.nao_lidas = {}     # canal -> linhas que chegaram fora da tela
+        self.atual = None
+        self.rolagem = 0        # Linhas acima do fim no /scroll (0: acompanhando o canal)
+        self.lote = []          # Linhas esperando a próxima escrita
+        self.omitidas = 0
+        self.agendada = False
+        self.escritas = 0
+
+    def mostrar(self, canal, linha):
+        chave = canal.lower() if canal is not None else None
+        anel = self.historico.get(chave)
+        if anel is None:
+            anel = self.historico[chave] = deque(maxlen=SCROLLBACK)
+        anel.append(linha)
+        if chave is not None and not self.todos and self.atual is not None and (chave != self.atual or self.rolagem):
+            self.nao_lidas[chave] = self.nao_lidas.get(chave, 0) + 1
+            return
+        self.lote.append(linha)
+        if len(self.lote) > 2 * RENDER_MAX: # O lote não cresce sem limite entre duas escritas
+            self.omitidas += len(self.lote) - RENDER_MAX
+            del self.lote[:-RENDER_MAX]
+        if not self.agendada:
+            self.agendada = True
+            self.laco.call_later(RENDER_INTERVAL, self.desenhar)
+
+    # Escreve o lote pendente
+    def desenhar(self):
+        self.agendada = False
+        lote, self.lote = self.lote, []
+        omitidas = self.omitidas + max(len(lote) - RENDER_MAX, 0)
+        self.omitidas = 0
+        if omitidas:
+            lote = [f"-- {omitidas} linhas omitidas (/scroll para ver) --"] + lote[-RENDER_MAX:]
+        if lote:
+            self.escrever("\n".join(lote))
+
+    # Mensagens do próprio cliente: saem na hora, depois do que estava pendente
+    def avisar(self, texto):
+        self.desenhar()
+        self.escrever(texto)
+
+    def escrever(self, texto):
+        saida = self.saida or sys.stdout
+        saida.write(texto + "\n")
+        saida.flush()
+        self.escritas += 1
+
+    # Troca o canal exibido; com `exibir` mostra a última página dele e as não lidas
+    def selecionar(self, canal, exibir=False):
+        self.desenhar()
+        self.atual = canal.lower() if canal is not None else None
+        self.rolagem = 0
+        novas = self.nao_lidas.pop(self.atual, 0)
+        if exibir and canal is not None:
+            anel = self.historico.get(self.atual, ())
+            pagina = list(islice(anel, max(len(anel) - max(PAGE, min(novas, RENDER_MAX)), 0), None))
+            self.escrever("\n".join([f"-- {canal}: {novas} não lidas --"] + pagina))
+
+    # /scroll [n]: n páginas para trás; "+" uma página para frente; "fim" volta a
+    # acompanhar o canal. Enquanto a tela está rolada, as linhas novas do canal
+    # atual só contam como não lidas
+    def rolar(self, arg=""):
+        self.desenhar()
+        anel = self.historico.get(self.atual, ())
+        if arg == "fim":
+            self.rolagem = 0
+        elif arg == "+":
+            self.rolagem = max(self.rolagem - PAGE, 0)
+        else:
+            paginas = int(arg) if arg.isdigit() else 1
+            self.rolagem = min(self.rolagem + paginas * PAGE, max(len(anel) - PAGE, 0))
+        fim = len(anel) - self.rolagem
+        pagina = list(islice(anel, max(fim - PAGE, 0), fim))
+        titulo = f"-- {self.atual or 'servidor'}: linhas {fim - len(pagina) + 1}-{fim} de {len(anel)}"
+        if self.rolagem:
+            titulo += " (/scroll fim volta ao fim)"
+        elif self.atual is not None and self.nao_lidas.get(self.atual):
+            titulo += f", {self.nao_lidas.pop(self.atual)} novas"
+        self.escrever("\n".join([titulo + " --"] + pagina))
+
+    def resumo(self, canais):
+        return ", ".join(f"{c} ({self.nao_lidas[c.lower()]} não lidas)" if self.nao_lidas.get(c.lower()) else c
+                         for c in canais)
+
+
+# Canal a que uma mensagem recebida pertence (None: mensagem do servidor)
+def canal_da_mensagem(msg):
+    if msg.command in CHANNEL_COMMANDS:
+        index = 0
+    else:
+        index = CHANNEL_NUMERICS.get(msg.command)
+        if index is None:
+            return None
+    if len(msg.params) > index and msg.params[index][:1] == "#":
+        return msg.params[index]
+    return None
+
+
+class Cliente:
+    def __init__(self, laco=None, eco=True):
         self.conectado = False
         self.socket = None
         self.nick = None
-        self.buffer = ""
+        self.framer = Enquadrador()
         self.current_channel = None
         self.channels = set()
+        self.laco = laco or Laco()
+        self.eco = eco             # Imprime as linhas recebidas (modo interativo)
+        self.tela = Tela(self.laco) if eco else None
+        self.handlers = {}         # comando -> callbacks chamados com (cliente, mensagem)
+        self.fila_eventos = None   # Mensagens guardadas enquanto eventos() está em uso
+        self.saida = []            # Linhas codificadas esperando o próximo envio
+        self.parcial = b""         # Resto de um envio parcial
+        self.conectando = False    # connect() não bloqueante em andamento
+        self.registrado = False
+        self.envios = 0            # Chamadas de send (várias linhas por envio)
+        self.linhas_enviadas = 0
+        self.entrada = None        # Enquadrador da entrada padrão (modo interativo/script)
+        self.perguntas = deque()   # Respostas esperadas na entrada ("nick", "nome real")
+        self.respostas = []
+        self.sair = False
 
         # Exceção para alarme de tempo (não alterar esta linha)
         signal.signal(signal.SIGALRM, self.exception_handler)
 
+    # Modo interativo: a entrada padrão entra no mesmo laço das conexões
     def executar(self):
         print("Cliente IRC iniciado!")
-        
-        while True:
-            
-            try:
-                cmd = input()
-            except Exception as e:
-                print(f"Erro ao receber comando: {e}")
-                continue
-            
-            partes = cmd.split()
-            comando = partes[0].lower()
+        self.ler_entrada()
+        self.laco.run(lambda: self.sair)
+        self.encerrar()
 
-            if comando == "/nick":
-                if len(partes) >= 2:
-                    self.nick_command(partes[1])
-                else:
-                    print("Uso: /nick <username>")
-            
-            elif comando == "/connect":
-                if len(partes) >= 2:
-                    self.conectar(partes[1])
-                else:
-                    print("Uso: /connect <ip>")
-            elif comando == "/disconnect":
-                motivo = " ".join(partes[1:]) if len(partes) > 1 else ""
-                self.quit_command(motivo)
-            elif comando == "/quit":
-                motivo = " ".join(partes[1:]) if len(partes) > 1 else ""
-                self.quit_command(motivo)
-                break
-            elif comando == "/join":
-                if len(partes) >= 2:
-                    self.join_command(partes[1])
-                else:
-                    print("Uso: /join <canal>")
-            elif comando == "/leave":
-                if len(partes) >= 2:
-                    self.part_command(partes[1], " ".join(partes[2:]))
-                else:
-                    print("Uso: /leave <canal> <motivo>")
-            elif comando == "/channel":
-                if len(partes) >= 2:
-                    if partes[1] in self.channels:
-                        self.current_channel = partes[1]
-                        print(f"Canal atual: {self.current_channel}")
-                    else:
-                        print("Você não está neste canal")
-                else:
-                    print(f"Canais: {', '.join(self.channels)}")
-            elif comando == "/list":
-                if len(partes) >= 2:
-                    self.list_command(partes[1])
-                else:
-                    print("Uso: /list <canal>")
-            elif comando == "/names":
-                if len(partes) >= 2:
-                    self.names_command(partes[1])
-                elif self.current_channel:
-                    self.names_command(self.current_channel)
+    # Espera o servidor fechar a conexão depois do QUIT (no máximo `timeout` s)
+    def encerrar(self, timeout=2):
+        self.laco.run(lambda: not self.conectado, timeout)
+        self.fechar()
+        if self.tela is not None:
+            self.tela.desenhar()
+
+    # Registra a entrada padrão no laço; cada linha lida vai para `tratar` (padrão:
+    # tratar_entrada). Lida em blocos com os.read (e não com input()) para não
+    # bloquear o laço; no fim da entrada chama `fim` ou encerra o cliente
+    def ler_entrada(self, tratar=None, fim=None):
+        tratar = tratar or self.tratar_entrada
+        self.entrada = Enquadrador(max_line=4096)
+        fd = sys.stdin.fileno()
+
+        def readable(mask):
+            data = os.read(fd, RECV_SIZE)
+            if not data:
+                self.laco.unregister(fd)
+                if fim is not None:
+                    fim()
                 else:
-                    print("Uso: /names <canal>")
-            elif comando == "/msg":
-                if len(partes) >= 3:
-                    self.privmsg_command(partes[1], " ".join(partes[2:]))
-                elif self.current_channel and len(partes) >= 2:
-                    self.privmsg_command(self.current_channel, " ".join(partes[1:]))
+                    self.sair = True
+                return
+            for linha in self.entrada.feed(data):
+                tratar(linha)
+
+        self.laco.register(fd, selectors.EVENT_READ, readable)
+
+    # Mensagens do próprio cliente passam pela Tela, para não saírem antes das linhas
+    # recebidas que ainda esperam o próximo lote
+    def avisar(self, texto):
+        if self.tela is not None:
+            self.tela.avisar(texto)
+        else:
+            print(texto)
+
+    def tratar_entrada(self, cmd):
+        if self.perguntas:
+            self.responder(cmd)
+            return
+        partes = cmd.split()
+        if not partes:
+            return
+        comando = partes[0].lower()
+
+        if comando == "/nick":
+            if len(partes) >= 2:
+                self.nick_command(partes[1])
+            else:
+                self.avisar("Uso: /nick <username>")
+
+        elif comando == "/connect":
+            if len(partes) >= 2:
+                self.conectar(partes[1])
+            else:
+                self.avisar("Uso: /connect <ip>")
+        elif comando == "/disconnect":
+            motivo = " ".join(partes[1:]) if len(partes) > 1 else ""
+            self.quit_command(motivo)
+        elif comando == "/quit":
+            motivo = " ".join(partes[1:]) if len(partes) > 1 else ""
+            self.quit_command(motivo)
+            self.sair = True
+        elif comando == "/join":
+            if len(partes) >= 2:
+                self.join_command(partes[1:])
+            else:
+                self.avisar("Uso: /join <canal>")
+        elif comando == "/leave":
+            if len(partes) >= 2:
+                self.part_command(partes[1], " ".join(partes[2:]))
+            else:
+                self.avisar("Uso: /leave <canal> <motivo>")
+        elif comando == "/channel":
+            if len(partes) >= 2:
+                if partes[1] in self.channels:
+                    self.current_channel = partes[1]
+                    if self.tela is not None:
+                        self.tela.selecionar(partes[1], exibir=True)
+                    self.avisar(f"Canal atual: {self.current_channel}")
                 else:
-                    print("Uso: /msg <canal> <mensagem> ou /msg <mensagem>")
-    
-            elif comando == "/help":
-                self.mostrar_ajuda()
-            
-            elif comando == "ping":
-                self.send_ping(" ".join(partes[1:]))
+                    self.avisar("Você não está neste canal")
+            elif self.tela is not None:
+                self.avisar(f"Canais: {self.tela.resumo(self.channels)}")
+            else:
+                self.avisar(f"Canais: {', '.join(self.channels)}")
+        elif comando == "/scroll":
+            if self.tela is not None:
+                self.tela.rolar(partes[1] if len(partes) >= 2 else "")
+        elif comando == "/list":
+            self.list_command(" ".join(partes[1:]))
+        elif comando == "/names":
+            if len(partes) >= 2:
+                self.names_command(partes[1:])
+            elif self.current_channel:
+                self.names_command(self.current_channel)
             else:
-                print("Comando não reconhecido. Digite /help para ver os comandos disponíveis.")
-                #if self.current_channel:
-                #    self.privmsg_command(self.current_channel, " ".join(partes[0:]))
-                #else:
-                #    print("Comando não reconhecido. Digite /help para ver os comandos disponíveis.")
+                self.avisar("Uso: /names <canal>")
+        elif comando == "/msg":
+            if len(partes) >= 3:
+                self.privmsg_command(partes[1], " ".join(partes[2:]))
+            elif self.current_channel and len(partes) >= 2:
+                self.privmsg_command(self.current_channel, " ".join(partes[1:]))
+            else:
+                self.avisar("Uso: /msg <canal> <mensagem> ou /msg <mensagem>")
+
+        elif comando == "/help":
+            self.mostrar_ajuda()
+
+        elif comando == "ping":
+            self.send_ping(" ".join(partes[1:]))
+        elif comando == "/raw":
+            self.enviar_dados(cmd.split(None, 1)[1] if len(partes) > 1 else "")
+        else:
+            self.avisar("Comando não reconhecido. Digite /help para ver os comandos disponíveis.")
+            #if self.current_channel:
+            #    self.privmsg_command(self.current_channel, " ".join(partes[0:]))
+            #else:
+            #    print("Comando não reconhecido. Digite /help para ver os comandos disponíveis.")
 
 
-    def check_server_messages(self):
-        if self.conectado:
-            data = self.receber_dados()
-            if data:
-                self.processar_comando(data)
     # Tratamento de exceção para alarme de tempo (não alterar este método)
     def exception_handler(self, signum, frame):
         raise Exception("EXCEÇÃO (timeout)")
 
-    def conectar(self, host, port=6667):
+    # Abre a conexão sem bloquear. Sem nick, pergunta o nick e o nome real na entrada
+    # (modo interativo); com nick, já enfileira NICK e USER, que saem assim que a
+    # conexão completar, junto com o que mais for enviado até lá
+    def conectar(self, host, port=6667, nick=None, realname=None):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((host, port))
+            self.socket.setblocking(False)
+            self.conectando = True
             self.conectado = True
-            threading.Thread(target=self.receber_dados).start()
-
-            # Solicita nick e user do usuário
-            nick = input("Digite seu nick: ")
-            realname = input("Digite seu nome real: ")
-
-            self.nick_command(nick)
-            self.user_command(nick, realname)
-            
+            self.socket.connect_ex((host, port))
+            self.laco.register(self.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, self.on_ready)
         except Exception as e:
-            print(f"Erro ao conectar ao servidor: {e}")
+            self.avisar(f"Erro ao conectar ao servidor: {e}")
             self.conectado = False
+            return
+        if nick is None:
+            # Solicita nick e user do usuário
+            self.perguntas.extend(("Digite seu nick: ", "Digite seu nome real: "))
+            self.perguntar()
+        else:
+            self.registrar(nick, realname or nick)
+
+    # A pergunta fica sem quebra de linha; o que já chegou sai antes dela
+    def perguntar(self):
+        if self.tela is not None:
+            self.tela.desenhar()
+        print(self.perguntas[0], end="", flush=True)
+
+    def responder(self, resposta):
+        self.perguntas.popleft()
+        self.respostas.append(resposta)
+        if self.perguntas:
+            self.perguntar()
+            return
+        nick, realname = self.respostas
+        self.respostas = []
+        self.registrar(nick, realname)
 
+    def registrar(self, nick, realname):
+        self.nick_command(nick)
+        self.user_command(nick, realname)
+
+    # Callback do laço para o socket do servidor
+    def on_ready(self, mask):
+        if self.conectando:
+            if not mask & selectors.EVENT_WRITE:
+                return
+            erro = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if erro:
+                self.avisar(f"Erro ao conectar ao servidor: {os.strerror(erro)}")
+                self.fechar()
+                return
+            self.conectando = False
+            self.flush()
+            return
+        if mask & selectors.EVENT_WRITE:
+            self.flush()
+        if mask & selectors.EVENT_READ and self.conectado:
+            self.receber_dados()
+
+    # Enfileira uma linha; o envio acontece no fim da volta do laço, junto com as
+    # outras linhas enfileiradas até lá (pipelining: não espera pela resposta)
     def enviar_dados(self, msg):
         if self.conectado:
+            self.saida.append(f"{msg}\r\n".encode("utf-8"))
+            self.laco.pending.add(self)
+
+    # Envia tudo o que estiver na fila com um único send; o que não couber no
+    # socket espera o próximo evento de escrita
+    def flush(self):
+        if self.conectando or not self.conectado:
+            return
+        if self.saida:
+            self.linhas_enviadas += len(self.saida)
+            self.parcial += b"".join(self.saida)
+            self.saida = []
+        if self.parcial:
             try:
-                self.socket.sendall(f"{msg}\r\n".encode("utf-8"))
+                enviado = self.socket.send(self.parcial)
+                self.envios += 1
+            except (BlockingIOError, InterruptedError):
+                enviado = 0
             except Exception as e:
-                print(f"Erro ao enviar dados: {e}")
+                self.avisar(f"Erro ao enviar dados: {e}")
+                self.fechar()
+                return
+            self.parcial = self.parcial[enviado:]
+        eventos = selectors.EVENT_READ | (selectors.EVENT_WRITE if self.parcial else 0)
+        self.laco.modify(self.socket, eventos, self.on_ready)
 
+    # Chamado pelo laço quando o socket tem dados
     def receber_dados(self):
-        while self.conectado:
-            try:
-                data = self.socket.recv(1024).decode("utf-8")
-                if data:
-                    self.buffer += data
-                    while "\r\n" in self.buffer:
-                        linha, self.buffer = self.buffer.split("\r\n", 1)
-                        self.processar_comando(linha)
-                else:
-                    self.conectado = False
-            except Exception as e:
-                print(f"Erro ao receber dados: {e}")
-                self.conectado = False
+        try:
+            linhas = self.framer.recv_from(self.socket, scratch)
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception as e:
+            self.avisar(f"Erro ao receber dados: {e}")
+            linhas = None
+        if linhas is None:
+            self.fechar()
+            return
+        for linha in linhas:
+            self.processar_comando(linha)
+
+    def fechar(self):
+        if self.socket is not None:
+            self.laco.unregister(self.socket)
+            self.socket.close()
+        self.conectado = False
+        self.conectando = False
+        self.laco.pending.discard(self)
 
     def processar_comando(self, linha):
-        parts = linha.split()
-        if parts[0] == "PING":
-            mensagem = parts[1]
-            self.pong_resp(mensagem)
+        msg = parse_message(linha)
+        if msg is None:
+            return
+        if msg.command == "PING":
+            self.pong_resp(msg.rest(0))
         else:
-            print(linha)
-        
+            if msg.command == "001":
+                self.registrado = True
+            if self.tela is not None:
+                self.tela.mostrar(canal_da_mensagem(msg), linha)
+        self.emitir(msg)
+
+    # API de eventos: on("PRIVMSG", f) chama f(cliente, mensagem) a cada PRIVMSG
+    # recebida; "*" recebe todas as mensagens
+    def on(self, comando, callback):
+        self.handlers.setdefault(comando.upper(), []).append(callback)
+
+    def emitir(self, msg):
+        for callback in self.handlers.get(msg.command, ()):
+            callback(self, msg)
+        for callback in self.handlers.get("*", ()):
+            callback(self, msg)
+        if self.fila_eventos is not None:
+            self.fila_eventos.append(msg)
+
+    # Iterador de eventos: roda o laço e devolve cada mensagem recebida. Termina
+    # quando a conexão fecha ou quando passam `timeout` segundos sem nada chegar
+    def eventos(self, timeout=None):
+        self.fila_eventos = deque()
+        try:
+            while True:
+                while self.fila_eventos:
+                    yield self.fila_eventos.popleft()
+                if not self.conectado:
+                    return
+                if not self.laco.run(lambda: self.fila_eventos or not self.conectado, timeout):
+                    return
+        finally:
+            self.fila_eventos = None
+
+    # Roda o laço até chegar uma mensagem com o comando (ou numérico) pedido e a
+    # devolve; None se a conexão fechar ou o tempo acabar
+    def esperar(self, comando, timeout=None):
+        encontrada = []
+
+        def achou(cliente, msg):
+            encontrada.append(msg)
+
+        self.on(comando, achou)
+        try:
+            self.laco.run(lambda: encontrada or not self.conectado, timeout)
+        finally:
+            self.handlers[comando.upper()].remove(achou)
+        return encontrada[0] if encontrada else None
 
     def nick_command(self, username):
         self.nick = username
         self.enviar_dados(f"NICK {username}")
 
     def user_command(self, username, realname):
-        self.enviar_dados(f"USER {username} 0 = {realname}")
+        self.enviar_dados(f"USER {username} 0 = :{realname}")
 
-    def join_command(self, canal):
-        self.enviar_dados(f"JOIN {canal}")
-        self.channels.add(canal)
-        self.current_channel = canal
+    # Canais de um texto "#a,#b" ou de uma lista de textos, sem repetidos
+    def alvos(self, canais):
+        if isinstance(canais, str):
+            canais = [canais]
+        return list(dict.fromkeys(c for item in canais for c in item.split(",") if c))
 
-    def part_command(self, canal, motivo):
-        self.enviar_dados(f"PART {canal} {motivo}")
-        self.channels.discard(canal)
-        if self.current_channel == canal:
+    # Vários canais saem em um único JOIN ("JOIN #a,#b,#c"), dividido em mais
+    # linhas só se passar do tamanho máximo de uma linha IRC
+    def join_command(self, canais):
+        canais = self.alvos(canais)
+        if not canais:
+            return
+        for linha in pack_items("JOIN ", canais, ","):
+            self.enviar_dados(linha)
+        self.channels.update(canais)
+        self.current_channel = canais[-1]
+        if self.tela is not None:
+            self.tela.selecionar(self.current_channel)
+
+    def part_command(self, canais, motivo):
+        canais = self.alvos(canais)
+        for linha in pack_items("PART ", canais, ",", f" :{motivo}"):
+            self.enviar_dados(linha)
+        self.channels.difference_update(canais)
+        if self.current_channel in canais:
             self.current_channel = None
+            if self.tela is not None:
+                self.tela.selecionar(None)
 
+    # O QUIT sai junto com o que ainda estiver na fila; quem fecha a conexão é o
+    # servidor, depois de responder (as respostas pendentes ainda são lidas)
     def quit_command(self, motivo):
-        self.enviar_dados(f"QUIT {motivo}")
-        self.conectado = False
-        self.socket.close()
-             
+        self.enviar_dados(f"QUIT :{motivo}")
+
 
     def privmsg_command(self, canal, mensagem):
-        self.enviar_dados(f"PRIVMSG {canal} {mensagem}")
+        self.enviar_dados(f"PRIVMSG {canal} :{mensagem}")
 
-    def names_command(self, canal):
-        self.enviar_dados(f"NAMES {canal}")
+    def names_command(self, canais):
+        for linha in pack_items("NAMES ", self.alvos(canais), ","):
+            self.enviar_dados(linha)
 
-    def list_command(self, canal):
-        self.enviar_dados(f"LIST {canal}")
+    # Filtros opcionais: ">10", "<5", "#jogo*", "!#teste*" ou nomes de canais
+    def list_command(self, filtros=""):
+        self.enviar_dados(f"LIST {filtros}".rstrip())
 
     def pong_resp(self, msg):
-        self.enviar_dados(f"PONG {msg}")
+        self.enviar_dados(f"PONG :{msg}")
 
     def send_ping(self, mensagem):
-        self.enviar_dados(f"PING {mensagem}")
+        self.enviar_dados(f"PING :{mensagem}")
 
     def mostrar_ajuda(self):
-        print(
+        self.avisar(
             """
 Comandos disponíveis:
 /nick <username>        - Define o nickname do usuário
 /connect <host>         - Conecta ao servidor IRC
 /disconnect <motivo>    - Desconecta do servidor IRC
 /quit <motivo>          - Sai do cliente IRC
-/join <canal>          - Entra em um canal
-/leave <canal> <motivo> - Sai de um canal
-/channel <#canal>       - Define o canal atual ou lista os canais que está participando
-/list                   - Lista os canais disponíveis
-/names <canal>         - Lista os usuários em um canal
-/msg <canal> <mensagem> - Envia uma mensagem para um canal
+/join <canal> [...]     - Entra em um ou mais canais (um único JOIN)
+/leave <canal> <motivo> - Sai de um canal (ou de vários: #a,#b)
+/channel <#canal>       - Define o canal atual (mostra as não lidas) ou lista os canais com as não lidas
+/scroll [n|+|fim]       - Volta n páginas no histórico do canal atual, avança uma ou volta ao fim
+/list [filtros]         - Lista os canais disponíveis (>n, <n, máscara, !máscara)
+/names <canal> [...]    - Lista os usuários de um ou mais canais
+/msg <canal> <mensagem> - Envia uma mensagem para um canal (ou vários: #a,#b)
+/raw <linha IRC>        - Envia uma linha IRC sem alteração
 /help                   - Mostra esta mensagem de ajuda
             """
         )
 
 
+# Buffer de leitura compartilhado: o laço é de uma thread só, então todas as
+# conexões do processo podem ler no mesmo bytearray
+scratch = bytearray(RECV_SIZE)
+
+
+# Modo sem terminal: conecta, registra e manda as linhas do script (ou da entrada
+# padrão, conforme chegam) sem esperar as respostas. Linhas com "/" são comandos do
+# cliente; as demais vão para o servidor como estão. Ao fim da entrada espera
+# `esperar` segundos pelas últimas respostas e sai com QUIT
+def executar_script(args):
+    c = Cliente()
+    c.tela.todos = True # Sem terminal, as linhas de todos os canais saem (em lotes)
+    c.conectar(args.host, args.porta, args.nick, args.nome)
+
+    def fim():
+        c.laco.run(lambda: not c.conectado, args.esperar)
+        if not c.sair:
+            c.quit_command("")
+        c.sair = True
+
+    def linha(texto):
+        if texto.startswith("/"):
+            c.tratar_entrada(texto)
+        elif texto.strip():
+            c.enviar_dados(texto)
+
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            for texto in f:
+                linha(texto.rstrip("\r\n"))
+        fim()
+    else:
+        c.ler_entrada(linha, fim)
+    c.laco.run(lambda: c.sair or not c.conectado)
+    c.encerrar()
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Cliente IRC")
+    parser.add_argument("--host", help="servidor; com --nick roda sem terminal (script ou entrada padrão)")
+    parser.add_argument("--porta", type=int, default=6667)
+    parser.add_argument("--nick")
+    parser.add_argument("--nome", help="nome real (padrão: o nick)")
+    parser.add_argument("--script", help="arquivo com uma linha por comando (padrão: entrada padrão)")
+    parser.add_argument("--esperar", type=float, default=1,
+                        help="segundos esperando respostas depois da última linha")
+    args = parser.parse_args()
+    if args.host and args.nick:
+        executar_script(args)
+        return
     c = Cliente()
     c.executar()
 
@@ -0,0 +1,209 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from json.encoder import encode_basestring
+
+# Log do servidor. Quem registra um evento só testa o nível, decide a amostragem
+# e coloca uma tupla em uma deque (append atômico, sem lock); a formatação e a
+# escrita acontecem em uma thread em segundo plano, em lotes, com rotação do
+# arquivo por tamanho. As linhas saem no formato chave=valor (logfmt).
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"debug": DEBUG, "info": INFO, "aviso": WARNING, "erro": ERROR}
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "AVISO", ERROR: "ERRO"}
+
+# Eventos aguardando a thread de escrita; acima disso novos eventos são descartados
+MAX_QUEUE = 100000
+
+# Comandos cujo texto final é conteúdo de usuário (ocultado sem --log-conteudo)
+# e comandos com senha (sempre ocultada)
+BODY_COMMANDS = ("PRIVMSG", "NOTICE")
+SECRET_COMMANDS = ("OPER", "PASS")
+
+
+# Esconde o conteúdo de uma linha IRC recebida: o texto das mensagens vira o
+# tamanho em bytes e as senhas viram "***"
+def redact(line, bodies=False):
+    command = line.split(" ", 1)[0].upper()
+    if command in SECRET_COMMANDS:
+        return f"{command} ***"
+    if not bodies and command in BODY_COMMANDS:
+        head, sep, text = line.partition(" :")
+        if sep:
+            return f"{head} :<{len(text.encode('utf-8'))} bytes>"
+    return line
+
+
+# Valores com espaço, aspas, "=", barra invertida ou caracteres de controle vão entre aspas
+NEEDS_QUOTES = re.compile(r'[\s"=\\\x00-\x1f\x7f]')
+
+
+def format_value(value):
+    kind = type(value)
+    if kind is int:
+        return str(value)
+    if kind is tuple: # Endereços (host, porta) saem como host:porta
+        value = ":".join(map(str, value))
+    text = value if type(value) is str else str(value)
+    if not text or NEEDS_QUOTES.search(text):
+        return encode_basestring(text)
+    return text
+
+
+class Diario:
+
+    def __init__(self):
+        self.level = INFO
+        self.sampling = {}  # categoria -> registra 1 a cada N eventos
+        self.counters = {}  # categoria -> eventos vistos (para a amostragem)
+        self.bodies = False # Registrar o texto das mensagens dos usuários
+        self.path = None    # None escreve na saída padrão
+        self.max_bytes = 10 * 1024 * 1024
+        self.backups = 3
+        self.interval = 0.05 # Intervalo entre os lotes da thread de escrita (s)
+        self.queue = deque()
+        self.dropped = 0
+        self.file = None
+        self.size = 0
+        self.messages = {}  # mensagem -> texto já formatado
+        self.second = None # Último segundo formatado e o seu prefixo de data
+        self.stamp = ""
+        self.thread = None
+        self.write_lock = threading.Lock() # Entre a thread de escrita e o flush()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def configure(self, level="info", path=None, max_bytes=None, backups=None, sampling=None, bodies=False):
+        self.level = LEVELS[level]
+        self.path = path
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if backups is not None:
+            self.backups = backups
+        self.sampling = dict(sampling or {})
+        self.bodies = bodies
+        self.open()
+
+    # Caminho rápido: nível, amostragem e um append na deque
+    def log(self, level, category, message, **fields):
+        if level < self.level:
+            return
+        every = self.sampling.get(category)
+        if every is not None:
+            seen = self.counters.get(category, 0) + 1
+            self.counters[category] = seen
+            if seen % every:
+                return
+        if len(self.queue) >= MAX_QUEUE:
+            self.dropped += 1
+            return
+        self.queue.append((time.time(), level, category, message, fields))
+        if self.thread is None:
+            self.start()
+
+    # O debug fica no caminho de cada comando: o nível é testado antes da chamada
+    def debug(self, category, message, **fields):
+        if self.level <= DEBUG:
+            self.log(DEBUG, category, message, **fields)
+
+    def info(self, category, message, **fields):
+        self.log(INFO, category, message, **fields)
+
+    def warning(self, category, message, **fields):
+        self.log(WARNING, category, message, **fields)
+
+    def error(self, category, message, **fields):
+        self.log(ERROR, category, message, **fields)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # A thread de escrita não sobrevive ao fork (--workers): o filho cria a sua,
+    # e os eventos pendentes ficam por conta do processo pai
+    def after_fork(self):
+        self.thread = None
+        self.queue.clear()
+        self.write_lock = threading.Lock()
+
+    # Troca o arquivo de destino (cada worker do --workers escreve no seu)
+    def reopen(self, path):
+        self.path = path
+        self.open()
+
+    def open(self):
+        if self.file is not None and self.file is not sys.stdout:
+            self.file.close()
+        if self.path is None:
+            self.file = sys.stdout
+            self.size = 0
+        else:
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.size = self.file.tell()
+
+    # Rotação por tamanho: log -> log.1 -> log.2 ... (o mais antigo é apagado)
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.unlink(self.path)
+        self.file = None
+        self.open()
+
+    def format(self, event):
+        stamp, level, category, message, fields = event
+        second = int(stamp)
+        if second != self.second: # A data muda no máximo uma vez por segundo
+            self.second = second
+            self.stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        quoted = self.messages.get(message)
+        if quoted is None: # As mensagens são poucas e fixas: cada uma é formatada uma vez
+            quoted = self.messages[message] = format_value(message)
+        parts = [f"{self.stamp}.{int(stamp * 1000) % 1000:03d}Z", LEVEL_NAMES[level], category, quoted]
+        for key, value in fields.items():
+            if key == "linha":
+                value = redact(value, self.bodies)
+            parts.append(f"{key}={format_value(value)}")
+        return " ".join(parts) + "\n"
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.write_batch()
+
+    # Formata e grava tudo o que estiver na fila com uma única escrita
+    def write_batch(self):
+        if not self.queue:
+            return
+        with self.write_lock:
+            lines = []
+            while self.queue:
+                lines.append(self.format(self.queue.popleft()))
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(self.format((time.time(), WARNING, "log", "eventos descartados", {"quantidade": dropped})))
+            if self.file is None:
+                self.open()
+            data = "".join(lines)
+            try:
+                self.file.write(data)
+                self.file.flush()
+            except (OSError, ValueError):
+                return
+            if self.path is not None:
+                self.size += len(data)
+                if self.size >= self.max_bytes:
+                    self.rotate()
+
+    # Grava na hora o que estiver pendente (encerramento do servidor)
+    def flush(self):
+        self.write_batch()
+
+
+log = Diario()
@@ -0,0 +1,222 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from diario import log
+
+# Histórico de mensagens dos canais (CHATHISTORY e replay no JOIN).
+# Cada canal tem um anel com as últimas `limit` mensagens. Sem arquivo, o anel guarda
+# as próprias linhas; com arquivo, guarda só (segmento, posição, tamanho) e as linhas
+# ficam em um log em disco só de acréscimo, lido com mmap sem carregar o arquivo inteiro.
+# O broadcast apenas enfileira a linha: uma thread em segundo plano escreve em lote.
+
+# Registro no log: data (ms desde a época), tamanho da chave do canal, tamanho da linha
+RECORD = struct.Struct("<qHH")
+
+# Tamanho de cada segmento do log; ficam no máximo os dois segmentos mais recentes
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Canais com histórico guardado; acima disso sai o canal sem mensagens há mais tempo
+MAX_CHANNELS = 10000
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class Historico:
+
+    def __init__(self, limit, path=None, segment_size=SEGMENT_SIZE, max_channels=MAX_CHANNELS):
+        self.limit = limit
+        self.path = path
+        self.segment_size = segment_size
+        self.max_channels = max_channels
+        self.rings = OrderedDict() # chave do canal -> deque de (ms, linha ou (segmento, posição, tamanho))
+        self.lock = threading.Lock()
+        self.maps = {}             # segmento -> mmap aberto para leitura
+        self.queue = deque()       # (chave, ms, linha) ainda não escritos no log
+        self.wakeup = threading.Condition(threading.Lock())
+        self.sleeping = False      # Thread de escrita parada esperando a fila
+        self.segment = 0
+        self.fd = None
+        if path is not None:
+            self.load()
+            self.open_segment(self.segment)
+            threading.Thread(target=self.run, daemon=True).start()
+
+    # Caminho de um segmento do log
+    def segment_path(self, segment):
+        return f"{self.path}.{segment}"
+
+    def segments(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + "."
+        found = []
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                found.append(int(name[len(prefix):]))
+        return sorted(found)
+
+    # Reconstrói os anéis lendo só os cabeçalhos e chaves dos segmentos existentes
+    def load(self):
+        for segment in self.segments():
+            self.segment = segment
+            path = self.segment_path(segment)
+            size = os.path.getsize(path)
+            if not size:
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                offset = 0
+                while offset + RECORD.size <= size:
+                    stamp, key_len, line_len = RECORD.unpack_from(m, offset)
+                    start = offset + RECORD.size + key_len
+                    if start + line_len > size:
+                        break
+                    key = m[offset + RECORD.size:start].decode("utf-8", "replace")
+                    self.store(key, stamp, (segment, start, line_len))
+                    offset = start + line_len
+            if offset < size:
+                os.truncate(path, offset) # Registro incompleto de uma queda no meio da escrita
+
+    def open_segment(self, segment):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.segment = segment
+        self.fd = os.open(self.segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.written = os.fstat(self.fd).st_size
+        # Segmentos antigos saem; as entradas que apontam para eles somem na leitura
+        for old in self.segments():
+            if old < segment - 1:
+                with self.lock:
+                    m = self.maps.pop(old, None)
+                    if m is not None:
+                        m.close()
+                os.unlink(self.segment_path(old))
+
+    # Guarda uma entrada no anel do canal (chamado com ou sem o lock, conforme o caso)
+    def store(self, key, stamp, ref):
+        ring = self.rings.get(key)
+        if ring is None:
+            ring = self.rings[key] = deque(maxlen=self.limit)
+            if len(self.rings) > self.max_channels:
+                self.rings.popitem(last=False)
+        else:
+            self.rings.move_to_end(key)
+        ring.append((stamp, ref))
+
+    # Chamado pelo broadcast: sem disco guarda direto no anel; com disco só enfileira
+    def record(self, key, data):
+        stamp = now_ms()
+        if self.path is None:
+            with self.lock:
+                self.store(key, stamp, data)
+            return
+        self.queue.append((key, stamp, data))
+        if self.sleeping:
+            with self.wakeup:
+                self.wakeup.notify()
+
+    # Espera a thread de escrita gravar tudo o que já foi registrado
+    def flush(self, timeout=None):
+        if self.path is None:
+            return True
+        done = threading.Event()
+        self.queue.append(done)
+        with self.wakeup:
+            self.wakeup.notify()
+        return done.wait(timeout)
+
+    # Thread de escrita: junta o que estiver na fila em uma única escrita no log.
+    # Só é acordada quando estava parada; a espera com prazo cobre a corrida entre
+    # a fila ficar vazia e a marcação de "parada"
+    def run(self):
+        while True:
+            with self.wakeup:
+                while not self.queue:
+                    self.sleeping = True
+                    self.wakeup.wait(0.05)
+                self.sleeping = False
+            batch, waiters = [], []
+            while self.queue:
+                item = self.queue.popleft()
+                (waiters if isinstance(item, threading.Event) else batch).append(item)
+            if self.written >= self.segment_size:
+                self.open_segment(self.segment + 1)
+            chunks, entries = [], []
+            offset = self.written
+            for key, stamp, data in batch:
+                raw_key = key.encode("utf-8")
+                chunks += (RECORD.pack(stamp, len(raw_key), len(data)), raw_key, data)
+                start = offset + RECORD.size + len(raw_key)
+                entries.append((key, stamp, (self.segment, start, len(data))))
+                offset = start + len(data)
+            try:
+                os.write(self.fd, b"".join(chunks))
+            except OSError as e:
+                log.error("historico", "Erro ao gravar o histórico", erro=e)
+            else:
+                self.written = offset
+                with self.lock:
+                    for key, stamp, ref in entries:
+                        self.store(key, stamp, ref)
+            for done in waiters:
+                done.set()
+
+    # Lê uma linha do log pelo mmap do segmento (remapeado quando o arquivo cresceu)
+    def read(self, ref):
+        if isinstance(ref, bytes):
+            return ref
+        segment, start, length = ref
+        m = self.maps.get(segment)
+        if m is None or start + length > len(m):
+            try:
+                with open(self.segment_path(segment), "rb") as f:
+                    new = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None # Segmento já apagado
+            if m is not None:
+                m.close()
+            m = self.maps[segment] = new
+        return m[start:start + length]
+
+    # Entradas do canal que passam no filtro, as `limit` mais recentes (ou as
+    # primeiras, com first=True), como (ms, linha) em ordem cronológica
+    def query(self, key, limit, keep=None, first=False):
+        with self.lock:
+            ring = self.rings.get(key)
+            if ring is None:
+                return []
+            entries = [e for e in ring if keep is None or keep(e[0])]
+            entries = entries[:limit] if first else entries[-limit:]
+            result = []
+            for stamp, ref in entries:
+                line = self.read(ref)
+                if line is not None:
+                    result.append((stamp, line))
+            return result
+
+    def latest(self, key, limit, after=None):
+        return self.query(key, limit, None if after is None else (lambda ms: ms > after))
+
+    def before(self, key, stamp, limit):
+        return self.query(key, limit, lambda ms: ms < stamp)
+
+    def after(self, key, stamp, limit):
+        return self.query(key, limit, lambda ms: ms > stamp, first=True)
+
+
+# Data no formato das tags IRCv3 (server-time) e o caminho inverso. Uma data sem
+# fuso é UTC, como no server-time, e não a hora local do servidor
+def format_time(ms):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ms // 1000)) + f".{ms % 1000:03d}Z"
+
+
+def parse_time(text):
+    moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
@@ -0,0 +1,371 @@
+import hmac
+import socket
+
+from diario import log
+from protocolo import pack_items, parse_message
+from servidor import FilaSaida, UsuarioRemoto, irc_lower
+
+# Ligações TCP entre servidores (servidor.py --link-porta / --conectar, modo async).
+# Os servidores ligados formam uma árvore: cada um conhece todos os nicks e a
+# composição de todos os canais da rede, mas não a topologia além das ligações diretas
+# (só quem está atrás de cada uma). Protocolo, uma linha IRC por mensagem:
+#  - aperto de mão: "PASS <senha>" e "SERVER <nome>" nos dois sentidos
+#  - burst logo depois: ":<uplink> SERVER <nome>" para cada servidor conhecido,
+#    "NICK <nick> <ts> <servidor>" para cada usuário, ":<servidor> NJOIN <canal> :nick nick..."
+#    com os membros de cada canal e ":<servidor> EOB" no fim
+#  - depois: as mesmas linhas trocadas com o barramento (:nick JOIN/PART/QUIT/PRIVMSG),
+#    ":antigo NICK novo <ts>", ":servidor KILL <nick> <ts> :motivo" e ":servidor SQUIT <nome> :motivo"
+# Mudanças de estado (NICK/JOIN/PART/QUIT) vão para toda a árvore; PRIVMSG segue só
+# pelas ligações que levam a membros do canal (Servidor.broadcast).
+# Colisão de nick: fica o usuário com o menor ts (momento em que pegou o nick, em ms);
+# com ts iguais os dois saem. Os dois lados de uma ligação decidem igual, e quem
+# perdeu do lado de cá é removido com um KILL que leva o ts, para não acertar um
+# usuário novo com o mesmo nick
+
+# Fila de saída de uma ligação (o burst de uma rede grande sai de uma vez)
+LINK_SENDQ = 64 * 1024 * 1024
+
+# Segundos entre tentativas de reconectar uma ligação de --conectar
+LINK_RETRY = 5
+
+
+# Aceita ligações de outros servidores em uma porta separada da dos clientes
+def listen(server, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", port))
+    sock.listen(16)
+    sock.setblocking(False)
+    server.loop.add_reader(sock.fileno(), accept, server, sock)
+    log.info("ligacao", "Aceitando servidores", porta=port)
+    return sock
+
+
+def accept(server, sock):
+    while True:
+        try:
+            conn, addr = sock.accept()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            log.error("ligacao", "Erro ao aceitar servidor", erro=e)
+            return
+        LigacaoServidor(server, conn, addr).start()
+
+
+# Liga a um servidor (host, porta) e tenta de novo a cada LINK_RETRY segundos
+# enquanto não conseguir
+def connect(server, target):
+    server.loop.create_task(connect_async(server, target))
+
+
+async def connect_async(server, target):
+    conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    conn.setblocking(False)
+    try:
+        await server.loop.sock_connect(conn, target)
+    except OSError as e:
+        conn.close()
+        log.debug("ligacao", "Servidor indisponível", addr=target, erro=e)
+        server.loop.call_later(LINK_RETRY, connect, server, target)
+        return
+    LigacaoServidor(server, conn, target, target).start()
+
+
+# Uma ligação com outro servidor. Para o Servidor é igual à do barramento:
+# usuários remotos apontam para ela e cada linha sai uma única vez por ligação
+class LigacaoServidor:
+
+    introduces_users = True # Todo usuário da rede é anunciado, esteja ou não em canais
+
+    def __init__(self, server, conn, addr, target=None):
+        self.server = server
+        self.conn = conn
+        self.addr = addr
+        self.target = target  # (host, porta) das ligações de --conectar, para reconectar
+        self.name = None      # Nome do servidor do outro lado, depois do SERVER
+        self.password = None
+        self.buffer = bytearray()
+        self.quit_reason = None
+        self.closed = False
+        self.last_seen = server.loop.time()
+        self.fila = FilaSaida(self, soft=LINK_SENDQ, hard=LINK_SENDQ)
+
+    def start(self):
+        self.conn.setblocking(False)
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.loop.add_reader(self.conn.fileno(), self.read)
+        self.send_data(f"PASS {self.server.link_password or '*'}\r\nSERVER {self.server.name}\r\n")
+        self.server.loop.call_later(self.server.ping_interval, self.check_alive)
+
+    def send_bytes(self, data, droppable=False):
+        return self.fila.put(data)
+
+    def send_data(self, message):
+        return self.fila.put(message.encode("utf-8"))
+
+    def forward(self, data):
+        self.server.propagate(data, origin=self)
+
+    def read(self):
+        try:
+            data = self.conn.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close("Connection closed")
+            return
+        self.last_seen = self.server.loop.time()
+        self.server.metrics.bytes_in += len(data)
+        self.buffer += data
+        start = 0
+        while not self.closed:
+            end = self.buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(self.buffer[start:end + 1])
+            start = end + 1
+            try:
+                self.handle(line)
+            except Exception as e:
+                log.error("ligacao", "Erro ao processar linha", servidor=self.name, erro=e)
+        del self.buffer[:start]
+
+    # Linhas de usuários (JOIN/PART/QUIT/PRIVMSG) vão direto para o Servidor, sem
+    # decodificar; as do protocolo entre servidores passam pelo parser
+    def handle(self, line):
+        if line.startswith(b":"):
+            if self.name is None:
+                return
+            cmd = line.split(b" ", 2)[1] if b" " in line else b""
+            if cmd in (b"JOIN", b"PART", b"QUIT", b"PRIVMSG"):
+                self.server.handle_remote(self, line)
+                return
+        msg = parse_message(line.decode("utf-8", "replace").rstrip("\r\n"))
+        if msg is None:
+            return
+        handler = self.HANDLERS.get(msg.command)
+        if handler is not None and (self.name is not None or msg.command in ("PASS", "SERVER", "ERROR")):
+            handler(self, line, msg)
+
+    # Aperto de mão: senha e nome do servidor do outro lado
+    def handle_pass(self, line, msg):
+        self.password = msg.params[0] if msg.params else ""
+
+    def handle_server(self, line, msg):
+        if not msg.params:
+            return
+        if self.name is not None:
+            self.handle_introduction(line, msg)
+            return
+        name = msg.params[0]
+        expected = self.server.link_password
+        if expected and not hmac.compare_digest(expected.encode(), (self.password or "").encode()):
+            self.refuse("Senha incorreta")
+        elif name == self.server.name or name in self.server.servers:
+            # Dois caminhos para o mesmo servidor formariam um ciclo na árvore
+            self.refuse(f"Server {name} already exists")
+        else:
+            self.name = name
+            self.server.servers[name] = (self, self.server.name)
+            self.server.links.append(self)
+            log.info("ligacao", "Servidor ligado", servidor=name, addr=self.addr)
+            self.send_burst()
+            self.forward(f":{self.server.name} SERVER {name}\r\n".encode("utf-8"))
+
+    # ":uplink SERVER nome": servidor atrás desta ligação
+    def handle_introduction(self, line, msg):
+        uplink = msg.prefix
+        name = msg.params[0]
+        if name == self.server.name or name in self.server.servers:
+            self.close(f"Server {name} already exists")
+            return
+        self.server.servers[name] = (self, uplink)
+        self.forward(line)
+
+    def refuse(self, reason):
+        log.warning("ligacao", "Ligação recusada", addr=self.addr, motivo=reason)
+        self.send_data(f"ERROR :{reason}\r\n")
+        self.close(reason)
+
+    def handle_error(self, line, msg):
+        log.warning("ligacao", "Erro do outro servidor", servidor=self.name, addr=self.addr,
+                    motivo=msg.params[0] if msg.params else "")
+        self.close(msg.params[0] if msg.params else "ERROR")
+
+    # Estado da rede vista daqui (menos o que está atrás desta ligação) em um único envio
+    def send_burst(self):
+        server = self.server
+        lines = [
+            f":{uplink} SERVER {name}" for name, (link, uplink) in server.servers.items() if link is not self
+        ]
+        for user in server.nicks.values():
+            if user.link is None and user.ts is not None:
+                lines.append(f"NICK {user.nick} {user.ts} {server.name}")
+            elif user.link is not None and user.link is not self and user.server is not None:
+                lines.append(f"NICK {user.nick} {user.ts} {user.server}")
+        for canal in server.channels.values():
+            nicks = [member.nick for member in server.members_of(canal) if member.link is not self]
+            if nicks:
+                lines += pack_items(f":{server.name} NJOIN {canal.name} :", nicks)
+        lines.append(f":{server.name} EOB")
+        self.send_data("\r\n".join(lines) + "\r\n")
+
+    def handle_eob(self, line, msg):
+        log.info("ligacao", "Ligação sincronizada", servidor=self.name,
+                 usuarios=sum(user.link is self for user in self.server.nicks.values()))
+
+    # "NICK <nick> <ts> <servidor>": usuário novo na rede
+    def handle_user(self, line, msg):
+        if len(msg.params) < 3 or not msg.params[1].isdigit():
+            return
+        nick, ts, origin = msg.params[0], int(msg.params[1]), msg.params[2]
+        existing = self.server.nicks.get(irc_lower(nick))
+        if existing is not None and not self.collide(existing, ts):
+            return
+        user = UsuarioRemoto(nick, self, ts, origin)
+        self.server.nicks[irc_lower(nick)] = user
+        self.forward(line)
+
+    # ":antigo NICK novo <ts>": troca de nick de um usuário remoto
+    def handle_nick(self, line, msg):
+        if not line.startswith(b":"):
+            self.handle_user(line, msg)
+            return
+        if len(msg.params) < 2 or not msg.params[1].isdigit():
+            return
+        old = msg.prefix
+        new, ts = msg.params[0], int(msg.params[1])
+        user = self.server.nicks.get(irc_lower(old))
+        if user is None or user.link is not self:
+            return
+        existing = self.server.nicks.get(irc_lower(new))
+        if existing is not None and existing is not user and not self.collide(existing, ts):
+            # O nick novo perdeu: o usuário sai daqui e de quem está atrás deste servidor
+            self.kill(user, "Nick collision")
+            return
+        del self.server.nicks[irc_lower(old)]
+        user.nick = new
+        user.ts = ts
+        self.server.nicks[irc_lower(new)] = user
+        self.server.renamed(user)
+        self.forward(line)
+
+    # Decide uma colisão entre um usuário já conhecido e um nick chegando por esta
+    # ligação com o ts dado. Remove o conhecido quando ele perde; devolve True se o
+    # que está chegando fica
+    def collide(self, existing, ts):
+        log.warning("ligacao", "Colisão de nick", nick=existing.nick, servidor=self.name,
+                    ts_existente=existing.ts, ts_novo=ts)
+        if existing.ts is not None and existing.ts < ts:
+            return False
+        self.kill(existing, "Nick collision")
+        return existing.ts is None or existing.ts > ts
+
+    # Remove um usuário por colisão e avisa as outras ligações com um KILL
+    def kill(self, user, reason):
+        data = f":{self.server.name} KILL {user.nick} {user.ts} :{reason}\r\n".encode("utf-8")
+        self.forward(data)
+        self.server.kill(user, reason)
+
+    # ":servidor KILL <nick> <ts> :motivo" (só vale para o usuário com aquele ts)
+    def handle_kill(self, line, msg):
+        if len(msg.params) < 2 or not msg.params[1].isdigit():
+            return
+        user = self.server.nicks.get(irc_lower(msg.params[0]))
+        if user is None or user.ts != int(msg.params[1]):
+            return
+        self.server.kill(user, msg.params[2] if len(msg.params) > 2 else "Killed")
+        self.forward(line)
+
+    # ":servidor NJOIN <canal> :nick nick...": membros de um canal no burst
+    def handle_njoin(self, line, msg):
+        if len(msg.params) < 2:
+            return
+        for nick in msg.params[1].split():
+            user = self.server.nicks.get(irc_lower(nick))
+            if user is not None and user.link is self:
+                self.server.join_remote(user, msg.params[0], f":{user.nick} JOIN :{msg.params[0]}\r\n".encode("utf-8"))
+        self.forward(line)
+
+    # ":servidor SQUIT <nome> :motivo": um servidor atrás desta ligação saiu da rede
+    def handle_squit(self, line, msg):
+        if not msg.params or self.server.servers.get(msg.params[0], (None,))[0] is not self:
+            return
+        self.drop_servers(msg.params[0], msg.params[1] if len(msg.params) > 1 else "")
+        self.forward(line)
+
+    def handle_ping(self, line, msg):
+        self.send_data(f"PONG :{self.server.name}\r\n")
+
+    def handle_pong(self, line, msg):
+        pass # Qualquer linha já conta como atividade (last_seen)
+
+    HANDLERS = {
+        "PASS": handle_pass,
+        "SERVER": handle_server,
+        "ERROR": handle_error,
+        "EOB": handle_eob,
+        "NICK": handle_nick,
+        "KILL": handle_kill,
+        "NJOIN": handle_njoin,
+        "SQUIT": handle_squit,
+        "PING": handle_ping,
+        "PONG": handle_pong,
+    }
+
+    # Tira da rede o servidor `name` e todos os que estão atrás dele, com os seus
+    # usuários; os membros locais dos canais recebem um QUIT de cada um
+    def drop_servers(self, name, reason):
+        servers = self.server.servers
+        gone = {name}
+        grew = True
+        while grew:
+            grew = False
+            for other, (link, uplink) in servers.items():
+                if link is self and uplink in gone and other not in gone:
+                    gone.add(other)
+                    grew = True
+        for other in gone:
+            del servers[other]
+        split = f"{self.server.name} {name}" # Motivo no estilo dos netsplits
+        users = [user for user in self.server.nicks.values() if user.link is self and user.server in gone]
+        for user in users:
+            self.server.kill(user, split)
+        log.warning("ligacao", "Netsplit", servidor=name, servidores=len(gone), usuarios=len(users), motivo=reason)
+
+    # Keepalive da ligação: PING a cada ping_interval; sem receber nada por
+    # ping_interval + ping_timeout segundos a ligação é derrubada
+    def check_alive(self):
+        if self.closed:
+            return
+        server = self.server
+        if server.loop.time() - self.last_seen > server.ping_interval + server.ping_timeout:
+            self.close("Ping timeout")
+            return
+        self.send_data(f"PING :{server.name}\r\n")
+        server.loop.call_later(server.ping_interval, self.check_alive)
+
+    # Chamado pela fila de saída (SendQ ou erro de escrita)
+    def evict(self, reason):
+        self.close(reason)
+
+    # Fim da ligação: os servidores atrás dela e os seus usuários saem da rede
+    # (netsplit) e as outras ligações recebem um SQUIT. Ligações de --conectar
+    # tentam de novo depois de LINK_RETRY segundos
+    def close(self, reason):
+        if self.closed:
+            return
+        self.closed = True
+        self.quit_reason = reason
+        server = self.server
+        server.loop.remove_reader(self.conn.fileno())
+        if self.name is not None:
+            server.links.remove(self)
+            self.drop_servers(self.name, reason)
+            server.propagate(f":{server.name} SQUIT {self.name} :{reason}\r\n".encode("utf-8"))
+        self.fila.close()
+        if self.target is not None:
+            server.loop.call_later(LINK_RETRY, connect, server, self.target)
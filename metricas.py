@@ -0,0 +1,216 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+from diario import log
+
+# Métricas internas do servidor: contadores e histogramas baratos o suficiente
+# para ficarem sempre ligados. São atualizados sem lock; no modo com threads um
+# incremento concorrente raro pode se perder, o que é aceitável para estatística.
+
+
+# Histograma em baldes de potências de 2 (o balde i guarda valores com i bits).
+# Registrar um valor custa um bit_length e três somas; os percentis são estimados
+# pelo limite superior do balde
+class Histograma:
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.buckets[value.bit_length()] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        target = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min((1 << i) - 1, self.max)
+        return 0
+
+    # Resumo com os valores divididos por `scale` (ex.: 1000 para ns -> µs)
+    def summary(self, scale=1):
+        if not self.count:
+            return {"n": 0}
+        return {
+            "n": self.count,
+            "media": round(self.total / self.count / scale, 1),
+            "p50": round(self.percentile(0.50) / scale, 1),
+            "p99": round(self.percentile(0.99) / scale, 1),
+            "max": round(self.max / scale, 1),
+        }
+
+
+class Metricas:
+
+    def __init__(self):
+        self.started = time.time()
+        self.accepted = 0      # Conexões aceitas
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.send_errors = 0   # Erros de escrita no socket
+        self.sendq_drops = 0   # Mensagens de canal descartadas pelo limite suave
+        self.sendq_evictions = 0
+        self.ping_timeouts = 0 # Conexões derrubadas pelo keepalive
+        self.flood_deferred = 0   # Linhas adiadas pelo controle de flood
+        self.flood_throttles = 0  # Vezes em que um cliente esgotou o balde
+        self.flood_kills = 0      # Conexões derrubadas por "Excess Flood"
+        self.commands = {}     # comando -> Histograma do tempo de tratamento (ns)
+        self.fanout_size = Histograma()  # Destinatários locais por broadcast
+        self.fanout_time = Histograma()  # Duração de cada broadcast (ns)
+        self.profiler = None
+
+    def command(self, name, elapsed):
+        hist = self.commands.get(name)
+        if hist is None:
+            hist = self.commands[name] = Histograma()
+        hist.observe(elapsed)
+
+    def broadcast(self, recipients, elapsed):
+        self.fanout_size.observe(recipients)
+        self.fanout_time.observe(elapsed)
+
+    # Estado atual em um dict (saída do socket de coleta e base do STATS)
+    def snapshot(self, server):
+        return {
+            "uptime_s": int(time.time() - self.started),
+            "conexoes_ativas": len(server.clients),
+            "canais": len(server.channels),
+            "conexoes_aceitas": self.accepted,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "erros_envio": self.send_errors,
+            "sendq_descartes": self.sendq_drops,
+            "sendq_excedida": self.sendq_evictions,
+            "ping_timeouts": self.ping_timeouts,
+            "flood_adiadas": self.flood_deferred,
+            "flood_avisos": self.flood_throttles,
+            "flood_desconexoes": self.flood_kills,
+            "comandos_us": {name: hist.summary(1000) for name, hist in sorted(dict(self.commands).items())},
+            "fanout_membros": self.fanout_size.summary(),
+            "fanout_us": self.fanout_time.summary(1000),
+            "perfil": self.profiler is not None and self.profiler.running,
+        }
+
+    # Linhas de texto do STATS: "m" (comandos), "u" (tempo no ar), "q" (filas de
+    # saída), "p" (perfil por amostragem); sem consulta mostra o resumo geral
+    def report(self, server, query=""):
+        snap = self.snapshot(server)
+        if query == "u":
+            return [f"Server Up {snap['uptime_s'] // 86400} days {time.strftime('%H:%M:%S', time.gmtime(snap['uptime_s']))}"]
+        if query == "m":
+            return [
+                f"{name} n={s['n']} media={s['media']}us p50={s['p50']}us p99={s['p99']}us max={s['max']}us"
+                for name, s in snap["comandos_us"].items()
+            ]
+        if query == "q":
+            rows = sorted(server.sendq_report(), key=lambda r: r[2], reverse=True)[:20]
+            return [f"{nick} {addr} {size} bytes {count} msgs {dropped} descartadas"
+                    for nick, addr, size, count, dropped in rows]
+        if query == "p":
+            if self.profiler is None:
+                return ["Perfil desligado (PROFILE ON)"]
+            return self.profiler.report()
+        lines = [f"{key}={value}" for key, value in snap.items() if not isinstance(value, dict)]
+        for key in ("fanout_membros", "fanout_us"):
+            lines.append(f"{key} " + " ".join(f"{k}={v}" for k, v in snap[key].items()))
+        return lines
+
+    def start_profiler(self, interval=0.005):
+        if self.profiler is None or not self.profiler.running:
+            self.profiler = Amostrador(interval)
+            self.profiler.start()
+
+    def stop_profiler(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+
+
+# Profiler por amostragem: uma thread olha a pilha das outras threads a cada
+# `interval` segundos e conta as funções encontradas (no topo e em toda a pilha).
+# Não instrumenta nada, então o custo fica na thread de amostragem
+class Amostrador:
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.leaf = Counter()   # Função no topo da pilha (tempo próprio)
+        self.total = Counter()  # Função em qualquer ponto da pilha (tempo acumulado)
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        me = threading.get_ident()
+        while self.running:
+            for ident, frame in sys._current_frames().items():
+                if ident == me or ident in ignored_threads:
+                    continue
+                self.samples += 1
+                self.leaf[label(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    key = label(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        self.total[key] += 1
+                    frame = frame.f_back
+            time.sleep(self.interval)
+
+    def report(self, limit=15):
+        samples = max(self.samples, 1)
+        lines = [f"{self.samples} amostras ({'ligado' if self.running else 'desligado'})"]
+        lines += [f"proprio {n * 100 / samples:5.1f}% {key}" for key, n in self.leaf.most_common(limit)]
+        lines += [f"total {n * 100 / samples:5.1f}% {key}" for key, n in self.total.most_common(limit)]
+        return lines
+
+
+def label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# Threads de infraestrutura que o profiler não amostra (socket de coleta)
+ignored_threads = set()
+
+
+# Socket Unix local de coleta: cada conexão recebe o snapshot em JSON e é fechada
+def serve_scrape(server, path):
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(8)
+
+    def run():
+        ignored_threads.add(threading.get_ident())
+        while True:
+            conn, _ = sock.accept()
+            try:
+                conn.sendall(json.dumps(server.metrics.snapshot(server)).encode() + b"\n")
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    log.info("metricas", "Métricas disponíveis", caminho=path)
+    return sock
@@ -0,0 +1,139 @@
+# Código do protocolo IRC compartilhado pelo servidor (servidor.py) e pelo cliente (cliente.py)
+
+# Tamanho máximo de uma linha IRC, incluindo o CRLF (RFC 1459)
+MAX_LINE = 512
+
+# Tamanho das leituras do socket
+RECV_SIZE = 16384
+
+
+# Separa um fluxo de bytes em linhas IRC de forma incremental.
+# Os dados são lidos direto para um buffer pré-alocado (recv_into) e as linhas
+# completas são decodificadas a partir dele sem cópias intermediárias; só o pedaço
+# final incompleto é guardado para a próxima leitura. Como apenas linhas completas
+# são decodificadas, um caractere UTF-8 dividido entre duas leituras não quebra.
+# Linhas maiores que MAX_LINE são truncadas e o excesso é descartado.
+# O pedaço incompleto é um bytes que só existe enquanto há uma linha pela metade
+# (b"" é um objeto único), então uma conexão ociosa não guarda buffer nenhum
+class Enquadrador:
+    __slots__ = ("max_line", "partial", "overflow")
+
+    def __init__(self, max_line=MAX_LINE):
+        self.max_line = max_line - 2 # Sem o CRLF
+        self.partial = b""
+        self.overflow = False # Descartando o resto de uma linha longa demais
+
+    # Lê do socket para o buffer `scratch` (bytearray reaproveitado entre leituras)
+    # e devolve as linhas completas; None quando a conexão foi encerrada
+    def recv_from(self, sock, scratch):
+        n = sock.recv_into(scratch)
+        if not n:
+            return None
+        return self.feed(scratch, n)
+
+    # Processa os primeiros `length` bytes de `data` e devolve as linhas completas
+    def feed(self, data, length=None):
+        end = len(data) if length is None else length
+        view = memoryview(data)
+        lines = []
+        start = 0
+        if self.partial or self.overflow:
+            nl = data.find(b"\n", 0, end)
+            if nl < 0:
+                self.keep(view[:end])
+                return lines
+            self.keep(view[:nl])
+            lines += self.split(self.partial)
+            self.partial = b""
+            self.overflow = False
+            start = nl + 1
+        # Todas as linhas completas da leitura são separadas de uma vez
+        last = data.rfind(b"\n", start, end)
+        if last >= 0:
+            lines += self.split(bytes(view[start:last]))
+            start = last + 1
+        if start < end:
+            self.keep(view[start:end])
+        return lines
+
+    # Guarda o início de uma linha incompleta, respeitando o tamanho máximo
+    def keep(self, chunk):
+        room = self.max_line + 1 - len(self.partial) # +1 para um possível \r final
+        if len(chunk) > room:
+            chunk = chunk[:max(room, 0)]
+            self.overflow = True
+        self.partial += chunk
+
+    # Separa um trecho formado só por linhas completas (sem o último \n)
+    def split(self, region):
+        limit = self.max_line
+        return [
+            (line[:-1] if line[-1:] == b"\r" else line)[:limit].decode("utf-8", "replace")
+            for line in region.split(b"\n") if line and line != b"\r"
+        ]
+
+
+# Monta linhas "head" + itens separados por `sep` + "tail" com no máximo `limit`
+# bytes cada (sem o CRLF), usando quantas linhas forem necessárias. Serve para as
+# listas de alvos ("JOIN #a,#b,#c") e para as respostas 353 do NAMES
+def pack_items(head, items, sep=" ", tail="", limit=MAX_LINE - 2):
+    room = limit - len(head.encode("utf-8")) - len(tail.encode("utf-8"))
+    lines = []
+    chunk = []
+    size = 0
+    for item in items:
+        n = len(item.encode("utf-8"))
+        if chunk and size + len(sep) + n > room:
+            lines.append(head + sep.join(chunk) + tail)
+            chunk = []
+        size = n if not chunk else size + len(sep) + n
+        chunk.append(item)
+    if chunk:
+        lines.append(head + sep.join(chunk) + tail)
+    return lines
+
+
+# Mensagem IRC separada em partes: tags IRCv3 (texto bruto), prefixo, comando em
+# maiúsculas e parâmetros (o parâmetro final ":trailing" vem inteiro, com espaços)
+class Mensagem:
+    __slots__ = ("tags", "prefix", "command", "params")
+
+    def __init__(self, tags, prefix, command, params):
+        self.tags = tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+
+    # Junta os parâmetros a partir de `index`. Com ":trailing" é o próprio texto;
+    # sem ele mantém a compatibilidade com clientes que mandam o texto sem ":"
+    def rest(self, index):
+        params = self.params
+        if index == len(params) - 1:
+            return params[index]
+        return " ".join(params[index:]) # "" quando não há parâmetros a partir de index
+
+    # Nick do prefixo (":nick!user@host")
+    def nick(self):
+        if self.prefix is None:
+            return None
+        return self.prefix.split("!", 1)[0]
+
+
+# Converte uma linha ("@tags :prefixo COMANDO a b :texto final") em Mensagem;
+# devolve None para linhas vazias
+def parse_message(line):
+    if not line:
+        return None
+    tags = prefix = None
+    if line[0] == "@":
+        tags, _, line = line[1:].partition(" ")
+    if line[:1] == ":":
+        prefix, _, line = line[1:].partition(" ")
+    head, sep, trailing = line.partition(" :")
+    params = head.split()
+    if sep:
+        params.append(trailing)
+    if not params:
+        return None
+    command = params[0]
+    return Mensagem(tags, prefix, command if command.isupper() else command.upper(), params[1:])
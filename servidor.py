@@ -1,13 +1,426 @@
+import argparse
+import asyncio
+import hmac
+import os
+import selectors
 import socket
 import threading
 from collections import deque
+from itertools import count, islice
 import re
+import signal
+import sys
 import time
 
+from diario import log
+from historico import Historico, format_time, now_ms, parse_time
+from metricas import Metricas, serve_scrape
+from protocolo import MAX_LINE, RECV_SIZE, Enquadrador, pack_items, parse_message
+
 # Mensagem do Dia (MOTD)
 MOTD = "Imagine uma mensagem inspiracional aqui kk (:"
 
+# Nick válido: letra seguida de até 8 letras, dígitos ou "_"
+NICK_RE = re.compile("^[A-Za-z][A-Za-z0-9_]{0,8}$")
+
+# Keepalive: PING depois de PING_INTERVAL segundos sem receber nada do cliente;
+# sem resposta em PING_TIMEOUT segundos a conexão é derrubada
+PING_INTERVAL = 120
+PING_TIMEOUT = 60
+
+# Segundos que um cliente que saiu (QUIT, KILL) tem para ler o resto da fila de
+# saída; depois disso o socket é desligado mesmo com a fila cheia
+CLOSE_TIMEOUT = 5
+
+# Controle de flood: cada cliente tem um balde de FLOOD_RATE fichas por segundo
+# com até FLOOD_BURST fichas acumuladas; cada comando custa fichas (ver COMMANDS)
+# e uma PRIVMSG custa uma ficha a mais a cada FLOOD_FANOUT membros do canal.
+# Com uma lista de alvos, cada FLOOD_TARGETS alvos além do primeiro custam uma
+# ficha a mais: um JOIN com dezenas de canais logo depois do registro cabe na rajada.
+# Sem fichas, as linhas ficam adiadas (até FLOOD_PENDING) e a leitura da conexão
+# pausa; quem esgota o balde FLOOD_STRIKES vezes seguidas (recupera uma a cada
+# FLOOD_STRIKE_DECAY segundos) é desconectado com "Excess Flood"
+FLOOD_RATE = 10
+FLOOD_BURST = 40
+FLOOD_FANOUT = 100
+FLOOD_TARGETS = 5
+FLOOD_PENDING = 100
+FLOOD_STRIKES = 5
+FLOOD_STRIKE_DECAY = 10
+
+# Comandos que aceitam uma lista de alvos separados por vírgula ("JOIN #a,#b");
+# uma PRIVMSG aceita no máximo MAX_TARGETS alvos
+MULTI_TARGET = ("JOIN", "PART", "PRIVMSG", "NAMES")
+MAX_TARGETS = 20
+
+# Travas do registro de nicks e canais (modo com threads): cada chave usa uma de
+# LOCK_STRIPES travas, então JOIN/PART/NICK em canais e nicks diferentes quase
+# nunca esperam uns pelos outros
+LOCK_STRIPES = 64
+
+# LIST percorre os canais em blocos de LIST_CHUNK e só monta o próximo bloco
+# quando a fila de saída do cliente está abaixo de LIST_SENDQ bytes (senão espera
+# LIST_PAUSE segundos): uma lista enorme sai no ritmo em que o cliente lê, sem
+# estourar a fila nem prender o laço
+LIST_CHUNK = 200
+LIST_SENDQ = 32 * 1024
+LIST_PAUSE = 0.05
+
+# Limites padrão da fila de saída de cada cliente (em bytes)
+SENDQ_SOFT = 64 * 1024   # Acima disso as mensagens de canal para o cliente são descartadas
+SENDQ_HARD = 512 * 1024  # Atraso (fila + descartes) acima disso desconecta o cliente ("SendQ exceeded")
+
+# Casemapping do RFC 1459: além de A-Z, os caracteres []\~ são as maiúsculas de {}|^
+RFC1459_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~", "abcdefghijklmnopqrstuvwxyz{}|^")
+
+
+# Chave usada nos índices de nicks e canais (comparação sem diferenciar maiúsculas)
+def irc_lower(name):
+    return name.translate(RFC1459_LOWER)
+
+# Alvos de uma lista separada por vírgula, na ordem em que vieram e sem repetidos
+# (comparados sem diferenciar maiúsculas)
+def split_targets(targets):
+    unique = {}
+    for name in targets.split(","):
+        if name:
+            unique.setdefault(irc_lower(name), name)
+    return list(unique.values())
+
+# Filtros do LIST no estilo ELIST: ">n" e "<n" (usuários), máscaras com * e ?
+# e "!máscara" (negação), separados por vírgula. Nomes sem curinga são consultados
+# direto. Devolve (nomes, testes), cada teste recebendo (canal, usuários)
+def list_filters(query):
+    names, tests = [], []
+    for item in query.split(","):
+        item = item.strip()
+        if item[:1] in ("<", ">") and item[1:].isdigit():
+            n = int(item[1:])
+            tests.append((lambda c, users, n=n: users > n) if item[0] == ">" else (lambda c, users, n=n: users < n))
+        elif item and (item[0] == "!" or "*" in item or "?" in item):
+            negate = item[0] == "!"
+            pattern = re.compile(re.escape(irc_lower(item.lstrip("!"))).replace(r"\*", ".*").replace(r"\?", ".") + "$")
+            tests.append(lambda c, users, p=pattern, neg=negate: (p.match(c.key) is None) is neg)
+        elif item:
+            names.append(item)
+    return names, tests
+
+# Divide uma linha com prefixo (":nick COMANDO alvo ...") em (nick, comando, alvo),
+# usada nas linhas trocadas entre servidores
+def split_prefixed(line):
+    parts = line.split(b" ", 3)
+    if len(parts) < 3 or not parts[0].startswith(b":"):
+        return None, None, None
+    nick = parts[0][1:].decode("utf-8", "replace")
+    target = parts[2].strip().lstrip(b":").decode("utf-8", "replace")
+    return nick, parts[1].upper(), target
+
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+# Máximo de buffers entregues em uma única escrita vetorizada (sendmsg/writev)
+try:
+    IOV_MAX = min(os.sysconf("SC_IOV_MAX"), 1024)
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+
+
+# Conjunto vazio compartilhado pelos usuários que não estão em nenhum canal
+NO_CHANNELS = frozenset()
+
+# Fila vazia compartilhada: a deque de cada cliente só existe enquanto há algo
+# para enviar (uma deque vazia ocupa ~600 bytes, multiplicados por cada conexão ociosa)
+NO_ITEMS = ()
+
+
+# Fila de saída limitada de um cliente. Quem envia apenas enfileira os bytes;
+# o escritor (thread Escritor ou laço asyncio) esvazia a fila sem bloquear quem enviou
+class FilaSaida:
+    __slots__ = ("client", "soft", "hard", "items", "size", "dropped", "behind",
+                 "scheduled", "closing", "exceeded", "lock")
+
+    def __init__(self, client, soft=None, hard=None):
+        self.client = client
+        self.soft = client.server.sendq_soft if soft is None else soft
+        self.hard = client.server.sendq_hard if hard is None else hard
+        self.items = NO_ITEMS
+        self.size = 0           # Bytes aguardando envio
+        self.dropped = 0        # Mensagens descartadas pelo limite suave
+        self.behind = 0         # Bytes descartados desde a última vez que a fila esvaziou
+        self.scheduled = False  # Fila já entregue ao escritor
+        self.closing = False    # Fechar o socket assim que a fila esvaziar
+        self.exceeded = False
+        self.lock = threading.Lock()
+
+    # Enfileira bytes para envio; devolve False se a mensagem foi descartada
+    def put(self, data, droppable=False):
+        with self.lock:
+            if self.closing or self.exceeded:
+                return False
+            # O atraso do cliente conta o que está na fila e o que já foi descartado;
+            # um cliente que nunca alcança o fluxo acaba desconectado
+            if self.size + self.behind + len(data) > self.hard:
+                self.exceeded = True
+                self.items = NO_ITEMS
+                self.size = 0
+            elif droppable and self.size + len(data) > self.soft:
+                self.dropped += 1
+                self.client.server.metrics.sendq_drops += 1
+                self.behind += len(data)
+                return False
+            else:
+                if self.items is NO_ITEMS:
+                    self.items = deque()
+                self.items.append(data)
+                self.size += len(data)
+                if self.scheduled:
+                    return True
+                self.scheduled = True
+        if self.exceeded:
+            self.client.server.metrics.sendq_evictions += 1
+            self.client.evict("SendQ exceeded")
+            return False
+        self.client.server.wake_writer(self)
+        return True
+
+    # Envia o máximo possível sem bloquear. Chamado apenas pelo escritor.
+    # As linhas pendentes saem juntas em uma única escrita vetorizada (sendmsg),
+    # sem copiar os buffers compartilhados entre os membros de um canal.
+    # Devolve True quando a fila ficou vazia; nesse caso o escritor deixa de
+    # observar o socket e, se a fila estiver fechando, fecha o socket
+    def flush(self):
+        with self.lock:
+            batch = list(islice(self.items, IOV_MAX))
+        if batch:
+            try:
+                if len(batch) == 1:
+                    sent = self.client.conn.send(batch[0], socket.MSG_DONTWAIT)
+                elif HAS_SENDMSG:
+                    sent = self.client.conn.sendmsg(batch, (), socket.MSG_DONTWAIT)
+                else:
+                    sent = self.client.conn.send(b"".join(batch), socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as e:
+                log.warning("envio", "Erro ao enviar dados", addr=self.client.addr, erro=e)
+                self.client.server.metrics.send_errors += 1
+                self.client.evict("Write error")
+                sent = sum(len(item) for item in batch)
+            else:
+                self.client.server.metrics.bytes_out += sent
+            with self.lock:
+                # Remove do início da fila apenas o que foi enviado; novas mensagens
+                # podem ter sido adicionadas ao final enquanto o envio acontecia
+                while sent and self.items:
+                    item = self.items[0]
+                    if sent >= len(item):
+                        self.items.popleft()
+                        self.size -= len(item)
+                        sent -= len(item)
+                    else:
+                        self.items[0] = memoryview(item)[sent:]
+                        self.size -= sent
+                        sent = 0
+        with self.lock:
+            if self.items:
+                return False
+            self.items = NO_ITEMS
+            self.scheduled = False
+            self.behind = 0
+            return True
+
+    # Fecha o socket depois de enviar o que ainda estiver na fila
+    def close(self):
+        with self.lock:
+            self.closing = True
+            if self.size > self.soft:
+                # Cliente lento demais: não vale esperar a fila esvaziar
+                self.items = NO_ITEMS
+                self.size = 0
+            if self.scheduled:
+                return
+        self.close_socket()
+
+    # Desiste do que ainda está na fila: o escritor encontra a fila vazia e, se ela
+    # estiver fechando, fecha o socket
+    def discard(self):
+        with self.lock:
+            self.items = NO_ITEMS
+            self.size = 0
+
+    def close_socket(self):
+        try:
+            self.client.conn.close()
+        except OSError as e:
+            log.warning("conexao", "Erro ao fechar conexão", addr=self.client.addr, erro=e)
+
+
+# Escritor do modo com threads: uma única thread esvazia as filas de saída de
+# todos os clientes, esperando com um seletor pelos sockets que estão com o buffer cheio
+class Escritor:
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.ready = deque()
+        self.signaled = False
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def wake(self, fila):
+        self.ready.append(fila)
+        if not self.signaled:
+            self.signaled = True
+            try:
+                self.wake_w.send(b"\0")
+            except BlockingIOError:
+                pass
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.wake_r:
+                    try:
+                        self.wake_r.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                fila = key.data
+                self.selector.unregister(key.fileobj)
+                self.ready.append(fila)
+            self.signaled = False
+            while self.ready:
+                fila = self.ready.popleft()
+                if fila.flush():
+                    if fila.closing:
+                        fila.close_socket()
+                    continue
+                # Buffer do kernel cheio: espera o socket aceitar escrita de novo
+                try:
+                    self.selector.register(fila.client.conn, selectors.EVENT_WRITE, fila)
+                except (KeyError, ValueError, OSError):
+                    pass
+
+# Roda de temporização (timer wheel): cada posição guarda os itens que vencem
+# naquele tick. Agendar e vencer custam O(1) por item, independente de quantos
+# itens existem; atrasos maiores que a roda são limitados ao tamanho dela
+# (quem trata o vencimento confere o prazo real e agenda de novo)
+class RodaTempo:
+
+    def __init__(self, tick=1.0, slots=512, clock=time.monotonic):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = 0
+        self.clock = clock
+        self.started = clock()
+        self.ticks = 0
+        self.now = self.started # Relógio grosso, atualizado a cada tick
+        self.lock = threading.Lock()
+
+    def schedule(self, item, delay):
+        ticks = min(max(1, -int(-delay // self.tick)), len(self.slots) - 1)
+        with self.lock:
+            self.slots[(self.current + ticks) % len(self.slots)].append(item)
+
+    # Avança a roda até o tempo atual e devolve os itens vencidos
+    def advance(self):
+        self.now = self.clock()
+        due = int((self.now - self.started) / self.tick)
+        expired = []
+        with self.lock:
+            while self.ticks < due:
+                self.ticks += 1
+                self.current = (self.current + 1) % len(self.slots)
+                expired += self.slots[self.current]
+                self.slots[self.current] = []
+        return expired
+
+
+# Balde de fichas (token bucket): enche `rate` fichas por segundo até `capacity`
+class Balde:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    # Consome `cost` fichas se houver; um custo maior que o balde conta como o balde cheio
+    def take(self, cost):
+        cost = min(cost, self.capacity)
+        now = time.monotonic()
+        tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if tokens < cost:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - cost
+        return True
+
+    # Segundos até haver fichas para `cost`
+    def wait(self, cost):
+        return max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+
+# Buffer de leitura de cada thread no modo com threads (reaproveitado entre leituras)
+thread_buffers = threading.local()
+
+
+def recv_scratch():
+    scratch = getattr(thread_buffers, "scratch", None)
+    if scratch is None:
+        scratch = thread_buffers.scratch = bytearray(RECV_SIZE)
+    return scratch
+
+
+# Canal: os membros ficam em um dict usado como conjunto ordenado (entrada, saída
+# e teste de pertinência O(1), mantendo a ordem de entrada), alterado só com a
+# trava da faixa do canal. Quem só percorre (broadcast, NAMES) usa uma tupla
+# imutável com a cópia dos membros, descartada a cada mudança e refeita na
+# próxima leitura. O nome é internado: o mesmo objeto str serve ao canal, à
+# chave e às mensagens. As respostas do NAMES (listas de nicks já quebradas no
+# tamanho de uma linha 353) e do LIST (nome e número de usuários) também ficam
+# prontas: um JOIN acrescenta o nick ao fim da lista do NAMES; PART e troca de
+# nick a descartam
+class Canal:
+    __slots__ = ("name", "key", "members", "snapshot", "names", "entry")
+
+    def __init__(self, name):
+        self.name = sys.intern(name)
+        self.key = sys.intern(irc_lower(name))
+        self.members = {}
+        self.snapshot = None
+        self.names = None # Pedaços "nick nick ..." do 353, sem o início da linha
+        self.entry = None # "<canal> <usuários> :" do 322
+
+
+# Usuário conectado em outro processo ou servidor; as mensagens para ele saem
+# pela ligação (link). Do barramento (--workers) só existe localmente enquanto está
+# em algum canal daqui; das ligações entre servidores existe enquanto está na rede,
+# com o ts do nick (colisões) e o nome do servidor dele (netsplits)
+class UsuarioRemoto:
+    __slots__ = ("nick", "link", "channels", "ts", "server")
+
+    def __init__(self, nick, link, ts=None, server=None):
+        self.nick = nick
+        self.link = link
+        self.channels = NO_CHANNELS
+        self.ts = ts
+        self.server = server
+
+
+# Estado de uma conexão. Com __slots__ (sem __dict__ por objeto) e a fila de saída
+# e o buffer de leitura alocados só quando usados, uma conexão ociosa ocupa pouca
+# memória além do próprio socket
 class Cliente:
+    __slots__ = ("conn", "addr", "server", "nick", "username", "realname", "registered",
+                 "framer", "actual_channel", "staus_conn", "quit_reason", "fila", "channels",
+                 "is_oper", "last_seen", "ping_sent", "flood", "strikes", "pending", "pending_cost", "ts",
+                 "listing")
+
+    link = None # Clientes locais não dependem de nenhuma ligação
     
     def __init__(self, connection, address, server):
         self.conn = connection
@@ -17,100 +430,198 @@ class Cliente:
         self.username = None
         self.realname = None
         self.registered = False
-        self.buffer = ""
+        self.framer = Enquadrador()
         self.actual_channel = None
         self.staus_conn = None
+        self.quit_reason = None # Motivo usado quando o servidor derruba a conexão
+        self.fila = FilaSaida(self)
+        self.channels = NO_CHANNELS # Índice reverso: canais (objetos Canal) em que o cliente está
+        self.is_oper = False
+        self.last_seen = server.keepalive.now # Última leitura (relógio da roda de keepalive)
+        self.ping_sent = None # Quando o PING do keepalive foi enviado, se ainda sem resposta
+        self.flood = None     # Balde de fichas, criado no primeiro comando que custa fichas
+        self.strikes = None   # Balde de avisos de flood, criado no primeiro aviso
+        self.pending = None   # Linhas adiadas pelo controle de flood (deque) enquanto sem fichas
+        self.pending_cost = 0 # Custo da primeira linha adiada
+        self.ts = None        # Quando o nick atual foi pego (ms); decide colisões entre servidores
+        self.listing = None   # LIST em andamento: (canais ainda não vistos, filtros)
         
     # Função que roda em loop para receber e processar comandos do cliente
     def run(self):
-        print(f"Cliente {self.addr} conectado.")
+        log.debug("conexao", "Thread do cliente iniciada", addr=self.addr)
         self.staus_conn = True
         try:
             
             while True:
                 if self.staus_conn:
                     data = self.receive_data()
+                    if data is None: # Conexão encerrada pelo cliente
+                        break
                     if data:
                         self.process_commands(data)
                 else:
                     break
         except Exception as e:
-            print(f"Erro ao processar dados de {self.addr}: {e}")
+            log.error("conexao", "Erro ao processar dados", addr=self.addr, erro=e)
+        if self.staus_conn:
+            self.server.remove_client(self, self.quit_reason or "Connection closed")
+            self.close()
         
     
     # Auxilia a função run() a receber dados de comando do cliente 
+    # Retorna None quando o cliente fecha a conexão
     def receive_data(self):
         try:
-            data = self.conn.recv(1024).decode("utf-8")
-            if data:
-                self.buffer += data
-                if "\r\n" in self.buffer:
-                    lines = self.buffer.split("\r\n")
-                    self.buffer = lines[-1] # Armazenando linha incompleta para processamento futuro
-                    return lines[:-1] # Retornando lista de linhas completas para processamento
-            return []
+            return self.read_lines(recv_scratch())
         except Exception as e:
-            print(f"Erro ao receber dados de {self.addr}: {e}")
-            return []
+            log.warning("conexao", "Erro ao receber dados", addr=self.addr, erro=e)
+            return None
+
+    # Lê do socket para o buffer `scratch` e devolve as linhas completas (None no fim da conexão)
+    def read_lines(self, scratch):
+        n = self.conn.recv_into(scratch)
+        if not n:
+            return None
+        self.server.metrics.bytes_in += n
+        self.last_seen = self.server.keepalive.now
+        return self.framer.feed(scratch, n)
      
     # Processa linhas recebidas do cliente  
     def process_commands(self, data):
         # Iterando sobre cada linha de comando recebida
         for command in data:
-            print(f"Recebendo comando: {command}")  # Log do comando recebido
-            self.handle_command(command) 
-    
-    # Divide cada linha de comando em partes e chama a função correspondente
-    def handle_command(self, command):
-        parts = command.split()
-        cmd = parts[0].upper()
-        if cmd == "NICK" and len(parts) > 1:
-            self.handle_nick(parts[1])
-        elif cmd == "USER" and len(parts) > 4:
-            realname = " ".join(parts[4:])
-            self.handle_user(parts[1], realname)
-        elif cmd == "PING" and len(parts) > 1:
-            mensagem = " ".join(parts[1:]) 
-            self.handle_ping(mensagem)
-        elif cmd == "PONG":
-            self.handle_pong(" ".join(parts[0:]))
-        elif cmd == "JOIN" and len(parts) > 1:
-            if self.registered:
-                self.handle_join(parts[1])
-            else:
-                self.send_data("ERRO : Necessário estar registrado\r\n")
-        elif cmd == "PART" and len(parts) > 1:
-            motivo = " ".join(parts[2:]) if len(parts) > 2 else ""
-            self.handle_part(parts[1], motivo)
-        elif cmd == "QUIT":
-            motivo = " ".join(parts[1:]) if len(parts) > 1 else ""
-            self.handle_quit(motivo)
-        elif cmd == "PRIVMSG" and len(parts) > 2:
-            if self.registered:
-                mensagem = " ".join(parts[2:])
-                self.handle_privmsg(parts[1], mensagem)
-        elif cmd == "NAMES" and len(parts) > 1:
-            self.handle_names(parts[1])
-        elif cmd == "LIST":
-            if len(parts) > 1:
-                canal = parts[1]
-                self.handle_list(canal)
+            if self.gone():
+                break # Saiu ou foi derrubado: o resto da leitura é descartado
+            log.debug("comando", "Recebendo comando", addr=self.addr, linha=command)
+            if self.pending is not None:
+                self.defer(command) # Mantém a ordem atrás das linhas já adiadas
             else:
-                self.handle_list("")
+                self.handle_command(command)
+        if self.pending is not None:
+            self.server.pause_client(self)
+
+    # Tabela de despacho: comando -> (mínimo de parâmetros, exige registro, handler, custo em fichas)
+    COMMANDS = {
+        "NICK": (1, False, lambda self, m: self.handle_nick(m.params[0]), 2),
+        "USER": (4, False, lambda self, m: self.handle_user(m.params[0], m.rest(3)), 1),
+        "PING": (1, False, lambda self, m: self.handle_ping(m.rest(0)), 1),
+        "PONG": (0, False, lambda self, m: self.handle_pong(m.rest(0)), 1),
+        "JOIN": (1, True, lambda self, m: self.handle_join(m.params[0]), 2),
+        "PART": (1, False, lambda self, m: self.handle_part(m.params[0], m.rest(1)), 2),
+        "QUIT": (0, False, lambda self, m: self.handle_quit(m.rest(0)), 0),
+        "PRIVMSG": (2, True, lambda self, m: self.handle_privmsg(m.params[0], m.rest(1)), 1),
+        "NAMES": (1, False, lambda self, m: self.handle_names(m.params[0]), 2),
+        "LIST": (0, False, lambda self, m: self.handle_list(m.rest(0)), 3),
+        "OPER": (2, True, lambda self, m: self.handle_oper(m.params[0], m.params[1]), 2),
+        "STATS": (0, True, lambda self, m: self.handle_stats(m.params[0] if m.params else ""), 1),
+        "PROFILE": (0, True, lambda self, m: self.handle_profile(m.params[0] if m.params else ""), 1),
+        "CHATHISTORY": (4, True, lambda self, m: self.handle_chathistory(*m.params[:4]), 2),
+        "LINKS": (0, True, lambda self, m: self.handle_links(), 2),
+    }
+
+    # Custo em fichas de um comando; uma lista de alvos custa uma ficha a mais a cada
+    # FLOOD_TARGETS alvos extras, e a PRIVMSG ainda pesa conforme o tamanho de cada canal
+    def command_cost(self, msg, entry):
+        if entry is None:
+            return 1
+        cost = entry[3]
+        if msg.command in MULTI_TARGET and msg.params:
+            targets = msg.params[0].split(",")
+            cost += (len(targets) - 1) // FLOOD_TARGETS
+            if msg.command == "PRIVMSG":
+                for target in targets:
+                    canal = self.server.get_channel(target)
+                    if canal is not None:
+                        cost += len(canal.members) // FLOOD_FANOUT
+        return cost
+
+    # Começa a adiar as linhas do cliente; esgotar o balde muitas vezes seguidas
+    # (sem contar as retomadas das linhas já adiadas) derruba a conexão
+    def throttle(self, command, cost, resumed=False):
+        self.pending = deque([command])
+        self.pending_cost = cost
+        self.server.metrics.flood_deferred += 1
+        if resumed:
+            return
+        self.server.metrics.flood_throttles += 1
+        if self.strikes is None:
+            self.strikes = Balde(1 / FLOOD_STRIKE_DECAY, self.server.flood_strikes)
+        if not self.strikes.take(1):
+            self.flood_kill()
+
+    def defer(self, command):
+        self.pending.append(command)
+        self.server.metrics.flood_deferred += 1
+        if len(self.pending) > FLOOD_PENDING:
+            self.flood_kill()
+
+    def flood_kill(self):
+        if self.quit_reason is None:
+            self.server.metrics.flood_kills += 1
+        self.pending = None
+        self.evict("Excess Flood")
+
+    # Cliente que saiu (QUIT) ou foi derrubado: as linhas que ainda estiverem na
+    # mesma leitura ou adiadas não são mais tratadas
+    def gone(self):
+        return self.staus_conn is False or self.quit_reason is not None
+
+    # Executa as linhas adiadas enquanto houver fichas; devolve True se todas saíram
+    # (ou se o cliente saiu no meio delas, e as que sobraram foram descartadas)
+    def drain_pending(self):
+        pending, self.pending = self.pending, None
+        while pending and not self.gone():
+            self.handle_command(pending.popleft(), resumed=True)
+            if self.pending is not None:
+                self.pending.extend(pending)
+                return False
+        return True
+
+    # Balde cheio é o estado inicial: enquanto o cliente não gastou nenhuma ficha
+    # (conexão que ainda não mandou nada) o balde não precisa existir
+    def bucket(self):
+        if self.flood is None:
+            self.flood = Balde(self.server.flood_rate, self.server.flood_burst)
+        return self.flood
+
+    # Separa a linha com o parser do protocolo e chama o handler da tabela de despacho
+    def handle_command(self, command, resumed=False):
+        msg = parse_message(command)
+        if msg is None:
+            return
+        entry = self.COMMANDS.get(msg.command)
+        if self.server.flood_rate:
+            cost = self.command_cost(msg, entry)
+            if cost and not self.bucket().take(cost):
+                self.throttle(command, cost, resumed)
+                return
+        if entry is None:
+            self.send_data(f":{self.server.host} 421 {self.nick or '*'} {msg.command} :Unknown command\r\n")
+        elif len(msg.params) < entry[0]:
+            self.send_data(f":{self.server.host} 461 {self.nick or '*'} {msg.command} :Not enough parameters\r\n")
+        elif entry[1] and not self.registered:
+            self.send_data(f":{self.server.host} 451 {self.nick or '*'} :Necessário estar registrado\r\n")
         else:
-            self.send_data("ERROR :Unknown command\r\n")
-      
+            start = time.perf_counter_ns()
+            entry[2](self, msg)
+            self.server.metrics.command(msg.command, time.perf_counter_ns() - start)
 
     def handle_nick(self, nick):
         #if not nick.isalnum() or len(nick) > 9:
-        if not re.match("^[A-Za-z][A-Za-z0-9_]{0,8}$", nick):
+        if not NICK_RE.match(nick):
             self.send_data(f"432 * {nick} :Erroneous Nickname\r\n")
         
-        elif self.server.is_nick_available(nick):
+        elif self.server.claim_nick(self, nick):
+            nick = sys.intern(nick)
             old_nick = self.nick
             self.nick = nick
+            self.ts = now_ms()
             if old_nick:
+                self.server.renamed(self)
                 self.send_data(f":{old_nick} NICK {nick}\r\n")
+                self.server.propagate(f":{old_nick} NICK {nick} {self.ts}\r\n".encode("utf-8"))
+            else:
+                self.server.introduce(self)
             self.check_registration() # Verifica se o cliente já registrou um nick e um username
         else:
             self.send_data(f"433 * {nick} :Nickname is already in use\r\n")
@@ -127,197 +638,1021 @@ class Cliente:
             self.send_data(f":server 372 {self.nick} :- {MOTD}\r\n")
             self.send_data(f":server 376 {self.nick} :End of /MOTD command.\r\n")
 
-    def handle_join(self, channel):
-        self.server.add_to_channel(self, channel)
-        self.actual_channel = channel
+    # JOIN, PART, PRIVMSG e NAMES aceitam vários alvos ("#a,#b"), tratados em uma
+    # única passada; alvos repetidos na lista contam uma vez
+    def handle_join(self, channels):
+        for channel in split_targets(channels):
+            self.server.add_to_channel(self, channel)
+            self.actual_channel = channel
         
 
-    def handle_part(self, channel, motivo=""):
-        self.server.remove_from_channel(self, channel, motivo)
+    def handle_part(self, channels, motivo=""):
+        for channel in split_targets(channels):
+            self.server.remove_from_channel(self, channel, motivo)
         
     def handle_quit(self, motivo=""):
         self.server.remove_client(self, motivo)
-        self.conn.close()
+        self.close()
+
+    # Fecha a conexão do cliente depois de enviar o que ainda está na fila de saída;
+    # no modo asyncio também remove o socket do laço de eventos. Se a fila não
+    # esvaziou, o cliente volta à roda de keepalive, que desliga o socket no prazo.
+    # Só a primeira chamada tem efeito
+    def close(self):
+        if self.staus_conn is False:
+            return
         self.staus_conn = False
+        if self.server.loop is not None:
+            self.server.loop.remove_reader(self.conn.fileno())
+        self.fila.close()
+        if self.fila.scheduled:
+            self.last_seen = self.server.keepalive.now
+            self.server.keepalive.schedule(self, CLOSE_TIMEOUT)
+
+    # Derruba um cliente que não consegue acompanhar a fila de saída. O socket é
+    # apenas desligado; quem lê a conexão (thread ou laço) percebe o fim e faz a
+    # remoção completa com o motivo registrado
+    def evict(self, reason):
+        if self.quit_reason is None:
+            self.quit_reason = reason
+            log.info("conexao", "Desconectando", addr=self.addr, nick=self.nick, motivo=reason)
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         
-    def handle_privmsg(self, channel, message):
-        self.server.broadcast_to_channel(
-            channel, f":{self.nick} PRIVMSG {channel} :{message}\r\n", self
-        )
-
-    def handle_names(self, channel):
-        if channel in self.server.channels:
-            users = [
-                c.nick for c in self.server.channels[channel] if c.nick is not None
-            ]
-            self.send_data(
-                f":{self.server.host} 353 {self.nick} = {channel} :{' '.join(users)}\r\n"
-            )
-            self.send_data(
-                f":{self.server.host} 366 {self.nick} {channel} :End of /NAMES list.\r\n"
+    # Com vários canais, quem está em mais de um recebe a mensagem uma única vez
+    # (endereçada ao primeiro canal da lista que tem em comum com o remetente)
+    def handle_privmsg(self, targets, message):
+        channels = split_targets(targets)
+        if len(channels) > MAX_TARGETS:
+            self.send_data(f":{self.server.host} 407 {self.nick} {targets} :Too many recipients\r\n")
+            return
+        seen = {self} if len(channels) > 1 else None
+        for channel in channels:
+            self.server.broadcast_to_channel(
+                channel, f":{self.nick} PRIVMSG {channel} :{message}\r\n", self, seen
             )
+
+    def handle_names(self, channels):
+        for channel in split_targets(channels):
+            self.server.list_names(channel, self)
+
+    # LIST [canais|filtros]: canais com o número de usuários (ver Servidor.start_list)
+    def handle_list(self, query):
+        self.server.start_list(self, query)
+
+
+    # OPER <nome> <senha>: operadores configurados com --oper nome:senha
+    def handle_oper(self, name, password):
+        expected = self.server.opers.get(name)
+        if not self.server.opers:
+            self.send_data(f":{self.server.host} 491 {self.nick} :No O-lines for your host\r\n")
+        elif expected is not None and hmac.compare_digest(expected.encode(), password.encode()):
+            self.is_oper = True
+            log.info("oper", "Novo operador", nick=self.nick, addr=self.addr, nome=name)
+            self.send_data(f":{self.server.host} 381 {self.nick} :You are now an IRC operator\r\n")
         else:
-            self.send_data(f"403 {self.nick} {channel} :No such channel\r\n")
+            self.send_data(f":{self.server.host} 464 {self.nick} :Password incorrect\r\n")
+
+    def require_oper(self):
+        if not self.is_oper:
+            self.send_data(f":{self.server.host} 481 {self.nick} :Permission Denied- You're not an IRC operator\r\n")
+        return self.is_oper
+
+    # STATS [m|u|q|p]: métricas do servidor, somente para operadores
+    def handle_stats(self, query):
+        if not self.require_oper():
+            return
+        host = self.server.host
+        for line in self.server.metrics.report(self.server, query):
+            self.send_data(f":{host} 249 {self.nick} :{line}\r\n")
+        self.send_data(f":{host} 219 {self.nick} {query or '*'} :End of STATS report\r\n")
 
-    def handle_list(self, canal):
+    # PROFILE ON|OFF liga e desliga o profiler por amostragem; sem argumento mostra o resultado
+    def handle_profile(self, action):
+        if not self.require_oper():
+            return
+        action = action.upper()
+        if action == "ON":
+            self.server.metrics.start_profiler()
+        elif action == "OFF":
+            self.server.metrics.stop_profiler()
+        self.handle_stats("p")
+
+    # CHATHISTORY LATEST <canal> <*|timestamp=...> <n> / BEFORE|AFTER <canal> timestamp=... <n>
+    # (IRCv3): as mensagens voltam em um BATCH com a tag time de cada uma
+    def handle_chathistory(self, subcommand, channel, selector, limit):
+        host = self.server.host
+        subcommand = subcommand.upper()
+        canal = self.server.get_channel(channel)
+        history = self.server.history
+        if history is None or canal is None or canal not in self.channels:
+            self.send_data(f":{host} FAIL CHATHISTORY INVALID_TARGET {subcommand} {channel} :Histórico indisponível\r\n")
+            return
         try:
-            if canal in self.server.channels:
-                if self in self.server.channels[canal]:
-                    clients = self.server.channels[canal]
-                    if clients:
-                        users = [client.nick for client in clients if client.nick is not None]
-                        self.send_data(f"Usuários do canal: {' '.join(users)}\r\n")
-                    else:
-                        self.send_data(f"Usuários do canal: \r\n")
-            else:
-                for channel, clients in self.server.channels.items():
-                    if self in self.server.channels[channel]:
-                        clients = self.server.channels[canal]
-                        if clients:
-                            users = [client.nick for client in clients if client.nick is not None]
-                            self.send_data(f"Usuários do canal: {' '.join(users)}\r\n")
-                        else:
-                            self.send_data(f"Usuários do canal: \r\n")
-            self.send_data(f":server 323 {self.nick} :End of /LIST\r\n")
-        except Exception as e:
-            print(f"Erro ao listar canais: {e}")
+            limit = int(limit)
+            if limit <= 0:
+                raise ValueError(limit)
+            limit = min(limit, history.limit)
+            stamp = None
+            if selector != "*":
+                kind, _, value = selector.partition("=")
+                if kind != "timestamp":
+                    raise ValueError(selector)
+                stamp = parse_time(value)
+        except ValueError:
+            self.send_data(f":{host} FAIL CHATHISTORY INVALID_PARAMS {subcommand} :Parâmetros inválidos\r\n")
+            return
+        key = canal.key
+        if subcommand == "LATEST":
+            entries = history.latest(key, limit, stamp)
+        elif subcommand in ("BEFORE", "AFTER") and stamp is not None:
+            entries = (history.before if subcommand == "BEFORE" else history.after)(key, stamp, limit)
+        else:
+            self.send_data(f":{host} FAIL CHATHISTORY INVALID_PARAMS {subcommand} :Parâmetros inválidos\r\n")
+            return
+        self.server.send_history(self, canal, entries)
 
+    # LINKS: servidores da rede (este e os que estão atrás de cada ligação)
+    def handle_links(self):
+        server = self.server
+        lines = [f":{server.host} 364 {self.nick} {server.name} {server.name} :0 {server.name}"]
+        for name, (link, uplink) in sorted(server.servers.items()):
+            lines.append(f":{server.host} 364 {self.nick} {name} {uplink} :1 {name}")
+        lines.append(f":{server.host} 365 {self.nick} * :End of /LINKS list.")
+        self.send_data("\r\n".join(lines) + "\r\n")
 
     def handle_ping(self, message):
         self.send_data(f"PONG :{message}\r\n")
 
-    def send_data(self, message):
-        try:
-            self.conn.sendall(message.encode("utf-8"))
-        except Exception as e:
-            print(f"Erro ao enviar dados para {self.addr}: {e}")
+    # Apenas enfileira a mensagem; o envio acontece no escritor.
+    # Mensagens "droppable" (tráfego de canal) são descartadas acima do limite suave
+    def send_data(self, message, droppable=False):
+        return self.fila.put(message.encode("utf-8"), droppable)
+
+    # Mesmo que send_data, para mensagens já serializadas (o mesmo objeto bytes
+    # pode estar na fila de vários clientes ao mesmo tempo)
+    def send_bytes(self, data, droppable=False):
+        return self.fila.put(data, droppable)
+
+    # Tamanho atual da fila de saída (bytes, mensagens)
+    def sendq_depth(self):
+        return self.fila.size, len(self.fila.items)
             
-    def send_ping(self):
-        while True:
-            try:
-                self.send_data("PING :server\r\n")
-                time.sleep(30)  # Envia PING a cada 60 segundos
-            except Exception as e:
-                print(f"Erro ao enviar PING: {e}")
-                break
-    
+    # Qualquer leitura já conta como atividade; o PONG só encerra a espera do keepalive
     def handle_pong(self, resposta):
-        print(resposta)
+        self.ping_sent = None
         
 class Servidor:
     
     # Inicializando servidor com porta padrão 6667 e listas de clientes e canais
-    def __init__(self, port=6667):
+    def __init__(self, port=6667, sendq_soft=SENDQ_SOFT, sendq_hard=SENDQ_HARD,
+                 ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT):
         self.port = port
         self.host = None
-        self.clients = []
-        self.channels = {}
+        self.clients = set()
+        self.channels = {} # irc_lower(nome) -> Canal
+        self.nicks = {}    # irc_lower(nick) -> Cliente
+        self.loop = None # Laço de eventos, preenchido apenas no modo asyncio
+        self.recv_buffer = bytearray(RECV_SIZE) # Buffer de leitura do modo asyncio
+        self.escritor = None # Thread que esvazia as filas de saída no modo com threads
+        self.bus = None      # Barramento entre processos (modo --workers)
+        self.links = []      # Ligações com o resto da rede (barramento ou outros servidores)
+        self.name = None     # Nome do servidor na rede (--nome); padrão "<host>.<porta>"
+        self.servers = {}    # Servidores da rede: nome -> (ligação por onde se chega, uplink)
+        self.link_port = None     # Porta das ligações de outros servidores (--link-porta)
+        self.link_targets = []    # (host, porta) a que este servidor se liga (--conectar)
+        self.link_password = None # Senha exigida nas ligações (--link-senha)
+        self.handoff_path = None  # Socket Unix da troca a quente (--troca)
+        self.listen_socket = None
+        self.stop_future = None
+        self.sendq_soft = sendq_soft
+        self.sendq_hard = sendq_hard
+        self.metrics = Metricas()
+        self.opers = {}           # nome -> senha do OPER
+        self.metrics_path = None  # Socket Unix de coleta das métricas (opcional)
+        self.keepalive = RodaTempo()
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.stopped = threading.Event() # Encerra o laço de keepalive do modo com threads
+        self.flood_rate = FLOOD_RATE # 0 desliga o controle de flood
+        self.flood_burst = FLOOD_BURST
+        self.flood_strikes = FLOOD_STRIKES
+        self.history = None      # Historico dos canais, criado em start_history()
+        self.history_limit = 0   # Mensagens guardadas por canal (0 desliga)
+        self.history_path = None # Log em disco do histórico (opcional)
+        self.history_join = 0    # Mensagens repetidas para quem entra em um canal
+        self.batches = count(1)
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
 
     
     # Inicializando servidor em uma thread na função accept_connections
 
     def start(self):
+        self.escritor = Escritor()
+        self.start_metrics()
+        self.start_history()
         threading.Thread(target=self.accept_connections).start()
 
+    # Laço do keepalive no modo com threads: bloqueia a thread principal até stop()
+    def run_keepalive(self):
+        while not self.stopped.wait(self.keepalive.tick):
+            self.check_keepalive()
 
-    # Função que roda em loop para aceitar conexões de clientes até que o servidor seja encerrado
-    # Adiciona clientes na lista de clientes (atributo da classe Servidor)
-    # Para cada conexão cria objeto da classe Cliente e uma nova thread usando Cliente.run()
-    def accept_connections(self):
+    # No modo asyncio o tick é uma chamada agendada no próprio laço
+    def keepalive_async(self):
+        self.check_keepalive()
+        self.loop.call_later(self.keepalive.tick, self.keepalive_async)
+
+    def watch(self, client):
+        self.keepalive.schedule(client, self.ping_interval)
+
+    # Trata os clientes vencidos neste tick. Cada cliente fica em uma única posição
+    # da roda; o custo por tick é proporcional aos clientes que vencem nele, não ao total
+    def check_keepalive(self):
+        wheel = self.keepalive
+        for client in wheel.advance():
+            if client not in self.clients:
+                # Já saiu; a entrada é descartada aqui em vez de removida na saída. Quem
+                # saiu sem ler a fila de saída até o prazo perde o que falta enviar e
+                # tem o socket desligado, que volta a aceitar escrita: o escritor
+                # encontra a fila vazia e fecha o socket
+                fila = client.fila
+                if fila.closing and fila.scheduled:
+                    left = CLOSE_TIMEOUT - (wheel.now - client.last_seen)
+                    if left > 0:
+                        wheel.schedule(client, left)
+                    else:
+                        fila.discard()
+                        client.evict("Close timeout")
+                continue
+            idle = wheel.now - client.last_seen
+            if client.ping_sent is not None and client.last_seen < client.ping_sent:
+                if wheel.now - client.ping_sent < self.ping_timeout:
+                    wheel.schedule(client, self.ping_timeout - (wheel.now - client.ping_sent))
+                    continue
+                # Sem resposta: quem lê a conexão percebe o fim e chama remove_client
+                self.metrics.ping_timeouts += 1
+                client.evict(f"Ping timeout: {int(idle)} seconds")
+            elif idle < self.ping_interval:
+                client.ping_sent = None
+                wheel.schedule(client, self.ping_interval - idle)
+            else:
+                client.ping_sent = wheel.now
+                client.send_data(f"PING :{self.host}\r\n")
+                wheel.schedule(client, self.ping_timeout)
+
+    def start_metrics(self):
+        if self.metrics_path:
+            serve_scrape(self, self.metrics_path)
+
+    def start_history(self):
+        if self.history_limit:
+            self.history = Historico(self.history_limit, self.history_path)
+
+    # Entrega uma fila com dados pendentes ao escritor do modo em uso
+    def wake_writer(self, fila):
+        if self.loop is not None:
+            self.loop.add_writer(fila.client.conn.fileno(), self.flush_async, fila)
+        else:
+            self.escritor.wake(fila)
+
+    def flush_async(self, fila):
+        if fila.flush():
+            self.loop.remove_writer(fila.client.conn.fileno())
+            if fila.closing:
+                fila.close_socket()
+
+    # Profundidade da fila de saída de cada cliente: (nick, endereço, bytes, mensagens, descartadas)
+    def sendq_report(self):
+        return [
+            (c.nick, c.addr, *c.sendq_depth(), c.fila.dropped) for c in list(self.clients)
+        ]
+
+    # Cria o socket de escuta compartilhado pelos dois modos. Com reuse_port vários
+    # processos escutam a mesma porta e o kernel distribui as conexões entre eles
+    def create_listen_socket(self, backlog=50, reuse_port=False):
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_socket.bind(("", self.port))
-        server_socket.listen(50)
+        server_socket.listen(backlog)
         self.host = socket.gethostname()
-        
-        
-        print(f"Servidor escutando na porta {self.port}...")
+        log.info("servidor", "Servidor escutando", porta=self.port)
+        return server_socket
+
+
+    # Função que roda em loop para aceitar conexões de clientes até que o servidor seja encerrado
+    # Adiciona clientes na lista de clientes (atributo da classe Servidor)
+    # Para cada conexão cria objeto da classe Cliente e uma nova thread usando Cliente.run()
+    def accept_connections(self):
+        server_socket = self.create_listen_socket()
 
         try:
             while True:
                 conn, addr = server_socket.accept()
-                print(f"Conexão aceita de {addr}")
+                log.info("conexao", "Conexão aceita", addr=addr)
+                self.metrics.accepted += 1
                 client = Cliente(conn, addr, self)
-                self.clients.append(client)
+                self.clients.add(client)
+                self.watch(client)
                 threading.Thread(target=client.run).start()
         except Exception as e:
-            print(f"Erro ao aceitar conexões: {e}")
+            log.error("servidor", "Erro ao aceitar conexões", erro=e)
+        finally:
+            server_socket.close()
+
+    # Modo asyncio: uma única thread atende todas as conexões com um laço de eventos.
+    # Os sockets ficam não bloqueantes e cada leitura disponível chama os mesmos
+    # handlers do modo com threads (Cliente.process_commands / handle_command)
+    def start_async(self, reuse_port=False):
+        asyncio.run(self.serve_async(reuse_port))
+
+    async def serve_async(self, reuse_port=False):
+        self.loop = asyncio.get_running_loop()
+        self.stop_future = self.loop.create_future()
+        self.start_metrics()
+        handoff = None
+        if self.handoff_path is not None:
+            import troca
+
+            # Com um servidor esperando no caminho, as conexões dele passam para este processo
+            handoff = troca.receive(self.handoff_path)
+        # Só depois da troca: o processo antigo grava todo o histórico antes de mandar
+        # o estado, e daí em diante está parado. O log relido aqui já inclui tudo, e a
+        # posição de escrita deste processo começa no fim do que o antigo escreveu
+        self.start_history()
+        if handoff is not None:
+            server_socket = troca.restore(self, *handoff)
+        else:
+            server_socket = self.create_listen_socket(backlog=1024, reuse_port=reuse_port)
+        server_socket.setblocking(False)
+        self.listen_socket = server_socket
+        self.loop.add_reader(server_socket.fileno(), self.accept_async, server_socket)
+        self.loop.call_later(self.keepalive.tick, self.keepalive_async)
+        for link in self.links:
+            link.start()
+        self.start_links()
+        if self.handoff_path is not None:
+            troca.listen(self, self.handoff_path)
+        try:
+            await self.stop_future # Roda até stop() ou até o processo ser interrompido
         finally:
+            self.loop.remove_reader(server_socket.fileno())
             server_socket.close()
+
+    # Ligações TCP com outros servidores (somente no modo asyncio)
+    def start_links(self):
+        if self.name is None:
+            self.name = f"{self.host}.{self.port}"
+        if self.link_port is None and not self.link_targets:
+            return
+        import ligacao
+
+        if self.link_port is not None:
+            ligacao.listen(self, self.link_port)
+        for target in self.link_targets:
+            ligacao.connect(self, target)
+
+    # Encerra o servidor (laço asyncio ou laço de keepalive do modo com threads)
+    def stop(self):
+        self.stopped.set()
+        if self.stop_future is not None and not self.stop_future.done():
+            self.stop_future.set_result(None)
+
+    def accept_async(self, server_socket):
+        while True:
+            try:
+                conn, addr = server_socket.accept()
+            except BlockingIOError:
+                return
+            except Exception as e:
+                log.error("servidor", "Erro ao aceitar conexões", erro=e)
+                return
+            log.info("conexao", "Conexão aceita", addr=addr)
+            self.metrics.accepted += 1
+            conn.setblocking(False)
+            client = Cliente(conn, addr, self)
+            client.staus_conn = True
+            self.clients.add(client)
+            self.watch(client)
+            self.loop.add_reader(conn.fileno(), self.read_async, client)
+
+    # Cliente sem fichas: no modo asyncio a leitura do socket pausa (o kernel segura
+    # o resto) e as linhas adiadas voltam quando o balde tiver fichas, sem travar o laço;
+    # no modo com threads a própria thread do cliente espera
+    def pause_client(self, client):
+        if client.quit_reason is not None:
+            client.pending = None
+            return
+        delay = client.flood.wait(client.pending_cost)
+        if self.loop is None:
+            while client.pending is not None and client.quit_reason is None:
+                time.sleep(delay)
+                if not client.drain_pending():
+                    delay = client.flood.wait(client.pending_cost)
+            return
+        self.loop.remove_reader(client.conn.fileno())
+        self.loop.call_later(delay, self.resume_client, client)
+
+    def resume_client(self, client):
+        if client not in self.clients or not client.staus_conn:
+            return
+        if client.quit_reason is None and not client.drain_pending():
+            self.loop.call_later(client.flood.wait(client.pending_cost), self.resume_client, client)
+            return
+        if not client.staus_conn:
+            return # Saiu com QUIT entre as linhas adiadas
+        # Linhas em dia (ou conexão derrubada): volta a ler, e a leitura percebe o fim
+        client.pending = None
+        self.loop.add_reader(client.conn.fileno(), self.read_async, client)
+
+    # Todas as conexões leem para o mesmo buffer (o laço roda em uma única thread)
+    def read_async(self, client):
+        try:
+            lines = client.read_lines(self.recv_buffer)
+        except BlockingIOError:
+            return
+        except Exception as e:
+            log.warning("conexao", "Erro ao receber dados", addr=client.addr, erro=e)
+            lines = None
+        if lines is None:
+            self.remove_client(client, client.quit_reason or "Connection closed")
+            client.close()
+            return
+        try:
+            client.process_commands(lines)
+        except Exception as e:
+            log.error("conexao", "Erro ao processar dados", addr=client.addr, erro=e)
             
 
-    def is_nick_available(self, nick):
-        return all(client.nick != nick for client in self.clients)
+    # Trava da faixa de uma chave (irc_lower) de nick ou canal
+    def lock_for(self, key):
+        return self.locks[hash(key) % LOCK_STRIPES]
 
+    # Faixas de várias chaves em ordem crescente (quem pega duas travas pega
+    # sempre na mesma ordem, sem risco de impasse)
+    def stripes(self, *keys):
+        return sorted({hash(key) % LOCK_STRIPES for key in keys if key is not None})
+
+    # Membros do canal para percorrer sem trava: a tupla da última leitura, ou uma
+    # nova cópia feita com a trava se os membros mudaram desde então. O envio
+    # acontece depois, sem nenhuma trava
+    def members_of(self, canal):
+        snapshot = canal.snapshot
+        if snapshot is None:
+            with self.lock_for(canal.key):
+                snapshot = canal.snapshot
+                if snapshot is None:
+                    snapshot = canal.snapshot = tuple(canal.members)
+        return snapshot
+
+    def is_nick_available(self, nick, client=None):
+        owner = self.nicks.get(irc_lower(nick))
+        return owner is None or owner is client
+
+    # Reserva o nick para o cliente, liberando o nick anterior dele.
+    # Com vários processos a reserva também é confirmada no barramento
+    def claim_nick(self, client, nick):
+        key = irc_lower(nick)
+        old = irc_lower(client.nick) if client.nick is not None else None
+        held = self.stripes(key, old)
+        for i in held:
+            self.locks[i].acquire()
+        try:
+            owner = self.nicks.get(key)
+            if owner is not None and owner is not client:
+                return False
+            if self.bus is not None and not self.bus.claim(client.nick, nick):
+                return False
+            if old is not None:
+                self.nicks.pop(old, None)
+            self.nicks[sys.intern(key)] = client
+            return True
+        finally:
+            for i in held:
+                self.locks[i].release()
+
+    def get_channel(self, name):
+        return self.channels.get(irc_lower(name))
+
+    # Criar o canal e entrar nele acontecem juntos com a trava: dois JOINs no mesmo
+    # canal novo não criam dois canais, e um PART que apaga o canal vazio não deixa
+    # quem está entrando em um canal fora do registro. As respostas saem depois
     def add_to_channel(self, client, channel):
-        if channel not in self.channels:
-            self.channels[channel] = deque()
-            self.channels[channel].append(client)
+        key = irc_lower(channel)
+        with self.lock_for(key):
+            canal = self.channels.get(key)
+            created = canal is None
+            if created:
+                canal = Canal(channel)
+                self.channels[canal.key] = canal
+            joined = client not in canal.members
+            if joined:
+                self.join_channel(client, canal)
+        if created:
             client.send_data(f":{self.host} 403 {client.nick} #{channel} :No such channel\r\n")
+            self.propagate(f":{client.nick} JOIN :{canal.name}\r\n".encode("utf-8"))
+            self.replay_history(client, canal)
             
         else:
-            if client in self.channels[channel]:
-                client.send_data(f":{self.host} 442 {client.nick} {channel} :You're already on that channel\r\n")
+            if not joined:
+                client.send_data(f":{self.host} 442 {client.nick} {canal.name} :You're already on that channel\r\n")
             else:
-                self.channels[channel].append(client)
-                client.send_data(f":{client.nick} JOIN :{channel}\r\n")
-                self.broadcast_to_channel(channel, f":{client.nick} JOIN :{channel}\r\n", client)
-                self.list_names(channel, client)
+                data = f":{client.nick} JOIN :{canal.name}\r\n".encode("utf-8")
+                client.send_bytes(data)
+                self.broadcast(canal, data, client, relay=False)
+                self.propagate(data)
+                self.list_names(canal.name, client)
+                self.replay_history(client, canal)
 
     def remove_from_channel(self, client, channel, motivo):
-        if channel in self.channels and client in self.channels[channel]:
-            self.channels[channel].remove(client)
-            client.send_data(f":{client.nick} PART {channel} {motivo}\r\n")
-            if not self.channels[channel]:
-                del self.channels[channel]
-            self.broadcast_to_channel(
-                channel, f":{client.nick} PART {channel} {motivo}\r\n", client
-            )
+        canal = self.get_channel(channel)
+        if canal is not None and client in canal.members:
+            self.part_channel(client, canal)
+            data = f":{client.nick} PART {canal.name} :{motivo}\r\n".encode("utf-8")
+            client.send_bytes(data)
+            self.broadcast(canal, data, client, relay=False)
+            self.propagate(data)
         else:
             client.send_data(f"{self.host} 442 {client.nick} {channel} :You're not on that channel\r\n")
 
+    # Põe o cliente no canal e no índice reverso (o conjunto é criado no primeiro canal).
+    # Chamado com a trava do canal. O índice reverso só é alterado pela thread do
+    # próprio cliente (ou pelo laço, para usuários remotos)
+    def join_channel(self, client, canal):
+        canal.members[client] = None
+        canal.snapshot = canal.entry = None
+        names = canal.names
+        if names is not None and client.nick is not None:
+            # O nick entra no fim do último pedaço do NAMES, ou abre um novo
+            last = names[-1] if names else None
+            room = MAX_LINE - 2 - len(self.names_head(canal).encode("utf-8"))
+            if last is not None and len(last.encode("utf-8")) + 1 + len(client.nick.encode("utf-8")) <= room:
+                names[-1] = f"{last} {client.nick}"
+            else:
+                names.append(client.nick)
+        if client.channels is NO_CHANNELS:
+            client.channels = set()
+        client.channels.add(canal)
+
+    # Tira o cliente do canal (e do índice reverso); canais vazios são removidos
+    # na hora, e o índice de quem não ficou em nenhum canal volta a ser o vazio
+    # compartilhado
+    def part_channel(self, client, canal):
+        with self.lock_for(canal.key):
+            canal.members.pop(client, None)
+            canal.snapshot = canal.names = canal.entry = None
+            if not canal.members and self.channels.get(canal.key) is canal:
+                del self.channels[canal.key]
+        client.channels.discard(canal)
+        if not client.channels:
+            client.channels = NO_CHANNELS
+
+    # Início da linha 353 com o maior nick possível: os pedaços guardados no canal
+    # cabem em 512 bytes qualquer que seja o nick de quem pede
+    def names_head(self, canal):
+        return f":{self.host} 353 {'x' * 9} = {canal.name} :"
+
+    # Pedaços do NAMES do canal: os guardados, ou refeitos com a trava se algum
+    # membro saiu ou trocou de nick desde a última vez
+    def names_of(self, canal):
+        names = canal.names
+        if names is None:
+            with self.lock_for(canal.key):
+                names = canal.names
+                if names is None:
+                    head = self.names_head(canal)
+                    users = [c.nick for c in canal.members if c.nick is not None]
+                    names = canal.names = [line[len(head):] for line in pack_items(head, users)]
+        return list(names)
+
+    # "<canal> <usuários> :" do 322, guardado até o próximo JOIN/PART no canal
+    def list_entry(self, canal):
+        entry = canal.entry
+        if entry is None:
+            with self.lock_for(canal.key):
+                entry = canal.entry
+                if entry is None:
+                    entry = canal.entry = f"{canal.name} {len(canal.members)} :\r\n"
+        return entry
+
+    # O usuário trocou de nick: os NAMES guardados dos canais dele ficam velhos
+    def renamed(self, user):
+        for canal in list(user.channels):
+            with self.lock_for(canal.key):
+                canal.names = None
+
+    # Responde com quantas linhas 353 forem necessárias para caber em 512 bytes
+    # cada, seguidas do 366, tudo em um único item da fila de saída
     def list_names(self, channel, client):
-        if channel in self.channels:
-            users = [c.nick for c in self.channels[channel] if c.nick is not None]
-            client.send_data(
-                f":{self.host} 353 {client.nick} = {channel} :{' '.join(users)}\r\n"
-            )
-            client.send_data(
-                f":{self.host} 366 {client.nick} {channel} :End of /NAMES list.\r\n"
-            )
+        canal = self.get_channel(channel)
+        if canal is not None:
+            head = f":{self.host} 353 {client.nick} = {canal.name} :"
+            lines = [head + names for names in self.names_of(canal)]
+            lines.append(f":{self.host} 366 {client.nick} {canal.name} :End of /NAMES list.")
+            client.send_data("\r\n".join(lines) + "\r\n")
         else:
             client.send_data(f"403 {client.nick} {channel} :No such channel\r\n")
 
-    def broadcast_to_channel(self, channel, message, sender=None):
-        if channel in self.channels:
-            for client in self.channels[channel]:
-                if client != sender:
-                    client.send_data(message)
-
-    def remove_client(self, client, motivo):
-        for channel in list(self.channels.keys()):
-            if client in self.channels[channel]:
-                self.channels[channel].remove(client)
-        if client in self.clients:
-            self.clients.remove(client)
+    # LIST: 321, um 322 por canal que passa nos filtros e 323. Com nomes de canais
+    # sem filtro responde direto; senão percorre uma cópia da lista de canais em
+    # blocos (continue_list). Um LIST novo substitui o que estiver em andamento
+    def start_list(self, client, query):
+        names, tests = list_filters(query)
+        client.send_data(f":{self.host} 321 {client.nick} Channel :Users  Name\r\n")
+        if names:
+            channels = [canal for canal in map(self.get_channel, names) if canal is not None]
+        else:
+            channels = list(self.channels.values())
+        client.listing = (iter(channels), tests)
+        self.continue_list(client, client.listing)
+
+    # Manda blocos de LIST_CHUNK canais enquanto a fila de saída do cliente estiver
+    # abaixo de LIST_SENDQ. No modo asyncio cada bloco é um passo do laço (os outros
+    # clientes são atendidos entre os blocos) e a espera é um call_later; no modo com
+    # threads a própria thread do cliente espera a fila esvaziar
+    def continue_list(self, client, listing):
+        channels, tests = listing
+        prefix = f":{self.host} 322 {client.nick} "
+        while client.listing is listing:
+            if not client.staus_conn or client.quit_reason is not None:
+                client.listing = None
+                return
+            if client.fila.size > LIST_SENDQ:
+                if self.loop is not None:
+                    self.loop.call_later(LIST_PAUSE, self.continue_list, client, listing)
+                    return
+                time.sleep(LIST_PAUSE)
+                continue
+            chunk = list(islice(channels, LIST_CHUNK))
+            lines = []
+            for canal in chunk:
+                users = len(canal.members)
+                if users and all(test(canal, users) for test in tests):
+                    lines.append(prefix + self.list_entry(canal))
+            if len(chunk) < LIST_CHUNK:
+                lines.append(f":{self.host} 323 {client.nick} :End of /LIST\r\n")
+                client.listing = None
+            if lines:
+                client.send_data("".join(lines))
+            if client.listing is listing and self.loop is not None:
+                self.loop.call_soon(self.continue_list, client, listing)
+                return
+
+    def broadcast_to_channel(self, channel, message, sender=None, seen=None):
+        canal = self.get_channel(channel)
+        if canal is not None:
+            data = message.encode("utf-8")
+            self.broadcast(canal, data, sender, seen=seen)
+            if self.history is not None:
+                self.history.record(canal.key, data)
+
+    # Mensagens recentes do canal para quem acabou de entrar (--historico-join)
+    def replay_history(self, client, canal):
+        if self.history is not None and self.history_join:
+            entries = self.history.latest(canal.key, self.history_join)
+            if entries:
+                self.send_history(client, canal, entries)
+
+    # Envia entradas do histórico em um BATCH chathistory, tudo em um único buffer
+    def send_history(self, client, canal, entries):
+        ref = f"h{next(self.batches)}"
+        parts = [f":{self.host} BATCH +{ref} chathistory {canal.name}\r\n".encode("utf-8")]
+        for stamp, line in entries:
+            parts.append(f"@batch={ref};time={format_time(stamp)} ".encode())
+            parts.append(line)
+        parts.append(f":{self.host} BATCH -{ref}\r\n".encode())
+        client.send_bytes(b"".join(parts))
+
+    # A mensagem é serializada uma única vez e o mesmo buffer vai para a fila
+    # de saída de todos os membros locais. Membros remotos recebem uma única cópia
+    # por ligação (exceto pela ligação de onde a mensagem veio); com relay=False
+    # a entrega é só local (mudanças de estado seguem por propagate). Com `seen`
+    # (PRIVMSG para vários canais) o membro local que já recebeu em outro canal é
+    # pulado; as ligações recebem a linha de cada canal
+    def broadcast(self, canal, message, sender=None, origin=None, relay=True, seen=None):
+        start = time.perf_counter_ns()
+        data = message.encode("utf-8") if isinstance(message, str) else message
+        links = None
+        recipients = 0
+        # Cópia imutável dos membros: quem entra ou sai durante o envio não altera
+        # esta passada, e nenhuma trava fica presa enquanto as filas são preenchidas
+        for client in self.members_of(canal):
+            if client is sender:
+                continue
+            if client.link is None:
+                if seen is not None:
+                    if client in seen:
+                        continue
+                    seen.add(client)
+                client.send_bytes(data, droppable=True)
+                recipients += 1
+            elif relay and client.link is not origin:
+                if links is None:
+                    links = set()
+                links.add(client.link)
+        if links:
+            for link in links:
+                link.send_bytes(data)
+        self.metrics.broadcast(recipients, time.perf_counter_ns() - start)
+
+    # Envia uma mudança de estado (JOIN/PART/QUIT/NICK) para todas as ligações
+    def propagate(self, data, origin=None):
+        for link in self.links:
+            if link is not origin:
+                link.send_bytes(data)
+
+    # Anuncia um nick novo às ligações entre servidores (o barramento reserva os
+    # nicks por conta própria)
+    def introduce(self, client):
+        if not self.links:
+            return
+        data = f"NICK {client.nick} {client.ts} {self.name}\r\n".encode("utf-8")
+        for link in self.links:
+            if link.introduces_users:
+                link.send_bytes(data)
+
+    # Remove o cliente dos canais em que está (índice reverso, sem percorrer todos
+    # os canais do servidor) e avisa uma única vez cada usuário que compartilhava
+    # algum canal com ele. Um cliente que já saiu não é removido de novo
+    def remove_client(self, client, motivo, relay=True):
+        if client not in self.clients:
+            return
+        peers = self.leave_all(client)
+        self.clients.discard(client)
+        data = f":{client.nick} QUIT :{motivo}\r\n".encode("utf-8")
+        for peer in peers:
+            peer.send_bytes(data, droppable=True)
+        if client.nick is not None and relay:
+            self.propagate(data)
         try:
-            client.send_data(f":{client.nick} QUIT {motivo} \r\n")
+            client.send_bytes(data)
         except Exception as e:
-            print(f"Erro ao enviar dados para {client.addr}: {e}")
+            log.warning("envio", "Erro ao enviar dados", addr=client.addr, erro=e)
         
 
 
+    # Tira um usuário (local ou remoto) de todos os canais e do índice de nicks;
+    # devolve os clientes locais que compartilhavam algum canal com ele
+    def leave_all(self, user):
+        peers = {}
+        for canal in list(user.channels):
+            self.part_channel(user, canal)
+            for member in self.members_of(canal):
+                if member.link is None:
+                    peers[member] = None
+        if user.nick is not None:
+            key = irc_lower(user.nick)
+            with self.lock_for(key):
+                if self.nicks.get(key) is user:
+                    del self.nicks[key]
+        return peers
+
+    # Tira da rede um usuário por decisão de uma ligação (colisão de nick, netsplit).
+    # Os membros locais dos canais recebem um QUIT; um cliente local é desconectado
+    # sem que a saída siga pelas ligações (elas recebem um KILL ou SQUIT)
+    def kill(self, user, reason):
+        if user.link is None:
+            user.send_data(f":{self.name} KILL {user.nick} :{reason}\r\n")
+            user.quit_reason = reason
+            self.remove_client(user, reason, relay=False)
+            user.close()
+            return
+        data = f":{user.nick} QUIT :{reason}\r\n".encode("utf-8")
+        for peer in self.leave_all(user):
+            peer.send_bytes(data, droppable=True)
+
+    # Põe um usuário remoto no canal (criado se preciso) e avisa os membros locais
+    def join_remote(self, user, name, data):
+        key = irc_lower(name)
+        with self.lock_for(key):
+            canal = self.channels.get(key)
+            if canal is None:
+                canal = Canal(name)
+                self.channels[canal.key] = canal
+            if user in canal.members:
+                return False
+            self.join_channel(user, canal)
+        self.broadcast(canal, data, user, relay=False)
+        return True
+
+    # Linha vinda de uma ligação: atualiza os usuários remotos e entrega a mesma
+    # linha, sem serializar de novo, aos membros locais; mudanças de estado
+    # seguem para as demais ligações
+    def handle_remote(self, link, data):
+        nick, cmd, target = split_prefixed(data)
+        if cmd is None:
+            return
+        if cmd == b"PRIVMSG":
+            canal = self.get_channel(target)
+            if canal is not None:
+                self.broadcast(canal, data, origin=link)
+                if self.history is not None:
+                    self.history.record(canal.key, data)
+            return
+        key = irc_lower(nick)
+        user = self.nicks.get(key)
+        if cmd == b"JOIN":
+            if user is None and not link.introduces_users:
+                user = self.nicks[key] = UsuarioRemoto(nick, link)
+            elif user is None or user.link is not link:
+                return
+            if not self.join_remote(user, target, data):
+                return
+        elif user is None or user.link is not link:
+            # Usuário que não está em nenhum canal daqui: só repassa adiante. Entre
+            # servidores todo usuário é conhecido, então é uma linha de quem já saiu
+            if link.introduces_users:
+                return
+        elif cmd == b"PART":
+            canal = self.get_channel(target)
+            if canal is not None and user in canal.members:
+                self.broadcast(canal, data, user, relay=False)
+                self.part_channel(user, canal)
+            if not user.channels and not link.introduces_users:
+                del self.nicks[key]
+        elif cmd == b"QUIT":
+            for peer in self.leave_all(user):
+                peer.send_bytes(data, droppable=True)
+        elif cmd == b"NICK":
+            del self.nicks[key]
+            user.nick = target
+            self.nicks[irc_lower(target)] = user
+            self.renamed(user)
+        self.propagate(data, origin=link)
+
+
+# Modo com vários processos: o processo principal roda o barramento e cria N workers
+# (fork) no modo asyncio, todos escutando a mesma porta com SO_REUSEPORT
+def start_workers(count, make_server):
+    import barramento
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(prefix="irc-"), "barramento.sock")
+    hub = barramento.Barramento(path)
+    pids = []
+    for worker_id in range(count):
+        pid = os.fork()
+        if pid == 0:
+            hub.close()
+            code = 0
+            server = None
+            try:
+                server = make_server()
+                if server.metrics_path:
+                    server.metrics_path = f"{server.metrics_path}.{worker_id}"
+                if server.history_path:
+                    server.history_path = f"{server.history_path}.w{worker_id}"
+                if log.path:
+                    log.reopen(f"{log.path}.w{worker_id}")
+                server.bus = barramento.LigacaoBarramento(server, path, worker_id)
+                server.links.append(server.bus)
+                server.start_async(reuse_port=True)
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                log.error("servidor", "Erro no worker", worker=worker_id, erro=e)
+                code = 1
+            if server is not None and server.history is not None:
+                server.history.flush(1)
+            log.flush()
+            os._exit(code)
+        pids.append(pid)
+    log.info("servidor", "Workers iniciados", quantidade=count, pids=pids)
+    try:
+        hub.run()
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        hub.close()
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+
+
+# Valor de --log-amostra: "CATEGORIA=N" -> (categoria, N), com N inteiro positivo
+def sampling_rule(text):
+    category, _, every = text.partition("=")
+    try:
+        every = int(every)
+    except ValueError:
+        every = 0
+    if not category or every < 1:
+        raise argparse.ArgumentTypeError(f"esperado CATEGORIA=N com N inteiro positivo: {text!r}")
+    return category, every
+
+
 def main():
-    port = 6667  # Porta padrão do IRC
-    server = Servidor(port) # Inicializando classe Servidor
-    server.start() # Inicializando servidor
-    print("Servidor iniciado. Pressione Ctrl+C para parar.")
+    parser = argparse.ArgumentParser(description="Servidor IRC")
+    parser.add_argument("--porta", type=int, default=6667) # Porta padrão do IRC
+    parser.add_argument("--modo", choices=["threads", "async"], default="threads",
+                        help="threads: uma thread por conexão; async: um único laço de eventos")
+    parser.add_argument("--sendq-soft", type=int, default=SENDQ_SOFT // 1024,
+                        help="KiB na fila de saída a partir dos quais mensagens de canal são descartadas")
+    parser.add_argument("--sendq-hard", type=int, default=SENDQ_HARD // 1024,
+                        help="KiB na fila de saída a partir dos quais o cliente é desconectado")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processos que dividem a porta via SO_REUSEPORT (usa o modo async)")
+    parser.add_argument("--ping-intervalo", type=int, default=PING_INTERVAL,
+                        help="segundos sem atividade antes de enviar PING ao cliente")
+    parser.add_argument("--ping-timeout", type=int, default=PING_TIMEOUT,
+                        help="segundos de espera pelo PONG antes de desconectar")
+    parser.add_argument("--flood-taxa", type=float, default=FLOOD_RATE,
+                        help="fichas por segundo de cada cliente no controle de flood (0 desliga)")
+    parser.add_argument("--flood-rajada", type=int, default=FLOOD_BURST,
+                        help="fichas acumuladas no máximo (rajada permitida)")
+    parser.add_argument("--flood-avisos", type=int, default=FLOOD_STRIKES,
+                        help="vezes seguidas sem fichas antes de desconectar o cliente")
+    parser.add_argument("--historico", type=int, default=0,
+                        help="mensagens guardadas por canal para CHATHISTORY (0 desliga)")
+    parser.add_argument("--historico-arquivo", metavar="CAMINHO",
+                        help="log em disco do histórico (segmentos CAMINHO.0, CAMINHO.1, ...)")
+    parser.add_argument("--historico-join", type=int, default=0,
+                        help="mensagens do histórico repetidas para quem entra no canal")
+    parser.add_argument("--oper", action="append", default=[], metavar="NOME:SENHA",
+                        help="operador que pode usar STATS e PROFILE (pode repetir)")
+    parser.add_argument("--metricas", metavar="CAMINHO",
+                        help="socket Unix que devolve as métricas em JSON a cada conexão")
+    parser.add_argument("--perfil", action="store_true",
+                        help="liga o profiler por amostragem desde o início")
+    parser.add_argument("--nome", help="nome do servidor na rede de servidores (padrão: <host>.<porta>)")
+    parser.add_argument("--link-porta", type=int, metavar="PORTA",
+                        help="porta que aceita ligações de outros servidores (usa o modo async)")
+    parser.add_argument("--conectar", action="append", default=[], metavar="HOST:PORTA",
+                        help="liga a outro servidor pela --link-porta dele (pode repetir)")
+    parser.add_argument("--link-senha", metavar="SENHA", help="senha exigida nas ligações entre servidores")
+    parser.add_argument("--troca", metavar="CAMINHO",
+                        help="socket Unix da troca a quente: um processo novo com o mesmo --troca "
+                             "assume as conexões do que está rodando (usa o modo async)")
+    parser.add_argument("--log-nivel", choices=["debug", "info", "aviso", "erro"], default="info",
+                        help="nível mínimo do log (debug inclui cada comando recebido)")
+    parser.add_argument("--log-arquivo", metavar="CAMINHO", help="arquivo de log (padrão: saída padrão)")
+    parser.add_argument("--log-tamanho", type=int, default=10,
+                        help="MiB do arquivo de log antes da rotação")
+    parser.add_argument("--log-copias", type=int, default=3, help="arquivos antigos mantidos na rotação")
+    parser.add_argument("--log-amostra", action="append", default=[], type=sampling_rule, metavar="CATEGORIA=N",
+                        help="registra 1 a cada N eventos da categoria (ex.: comando=100)")
+    parser.add_argument("--log-conteudo", action="store_true",
+                        help="inclui o texto das mensagens no log (padrão: só o tamanho)")
+    args = parser.parse_args()
+    linked = args.link_porta is not None or args.conectar
+    if linked and args.workers > 1:
+        parser.error("--link-porta/--conectar não podem ser usados com --workers")
+    if args.troca and (linked or args.workers > 1):
+        parser.error("--troca não pode ser usado com --workers, --link-porta ou --conectar")
+    if linked or args.troca:
+        args.modo = "async"
+    log.configure(args.log_nivel, args.log_arquivo, args.log_tamanho * 1024 * 1024, args.log_copias,
+                  dict(args.log_amostra),
+                  args.log_conteudo)
+
+    def make_server():
+        server = Servidor(args.porta, args.sendq_soft * 1024, args.sendq_hard * 1024,
+                          args.ping_intervalo, args.ping_timeout)
+        server.opers = dict(oper.split(":", 1) for oper in args.oper)
+        server.metrics_path = args.metricas
+        server.flood_rate, server.flood_burst, server.flood_strikes = args.flood_taxa, args.flood_rajada, args.flood_avisos
+        server.history_limit, server.history_path = args.historico, args.historico_arquivo
+        server.history_join = min(args.historico_join, args.historico)
+        server.name = args.nome
+        server.link_port, server.link_password = args.link_porta, args.link_senha
+        server.link_targets = [(host or "127.0.0.1", int(port)) for host, _, port in
+                               (target.rpartition(":") for target in args.conectar)]
+        server.handoff_path = args.troca
+        if args.perfil:
+            server.metrics.start_profiler()
+        return server
+
+    # Com --workers o processo principal só roda o barramento: cada worker cria o
+    # seu servidor (e o profiler, com --perfil) depois do fork
+    server = None
+    log.info("servidor", "Servidor iniciado. Pressione Ctrl+C para parar.")
     try:
-        while True:
-            pass
+        if args.workers > 1:
+            start_workers(args.workers, make_server)
+        else:
+            server = make_server() # Inicializando classe Servidor
+            if args.modo == "async":
+                server.start_async()
+            else:
+                server.start() # Inicializando servidor
+                server.run_keepalive() # Bloqueia até o servidor ser encerrado
     except KeyboardInterrupt:
-        print("Servidor encerrado.")
+        log.info("servidor", "Servidor encerrado.")
+    if server is not None and server.history is not None:
+        server.history.flush(1) # Grava o que ainda estiver na fila do histórico
+    log.flush()
 
 
 if __name__ == "__main__":
-    main()
+    # Roda pelo módulo importado: barramento.py, ligacao.py e troca.py importam
+    # servidor, e assim todos usam as mesmas classes e constantes (Cliente, Canal,
+    # NO_CHANNELS...) em vez de uma segunda cópia carregada como __main__
+    import servidor
+
+    servidor.main()
@@ -0,0 +1,233 @@
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from collections import deque
+
+from diario import log
+from servidor import Canal, Cliente, irc_lower
+
+# Troca a quente (--troca CAMINHO, modo asyncio). O servidor em execução escuta em
+# um socket Unix no CAMINHO; um processo novo iniciado com o mesmo --troca se
+# conecta a ele e recebe, por SCM_RIGHTS, o socket de escuta e o socket de cada
+# cliente, junto com o estado (nicks, registro, canais, linhas ainda não lidas ou
+# não enviadas e o histórico em memória). Os clientes continuam com a mesma
+# conexão TCP e não percebem a troca.
+#
+# Mensagens (SOCK_SEQPACKET, uma por send):
+#    "F" com até HANDOFF_FDS descritores: o socket de escuta e depois os clientes, em ordem
+#    "S" + pedaço do estado em JSON
+#    "E": fim; o processo novo responde "OK" depois de assumir todas as conexões
+# Sem o "OK" (erro ou prazo esgotado) o processo antigo volta a atender normalmente.
+
+HANDOFF_FDS = 250          # Descritores por mensagem (o kernel aceita até 253)
+HANDOFF_CHUNK = 60 * 1024  # Bytes do estado por mensagem
+HANDOFF_TIMEOUT = 30
+
+
+# Bytes vão para o JSON como texto latin-1 (um caractere por byte)
+def text(data):
+    return bytes(data).decode("latin-1")
+
+
+# Socket Unix que espera o processo novo; só aceita processos do mesmo usuário
+def listen(server, path):
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    sock.bind(path)
+    os.chmod(path, 0o600)
+    sock.listen(1)
+    sock.setblocking(False)
+    server.loop.add_reader(sock.fileno(), accept, server, sock)
+    log.info("troca", "Aguardando troca a quente", caminho=path)
+    return sock
+
+
+def accept(server, sock):
+    try:
+        conn, _ = sock.accept()
+    except BlockingIOError:
+        return
+    pid, uid, _ = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+    if uid != os.getuid():
+        log.warning("troca", "Troca recusada: outro usuário", pid=pid, uid=uid)
+        conn.close()
+        return
+    conn.settimeout(HANDOFF_TIMEOUT)
+    with conn:
+        if handoff(server, conn, pid):
+            server.loop.remove_reader(sock.fileno())
+            sock.close()
+
+
+# Lado do processo antigo. Roda dentro do laço, que fica parado durante a troca:
+# nenhuma conexão é lida, e as novas esperam no backlog do socket de escuta. Os
+# sockets só saem do laço depois do "OK", fora da pausa que os clientes percebem
+def handoff(server, conn, pid):
+    start = time.perf_counter()
+    loop = server.loop
+    listener = server.listen_socket
+    clients = [c for c in list(server.clients) if c.staus_conn and c.quit_reason is None]
+    for client in clients:
+        if client.fila.items:
+            client.fila.flush() # O que couber no socket sai agora; o resto vai no estado
+    if server.history is not None:
+        server.history.flush(HANDOFF_TIMEOUT)
+    try:
+        fds = [listener.fileno()] + [client.conn.fileno() for client in clients]
+        for i in range(0, len(fds), HANDOFF_FDS):
+            socket.send_fds(conn, [b"F"], fds[i:i + HANDOFF_FDS])
+        data = json.dumps(snapshot(server, clients)).encode("utf-8")
+        for i in range(0, len(data), HANDOFF_CHUNK):
+            conn.send(b"S" + data[i:i + HANDOFF_CHUNK])
+        conn.send(b"E")
+        done = conn.recv(16) == b"OK"
+    except OSError as e:
+        log.error("troca", "Erro na troca a quente", pid=pid, erro=e)
+        done = False
+    if not done:
+        log.warning("troca", "Troca cancelada; o servidor continua atendendo", pid=pid)
+        for client in clients:
+            if client.fila.items:
+                server.wake_writer(client.fila)
+        return False
+    # As conexões agora são do processo novo: aqui só os descritores são fechados
+    loop.remove_reader(listener.fileno())
+    for client in clients:
+        loop.remove_reader(client.conn.fileno())
+        loop.remove_writer(client.conn.fileno())
+        client.conn.close()
+    server.clients.clear()
+    log.info("troca", "Conexões entregues", pid=pid, conexoes=len(clients),
+             duracao_ms=round((time.perf_counter() - start) * 1000, 1))
+    server.stop()
+    return True
+
+
+# Estado que o processo novo precisa para continuar de onde o antigo parou
+def snapshot(server, clients):
+    index = {client: i for i, client in enumerate(clients)}
+    # Membros em ordem de entrada (a ordem do NAMES). Canais sem nenhum membro
+    # entregue (só com clientes já sendo derrubados) ficam de fora: no processo
+    # novo seriam canais vazios que nenhum PART removeria
+    channels = []
+    for canal in list(server.channels.values()):
+        members = [index[m] for m in canal.members if m in index]
+        if members:
+            channels.append([canal.name, members])
+    state = {
+        "host": server.host,
+        "clients": [
+            {
+                "addr": list(client.addr) if isinstance(client.addr, tuple) else client.addr,
+                "nick": client.nick,
+                "username": client.username,
+                "realname": client.realname,
+                "registered": client.registered,
+                "ts": client.ts,
+                "oper": client.is_oper,
+                "channel": client.actual_channel,
+                "partial": text(client.framer.partial),
+                "overflow": client.framer.overflow,
+                "pending": list(client.pending or ()),
+                "out": text(b"".join(client.fila.items)),
+            }
+            for client in clients
+        ],
+        "channels": channels,
+        "history": [],
+    }
+    history = server.history
+    if history is not None and history.path is None: # Com disco, o processo novo relê o log
+        with history.lock:
+            state["history"] = [[key, [[stamp, text(line)] for stamp, line in ring]]
+                                for key, ring in history.rings.items()]
+    return state
+
+
+# Lado do processo novo: pede a troca ao servidor em execução. Devolve
+# (conexão, descritores, estado, início), ou None se não houver servidor esperando
+def receive(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    sock.settimeout(HANDOFF_TIMEOUT)
+    start = time.perf_counter()
+    fds = []
+    chunks = []
+    while True:
+        msg, batch, flags, _ = socket.recv_fds(sock, HANDOFF_CHUNK + 1, HANDOFF_FDS)
+        fds += batch
+        if flags & (socket.MSG_CTRUNC | socket.MSG_TRUNC) or not msg:
+            for fd in fds:
+                os.close(fd)
+            sock.close()
+            raise ConnectionError("troca a quente interrompida")
+        if msg[:1] == b"S":
+            chunks.append(msg[1:])
+        elif msg[:1] == b"E":
+            break
+    state = json.loads(b"".join(chunks))
+    log.info("troca", "Estado recebido", conexoes=len(fds) - 1,
+             duracao_ms=round((time.perf_counter() - start) * 1000, 1))
+    return sock, fds, state, start
+
+
+# Recria clientes, nicks e canais no processo novo, põe as conexões no laço e
+# confirma a troca. Devolve o socket de escuta herdado
+def restore(server, sock, fds, state, start):
+    loop = server.loop
+    server.host = state["host"]
+    listener = socket.socket(fileno=fds[0])
+    listener.setblocking(False)
+    family, kind = listener.family, listener.type # As conexões aceitas são do mesmo tipo
+    clients = []
+    for data, fd in zip(state["clients"], fds[1:]):
+        conn = socket.socket(family, kind, 0, fd)
+        conn.setblocking(False)
+        addr = data["addr"]
+        client = Cliente(conn, tuple(addr) if isinstance(addr, list) else addr, server)
+        client.nick = sys.intern(data["nick"]) if data["nick"] is not None else None
+        client.username, client.realname = data["username"], data["realname"]
+        client.registered, client.ts, client.is_oper = data["registered"], data["ts"], data["oper"]
+        client.actual_channel = data["channel"]
+        client.framer.partial = data["partial"].encode("latin-1")
+        client.framer.overflow = data["overflow"]
+        client.staus_conn = True
+        if client.nick is not None:
+            server.nicks[sys.intern(irc_lower(client.nick))] = client
+        server.clients.add(client)
+        server.watch(client)
+        clients.append(client)
+    for name, members in state["channels"]:
+        canal = Canal(name)
+        server.channels[canal.key] = canal
+        for i in members:
+            server.join_channel(clients[i], canal)
+    if server.history is not None:
+        for key, ring in state["history"]:
+            for stamp, line in ring:
+                server.history.store(key, stamp, line.encode("latin-1"))
+    for client, data in zip(clients, state["clients"]):
+        loop.add_reader(client.conn.fileno(), server.read_async, client)
+        if data["out"]:
+            client.send_bytes(data["out"].encode("latin-1"))
+        if data["pending"] and not server.flood_rate:
+            client.process_commands(data["pending"])
+        elif data["pending"]:
+            # Linhas adiadas pelo controle de flood voltam a esperar fichas
+            client.pending = deque(data["pending"])
+            client.pending_cost = 1
+            client.bucket()
+            server.pause_client(client)
+    sock.send(b"OK")
+    sock.close()
+    log.info("troca", "Troca a quente concluída", conexoes=len(clients), canais=len(state["channels"]),
+             duracao_ms=round((time.perf_counter() - start) * 1000, 1))
+    return listener